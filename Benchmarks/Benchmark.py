@@ -0,0 +1,167 @@
+import argparse  # Параметры командной строки
+import json  # Результаты в машиночитаемом виде
+import logging  # Выводим лог на консоль
+import platform  # Версия Python и система
+from datetime import datetime  # Дата и время
+from statistics import median  # Медиана повторов
+from threading import Thread  # Потоки подписок
+from time import perf_counter, sleep  # Замер времени
+
+import grpc
+from google.protobuf import __version__ as protobuf_version
+
+from FinamPy.FinamPy import Event  # Событие
+from FinamPy.MockServer import MockServer  # Локальный сервер Finam Trade API
+from FinamPy.grpc.assets_service_pb2 import ClockRequest  # Время на сервере
+from FinamPy.grpc.marketdata_service_pb2 import BarsResponse  # История
+
+from Compression import bars_payload  # Синтетическая история
+
+
+def measure(func, number, repeat=5) -> dict:
+    """Время одной операции в наносекундах: медиана и лучший из повторов
+
+    :param func: Функция без параметров
+    :param int number: Кол-во вызовов в одном повторе
+    :param int repeat: Кол-во повторов
+    """
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        times.append((perf_counter() - start) / number * 1e9)
+    return {'ns_per_op': round(median(times), 1), 'best_ns_per_op': round(min(times), 1), 'number': number, 'repeat': repeat}
+
+
+def bench_call_function(fp_provider, number) -> dict:
+    """Накладные расходы call_function относительно прямого вызова заглушки
+
+    После прогрева прямой вызов и вызов через call_function замеряются парами, порядок в паре чередуется.
+    Так изменения состояния канала и машины попадают в оба замера. Накладные расходы - медиана разностей в парах
+    """
+    request = ClockRequest()
+    raw = lambda: fp_provider.assets_stub.Clock.with_call(request=request, metadata=(fp_provider.metadata,))
+    wrapped = lambda: fp_provider.call_function(fp_provider.assets_stub.Clock, request)
+    for _ in range(max(10, number // 10)):  # Прогрев: подключение канала, токен JWT
+        raw()
+        wrapped()
+    raw_times, wrapped_times = [], []
+    for i in range(number):
+        for func, times in ((raw, raw_times), (wrapped, wrapped_times)) if i % 2 == 0 else ((wrapped, wrapped_times), (raw, raw_times)):  # Чередуем, что замеряется первым
+            start = perf_counter()
+            func()
+            times.append((perf_counter() - start) * 1e9)
+    overhead = [w - r for w, r in zip(wrapped_times, raw_times)]  # Разность в каждой паре
+    return {'call_function.Clock': {'ns_per_op': round(median(wrapped_times), 1), 'best_ns_per_op': round(min(wrapped_times), 1), 'number': number, 'repeat': 1},
+            'stub.Clock': {'ns_per_op': round(median(raw_times), 1), 'best_ns_per_op': round(min(raw_times), 1), 'number': number, 'repeat': 1},
+            'call_function.overhead': {'ns_per_op': round(median(overhead), 1)}}
+
+
+def bench_event(number) -> dict:
+    """Вызов события с разным кол-вом подписчиков"""
+    results = {}
+    for callbacks in (1, 10, 100):
+        event = Event()
+        for _ in range(callbacks):
+            event.subscribe(lambda *args: None)  # Каждая лямбда - отдельный подписчик
+        results[f'Event.trigger.{callbacks}'] = measure(lambda: event.trigger(1, 2), max(1, number // callbacks))
+    return results
+
+
+def bench_conversions(fp_provider, number) -> dict:
+    """Функции конвертации цен, времени, тикеров"""
+    fp_provider.get_symbol_info('SBER', 'MISX')  # Заполняем справочник тикеров
+    fp_provider.get_symbol_info('SiZ6', 'RTSX')
+    fp_provider.dataname_to_finam_board_ticker('SBER')  # Заполняем справочник инструментов
+    fp_provider.get_mic('TQBR', 'SBER')  # Заполняем список бирж
+    dt = datetime(2026, 1, 15, 10, 30)
+    return {
+        'price_to_finam_price.TQBR': measure(lambda: fp_provider.price_to_finam_price('SBER', 'MISX', 301.23), number),
+        'finam_price_to_price.TQBR': measure(lambda: fp_provider.finam_price_to_price('SBER', 'MISX', 301.23), number),
+        'price_to_finam_price.FUT': measure(lambda: fp_provider.price_to_finam_price('SiZ6', 'RTSX', 95001), number),
+        'msk_datetime_to_timestamp': measure(lambda: fp_provider.msk_datetime_to_timestamp(dt), number),
+        'timestamp_to_msk_datetime': measure(lambda: fp_provider.timestamp_to_msk_datetime(1768462200), number),
+        'msk_to_utc_datetime': measure(lambda: fp_provider.msk_to_utc_datetime(dt), number),
+        'utc_to_msk_datetime': measure(lambda: fp_provider.utc_to_msk_datetime(dt), number),
+        'dataname_to_finam_board_ticker.board': measure(lambda: fp_provider.dataname_to_finam_board_ticker('TQBR.SBER'), number),
+        'dataname_to_finam_board_ticker.lookup': measure(lambda: fp_provider.dataname_to_finam_board_ticker('SBER'), max(1, number // 100)),
+        'get_mic': measure(lambda: fp_provider.get_mic('TQBR', 'SBER'), number),
+    }
+
+
+def bench_bars_decode(number) -> dict:
+    """Разбор ответа с историей"""
+    payload = bars_payload(5000)
+    return {'BarsResponse.FromString.5000': {**measure(lambda: BarsResponse.FromString(payload), number), 'bytes': len(payload)}}
+
+
+def bench_streams(mock_server, seconds) -> dict:
+    """Пропускная способность подписок через локальный сервер с максимальной частотой событий"""
+    results = {}
+    for name, target, args, event_name in (('SubscribeQuote', 'subscribe_quote_thread', (('SBER@MISX',),), 'on_quote'),
+                                            ('SubscribeOrderBook', 'subscribe_order_book_thread', ('SBER@MISX',), 'on_order_book'),
+                                            ('SubscribeLatestTrades', 'subscribe_latest_trades_thread', ('SBER@MISX',), 'on_latest_trades')):
+        fp_provider = mock_server.connect()  # Отдельное подключение на каждую подписку
+        received = [0]  # Кол-во событий
+
+        def on_event(*_):
+            received[0] += 1
+
+        getattr(fp_provider, event_name).subscribe(on_event)
+        thread = Thread(target=getattr(fp_provider, target), args=args, daemon=True)
+        thread.start()
+        sleep(0.5)  # Ждем установления подписки
+        start_count, start = received[0], perf_counter()
+        sleep(seconds)
+        count, elapsed = received[0] - start_count, perf_counter() - start
+        fp_provider.close_channel()
+        thread.join(5)
+        results[f'stream.{name}'] = {'messages_per_sec': round(count / elapsed, 1), 'messages': count, 'seconds': round(elapsed, 3)}
+    return results
+
+
+def compare(results, baseline_file) -> None:
+    """Сравнение с результатами предыдущего запуска"""
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key in ('ns_per_op', 'messages_per_sec'):
+            if key in result and key in baseline[name] and baseline[name][key]:
+                logger.info(f'{name:<45}{baseline[name][key]:>14.1f}{result[key]:>14.1f}{result[key] / baseline[name][key]:>8.2f}x  {key}')
+
+
+if __name__ == '__main__':  # Точка входа при запуске этого скрипта
+    logger = logging.getLogger('FinamPy.Benchmarks')  # Будем вести лог
+    logging.basicConfig(format='%(message)s', level=logging.INFO)  # Выводим только результаты
+
+    parser = argparse.ArgumentParser(description='Замеры производительности FinamPy без подключения к Финаму')
+    parser.add_argument('--output', help='Файл JSON для результатов. По умолчанию, вывод на консоль')
+    parser.add_argument('--compare', help='Файл JSON с результатами предыдущего запуска для сравнения')
+    parser.add_argument('--quick', action='store_true', help='Быстрый запуск с меньшим кол-вом повторов')
+    options = parser.parse_args()
+    number = 1_000 if options.quick else 10_000  # Кол-во вызовов в одном повторе
+    seconds = 1 if options.quick else 3  # Длительность замера подписок
+
+    results = {}
+    with MockServer(message_rate=0) as mock:  # Подписки с максимальной частотой событий
+        fp = mock.connect()
+        results.update(bench_call_function(fp, max(1, number // 10)))
+        results.update(bench_conversions(fp, number))
+        fp.close_channel()
+        results.update(bench_event(number))
+        results.update(bench_bars_decode(max(1, number // 100)))
+        results.update(bench_streams(mock, seconds))
+
+    report = {'timestamp': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'platform': platform.platform(), 'grpc': grpc.__version__, 'protobuf': protobuf_version,
+              'results': results}
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    else:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    if options.compare:
+        compare(results, options.compare)
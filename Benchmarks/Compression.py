@@ -0,0 +1,123 @@
+import logging  # Выводим лог на консоль
+import socket  # Прокси между каналом и сервером
+from statistics import median  # Медиана повторов
+from threading import Thread, Lock  # Потоки прокси
+from time import time, perf_counter  # Замер времени
+
+import grpc
+from google.protobuf.timestamp_pb2 import Timestamp
+from google.type.decimal_pb2 import Decimal
+from google.type.interval_pb2 import Interval
+
+from FinamPy.FinamPy import FinamPy, ChannelProfile  # Провайдер, профиль канала
+from FinamPy.MockServer import MockServer  # Локальный сервер Finam Trade API
+from FinamPy.grpc.assets_service_pb2 import AssetsRequest  # Справочник инструментов
+from FinamPy.grpc.marketdata_service_pb2 import BarsRequest, BarsResponse, Bar, TimeFrame  # История
+
+
+def bars_payload(count=5000) -> bytes:
+    """Минутные бары, похожие на ответ MarketDataService.Bars"""
+    price = 300.0  # Начальная цена
+    bars = []
+    for i in range(count):
+        price += ((i * 7919) % 21 - 10) / 100  # Детерминированное блуждание цены
+        bars.append(Bar(timestamp=Timestamp(seconds=1700000000 + i * 60),
+                        open=Decimal(value=f'{price:.2f}'), high=Decimal(value=f'{price + 0.15:.2f}'), low=Decimal(value=f'{price - 0.12:.2f}'), close=Decimal(value=f'{price + 0.03:.2f}'),
+                        volume=Decimal(value=str(1000 + (i * 31) % 5000))))
+    return BarsResponse(symbol='SBER@MISX', bars=bars).SerializeToString()
+
+
+class CountingProxy:
+    """TCP прокси между каналом и сервером. Считает байты в канале в обе стороны: сообщения вместе с кадрами и заголовками HTTP/2"""
+    def __init__(self, target_port):
+        self.target_port = target_port  # Порт сервера
+        self.listener = socket.create_server(('127.0.0.1', 0))  # Любой свободный порт
+        self.sent = 0  # Байт от канала к серверу
+        self.received = 0  # Байт от сервера к каналу
+        self.lock = Lock()  # Счетчики изменяются из потоков пересылки
+        Thread(target=self.accept_thread, name='ProxyAcceptThread', daemon=True).start()
+
+    @property
+    def address(self) -> str:
+        """Адрес прокси для канала"""
+        return f'127.0.0.1:{self.listener.getsockname()[1]}'
+
+    def accept_thread(self) -> None:
+        """Подключения канала"""
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:  # Прокси закрыт
+                return
+            server = socket.create_connection(('127.0.0.1', self.target_port))
+            Thread(target=self.relay_thread, args=(client, server, True), daemon=True).start()
+            Thread(target=self.relay_thread, args=(server, client, False), daemon=True).start()
+
+    def relay_thread(self, source, destination, to_server) -> None:
+        """Пересылка байт в одну сторону"""
+        try:
+            while data := source.recv(65536):
+                with self.lock:
+                    if to_server:
+                        self.sent += len(data)
+                    else:
+                        self.received += len(data)
+                destination.sendall(data)
+        except OSError:  # Соединение закрыто
+            pass
+        finally:
+            for s in (source, destination):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def reset(self) -> tuple[int, int]:
+        """Байт в обе стороны с прошлого сброса"""
+        with self.lock:
+            counts = (self.sent, self.received)
+            self.sent = self.received = 0
+        return counts
+
+    def close(self) -> None:
+        self.listener.close()
+
+
+def measure_call(fp_provider, proxy, func, request, repeat) -> tuple[float, float, float, int]:
+    """Медианы байт к серверу, байт от сервера, времени вызова в миллисекундах и размер ответа без сжатия"""
+    response = fp_provider.call_function(func, request)  # Прогрев: подключение канала, токен JWT
+    proxy.reset()
+    sent, received, times = [], [], []
+    for _ in range(repeat):
+        start = perf_counter()
+        fp_provider.call_function(func, request)
+        times.append((perf_counter() - start) * 1000)
+        bytes_sent, bytes_received = proxy.reset()
+        sent.append(bytes_sent)
+        received.append(bytes_received)
+    return median(sent), median(received), median(times), response.ByteSize()
+
+
+if __name__ == '__main__':  # Точка входа при запуске этого скрипта
+    logger = logging.getLogger('FinamPy.Benchmarks.Compression')  # Будем вести лог
+    logging.basicConfig(format='%(message)s', level=logging.INFO)  # Выводим только результаты
+
+    repeat = 10  # Кол-во повторов вызова
+    profiles = {'none': ChannelProfile(), 'gzip': ChannelProfile(compression='gzip'), 'deflate': ChannelProfile(compression='deflate'),
+                'Bars:gzip': ChannelProfile(call_compression={'Bars': 'gzip'})}  # Профили канала
+    now = int(time())
+    calls = (('Assets', lambda fp: fp.assets_stub.Assets, AssetsRequest()),
+             ('Bars', lambda fp: fp.marketdata_stub.Bars, BarsRequest(symbol='SBER@MISX', timeframe=TimeFrame.TIME_FRAME_M1,
+                                                                       interval=Interval(start_time=Timestamp(seconds=now - 5 * 24 * 60 * 60), end_time=Timestamp(seconds=now)))))  # Вызовы с большими ответами
+    logger.info(f'{"Сервер":<9}{"Канал":<11}{"Функция":<9}{"Сообщение":>11}{"К серверу":>11}{"От сервера":>12}{"%":>7}{"мс":>9}')
+    for server_compression in (None, 'gzip', 'deflate'):  # Сжатие ответов сервером
+        with MockServer(extra_instruments=30000, compression=server_compression) as mock_server:
+            for name, profile in profiles.items():
+                proxy = CountingProxy(mock_server.port)
+                fp_provider = FinamPy('mock-access-token', channel_profile=profile,
+                                      channel=grpc.insecure_channel(proxy.address, options=profile.options(), compression=profile.get_compression()))
+                for func_name, func, request in calls:
+                    sent, received, ms, size = measure_call(fp_provider, proxy, func(fp_provider), request, repeat)
+                    logger.info(f'{server_compression or "none":<9}{name:<11}{func_name:<9}{size:>11}{sent:>11.0f}{received:>12.0f}{received / size * 100:>7.1f}{ms:>9.2f}')
+                fp_provider.close_channel()
+                proxy.close()
@@ -0,0 +1,44 @@
+import logging  # Выводим лог на консоль
+from timeit import repeat  # Замер времени
+
+from FinamPy.FinamPy import Event  # Событие
+
+
+class SetEvent:
+    """Прежняя реализация события для сравнения: подписчики в set, при каждом вызове копируются в список"""
+    def __init__(self):
+        self._callbacks = set()
+
+    def subscribe(self, callback) -> None:
+        self._callbacks.add(callback)
+
+    def trigger(self, *args, **kwargs) -> None:
+        for callback in list(self._callbacks):
+            callback(*args, **kwargs)
+
+
+def trigger_ns(event, number) -> float:
+    """Лучшее время вызова события в наносекундах"""
+    return min(repeat(lambda: event.trigger(1, 2), number=number, repeat=5)) / number * 1e9
+
+
+def make(event_class, callbacks, **kwargs):
+    """Событие с заданным кол-вом подписчиков"""
+    event = event_class(**kwargs)
+    for _ in range(callbacks):
+        event.subscribe(lambda *args: None)  # Каждая лямбда - отдельный подписчик
+    return event
+
+
+if __name__ == '__main__':  # Точка входа при запуске этого скрипта
+    logger = logging.getLogger('FinamPy.Benchmarks')  # Будем вести лог
+    logging.basicConfig(format='%(message)s', level=logging.INFO)  # Выводим только результаты
+
+    number = 200_000  # Кол-во вызовов в одном повторе
+    logger.info(f'{"Подписчиков":>12}{"set, нс":>12}{"кортеж, нс":>12}{"ускорение":>11}{"с перехватом, нс":>18}')
+    for callbacks in (0, 1, 3, 10, 100):
+        n = max(1000, number // max(1, callbacks))
+        old = trigger_ns(make(SetEvent, callbacks), n)
+        new = trigger_ns(make(Event, callbacks), n)
+        isolated = trigger_ns(make(Event, callbacks, isolate=True), n)
+        logger.info(f'{callbacks:>12}{old:>12.1f}{new:>12.1f}{old / new:>10.2f}x{isolated:>18.1f}')
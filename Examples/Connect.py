@@ -2,25 +2,19 @@ import logging  # Выводим лог на консоль и в файл
 from datetime import datetime  # Дата и время
 from threading import Thread  # Запускаем поток подписки
 
-from FinamPy import FinamPy
+from FinamPy import FinamPy, ClockSync, BarBuilder
 from FinamPy.grpc.assets_service_pb2 import ClockRequest, ClockResponse  # Время на сервере
-from FinamPy.grpc.marketdata_service_pb2 import TimeFrame, SubscribeBarsResponse, Bar  # Временной интервал Финама, подписка на минутные бары тикера
+from FinamPy.grpc.marketdata_service_pb2 import TimeFrame, Bar  # Временной интервал Финама, бар
 
 
-def on_new_bar(bars: SubscribeBarsResponse, finam_timeframe: TimeFrame.ValueType):  # Обработчик события прихода нового бара
-    global last_bar, dt_last_bar  # Последний полученный бар и его дата/время
-    timeframe, _, _ = fp_provider.finam_timeframe_to_timeframe(finam_timeframe)  # Временной интервал пришедших баров
-    for bar in bars.bars:  # Пробегаемся по всем полученным барам
-        dt_bar = datetime.fromtimestamp(bar.timestamp.seconds, fp_provider.tz_msk)  # Дата/время полученного бара
-        if dt_last_bar is not None and dt_last_bar < dt_bar:  # Если время бара стало больше (предыдущий бар закрыт, новый бар открыт)
-            logger.info(f'{dt_last_bar:%d.%m.%Y %H:%M:%S} '
-                        f'O:{last_bar.open.value} '
-                        f'H:{last_bar.high.value} '
-                        f'L:{last_bar.low.value} '
-                        f'C:{last_bar.close.value} '
-                        f'V:{int(float(last_bar.volume.value))}')
-        last_bar = bar  # Запоминаем бар
-        dt_last_bar = dt_bar  # Запоминаем дату и время бара
+def on_bar_closed(symbol: str, finam_timeframe: TimeFrame.ValueType, bar: Bar):  # Обработчик события закрытия бара
+    dt_bar = datetime.fromtimestamp(bar.timestamp.seconds, fp_provider.tz_msk)  # Дата/время закрытого бара
+    logger.info(f'{symbol} {dt_bar:%d.%m.%Y %H:%M:%S} '
+                f'O:{bar.open.value} '
+                f'H:{bar.high.value} '
+                f'L:{bar.low.value} '
+                f'C:{bar.close.value} '
+                f'V:{int(float(bar.volume.value))}')
 
 
 if __name__ == '__main__':  # Точка входа при запуске этого скрипта
@@ -42,21 +36,23 @@ if __name__ == '__main__':  # Точка входа при запуске это
     logger.info(f'Локальное время МСК : {dt_local:%d.%m.%Y %H:%M:%S}')
     logger.info(f'Время на сервере    : {dt_server:%d.%m.%Y %H:%M:%S}')
     logger.info(f'Разница во времени  : {td}')
+    clock_sync = ClockSync(fp_provider)  # Синхронизация с часами сервера
+    if clock_sync.sync():  # Оцениваем смещение по нескольким запросам с учетом времени их прохождения
+        logger.info(f'Смещение часов      : {clock_sync.offset * 1000:.1f} мс, RTT {clock_sync.rtt * 1000:.1f} мс')
 
     # Проверяем работу подписок
     dataname = 'TQBR.SBER'  # Тикер
     tf = 'M1'  # Временной интервал
 
     logger.info(f'Подписка на {tf} бары тикера {dataname}')
-    fp_provider.on_new_bar.subscribe(on_new_bar)  # Обработчик события прихода нового бара
+    bar_builder = BarBuilder(fp_provider).start()  # Отслеживаем формирующийся бар по событиям прихода нового бара
+    bar_builder.on_bar_closed.subscribe(on_bar_closed)  # Обработчик события закрытия бара
     finam_board, ticker = fp_provider.dataname_to_finam_board_ticker(dataname)  # Код режима торгов Финама и тикер
     mic = fp_provider.get_mic(finam_board, ticker)  # Биржа тикера
     finam_tf, _, _ = fp_provider.timeframe_to_finam_timeframe(tf)  # Временной интервал Финам
-    last_bar: Bar  # Последнего полученного бара пока нет
-    dt_last_bar = None  # И даты/времени у него пока нет
     Thread(target=fp_provider.subscribe_bars_thread, name='BarsThread', args=(f'{ticker}@{mic}', finam_tf)).start()  # Создаем и запускаем поток подписки на новые бары
 
     # Выход
     input('Enter - выход\n')
-    fp_provider.on_new_bar.unsubscribe(on_new_bar)  # Отменяем подписку на новые бары
+    bar_builder.stop()  # Отменяем подписку на новые бары
     fp_provider.close_channel()  # Закрываем канал перед выходом
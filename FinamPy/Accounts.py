@@ -0,0 +1,407 @@
+import logging  # Будем вести лог
+from collections import deque  # Очередь частей периода, время запросов
+from datetime import datetime  # Дата и время
+from itertools import islice  # Первые незагруженные части периода
+from threading import Thread, RLock  # Загрузка спецификаций вне потока подписки, счет обновляется из разных потоков подписок
+from time import time, monotonic, sleep  # Время получения состояния счета, соблюдение ограничения запросов в минуту
+from typing import Optional, Iterator
+
+from google.protobuf.timestamp_pb2 import Timestamp
+from google.type.interval_pb2 import Interval
+
+from FinamPy.ClockSync import ClockSync  # Время состояния счета по часам сервера
+from FinamPy.FinamPy import Event  # Событие изменения счета
+from FinamPy.grpc import accounts_service_pb2 as accounts_service  # Счета
+from FinamPy.grpc.side_pb2 import SIDE_BUY  # Направление сделки
+from FinamPy.grpc.trade_pb2 import AccountTrade  # Свои сделки
+
+try:
+    import numpy as np  # Выгрузка истории счета в массивы. pip install FinamPy[numpy]
+except ImportError:  # Без numpy история счета загружается без выгрузки в массивы
+    np = None
+
+if np is not None:
+    account_trade_dtype = np.dtype([('timestamp', 'f8'), ('symbol', 'U32'), ('side', 'i1'), ('price', 'f8'), ('size', 'f8'),
+                                    ('trade_id', 'U32'), ('order_id', 'U32')])  # Своя сделка: время в секундах UTC, символ, сторона Финама, цена, кол-во в штуках
+    transaction_dtype = np.dtype([('timestamp', 'f8'), ('symbol', 'U32'), ('category', 'i2'), ('change', 'f8'), ('currency', 'U3'), ('change_qty', 'f8'),
+                                  ('price', 'f8'), ('size', 'f8'), ('id', 'U32')])  # Транзакция: время в секундах UTC, символ, категория, изменение денег и позиции, цена и кол-во сделки
+
+
+class PositionState:
+    """Позиция по инструменту"""
+    def __init__(self, symbol, quantity=0.0, average_price=0.0, current_price=0.0, unrealized_pnl=0.0):
+        self.symbol = symbol  # Символ инструмента тикер@биржа
+        self.quantity = quantity  # Кол-во в штуках со знаком: больше 0 - длинная позиция, меньше 0 - короткая
+        self.average_price = average_price  # Средняя цена
+        self.current_price = current_price  # Текущая цена
+        self.unrealized_pnl = unrealized_pnl  # Нереализованная прибыль
+
+
+class AccountState:
+    """Состояние счета"""
+    def __init__(self, account_id):
+        self.account_id = account_id  # Номер счета
+        self.positions: dict[str, PositionState] = {}  # Позиции по символу инструмента
+        self.cash: dict[str, float] = {}  # Свободные средства по коду валюты
+        self.equity = 0.0  # Оценка счета: свободные средства плюс стоимость позиций
+        self.unrealized_profit = 0.0  # Нереализованная прибыль
+        self.snapshot_time = 0.0  # Время последнего состояния счета по часам сервера. 0 - еще не получено
+        self.fills: list[tuple[AccountTrade, Optional[tuple[str, float]]]] = []  # Сделки после последнего состояния счета и изменение свободных средств по ним (валюта, сумма)
+
+    @property
+    def fills_since_snapshot(self) -> int:
+        """Кол-во сделок, учтенных после последнего состояния счета"""
+        return len(self.fills)
+
+
+class AccountCache:
+    """Позиции, свободные средства и оценка счетов в памяти. Заполняется из GetAccount, обновляется подпиской SubscribeAccount и своими сделками
+
+    Позиции, свободные средства и оценка читаются без запросов к серверу, например, для проверки рисков перед выставлением заявки.
+    Состояние счета с сервера заменяет все данные по счету. Между состояниями счета позиции и свободные средства изменяются своими сделками.
+    Время сделок сравнивается со временем состояния счета по часам сервера (ClockSync), поэтому расхождение локальных часов не влияет на учет.
+    Сделки не позже состояния счета уже учтены в нем и пропускаются. Сделки позже него, пришедшие раньше самого состояния, учитываются в нем повторно.
+    Свободные средства по сделке изменяются только для акций и фондов, где стоимость - цена, умноженная на кол-во, в валюте котировки инструмента.
+    По фьючерсам (вариационная маржа, гарантийное обеспечение), облигациям (% от номинала, НКД) и остальным инструментам, а также комиссия
+    учитываются со следующим состоянием счета.
+    Спецификации инструментов позиций загружаются при start(), остальных - заранее через preload(). В потоке подписки запросов к серверу нет:
+    если спецификация еще не загружена, то она загружается в отдельном потоке, а свободные средства по сделке учитываются со следующим состоянием счета
+    """
+    logger = logging.getLogger('FinamPy.Accounts')  # Будем вести лог
+    cash_types = ('EQUITIES', 'FUNDS')  # Типы инструментов, по сделкам которых изменяются свободные средства
+
+    def __init__(self, fp_provider, account_ids=None, clock_sync=None):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param list[str] account_ids: Номера счетов. По умолчанию, все счета провайдера
+        :param ClockSync clock_sync: Синхронизация с часами сервера. По умолчанию, провайдера, а если ее нет, то своя, выполняемая при start()
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.clock_sync = clock_sync or fp_provider.clock_sync or ClockSync(fp_provider)  # Часы сервера
+        self.account_ids = list(fp_provider.account_ids if account_ids is None else account_ids)  # Номера счетов
+        self.accounts: dict[str, AccountState] = {account_id: AccountState(account_id) for account_id in self.account_ids}  # Состояние по номеру счета
+        self.trade_ids: set[str] = set()  # Номера учтенных сделок, чтобы не учитывать сделку дважды
+        self.loading: set[tuple[str, str]] = set()  # Тикеры и биржи, спецификации которых загружаются в отдельном потоке
+        self.lock = RLock()  # Блокировка изменения счетов
+        self.on_update = Event()  # Изменение счета (AccountState)
+
+    def start(self) -> 'AccountCache':
+        """Загрузка счетов и начало обновления по событиям провайдера. Потоки подписок запускаются отдельно"""
+        if self.clock_sync.rtt is None and not self.clock_sync.sync():  # Если синхронизации с часами сервера еще не было, и она не удалась
+            self.logger.warning('Нет синхронизации с часами сервера. Сделки сравниваются с состоянием счета по локальным часам')
+        self.fp_provider.on_account.subscribe(self.update)
+        self.fp_provider.on_trade.subscribe(self.add_trade)
+        self.load()
+        missing = self.preload({symbol for state in self.accounts.values() for symbol in state.positions})  # Спецификации инструментов позиций
+        if missing:
+            self.logger.warning('Не найдены спецификации инструментов позиций %s', missing)
+        return self
+
+    def stop(self) -> None:
+        """Остановка обновления"""
+        self.fp_provider.on_account.unsubscribe(self.update)
+        self.fp_provider.on_trade.unsubscribe(self.add_trade)
+
+    def preload(self, symbols) -> list[str]:
+        """Загрузка спецификаций инструментов заранее, чтобы сделки по ним учитывались в свободных средствах без запросов к серверу
+
+        :param list[str] symbols: Символы инструментов тикер@биржа
+        :return: Символы инструментов, спецификации которых не найдены
+        """
+        return [symbol for symbol in symbols if self.fp_provider.get_symbol_info(*symbol.rsplit('@', 1)) is None]
+
+    def load(self) -> None:
+        """Загрузка состояния всех счетов с сервера GetAccount"""
+        for account_id in self.account_ids:
+            sent = time()  # Локальное время отправки запроса
+            account: accounts_service.GetAccountResponse = self.fp_provider.call_function(self.fp_provider.accounts_stub.GetAccount, accounts_service.GetAccountRequest(account_id=account_id))
+            if account is not None:  # Если состояние счета получено
+                self.update(account, self.clock_sync.to_server_time((sent + time()) / 2))  # Состояние сформировано сервером примерно в середине запроса
+
+    def update(self, account: accounts_service.GetAccountResponse, as_of=None) -> None:
+        """Состояние счета с сервера
+
+        :param account: Состояние счета
+        :param float as_of: Время состояния по часам сервера. None - получено из подписки сейчас, сформировано на половину RTT раньше
+        """
+        if as_of is None:
+            as_of = self.clock_sync.now() - (self.clock_sync.rtt or 0.0) / 2
+        if account.account_id not in self.accounts:  # Если счет не отслеживается
+            return  # то его пропускаем
+        state = AccountState(account.account_id)  # Новое состояние счета собираем вне блокировки
+        for position in account.positions:
+            state.positions[position.symbol] = PositionState(
+                position.symbol, self.decimal(position.quantity), self.decimal(position.average_price),
+                self.decimal(position.current_price), self.decimal(position.unrealized_pnl))
+        for money in account.cash:
+            state.cash[money.currency_code] = state.cash.get(money.currency_code, 0.0) + money.units + money.nanos / 1e9
+        state.equity = self.decimal(account.equity)
+        state.unrealized_profit = self.decimal(account.unrealized_profit)
+        state.snapshot_time = as_of
+        with self.lock:
+            previous = self.accounts[account.account_id]
+            for trade, cash_change in previous.fills:  # Сделки позже нового состояния, пришедшие раньше него
+                if self.trade_time(trade) > as_of:
+                    self.apply(state, trade, cash_change)  # учитываем в нем повторно
+            self.accounts[account.account_id] = state  # Заменяем состояние целиком. Читатели видят либо старое, либо новое
+        self.on_update.trigger(state)
+
+    def add_trade(self, trade: AccountTrade) -> None:
+        """Своя сделка. Изменяет позицию и свободные средства до следующего состояния счета"""
+        if trade.account_id not in self.accounts or trade.trade_id in self.trade_ids:  # Если счет не отслеживается или сделка уже учтена
+            return  # то сделку пропускаем
+        cash_change = self.cash_change(trade)  # Изменение свободных средств вычисляем вне блокировки
+        with self.lock:
+            if trade.trade_id in self.trade_ids:  # Если сделку уже учли из другого потока
+                return
+            self.trade_ids.add(trade.trade_id)
+            state = self.accounts[trade.account_id]
+            if self.trade_time(trade) <= state.snapshot_time:  # Если сделка была не позже состояния счета
+                return  # то она в нем уже учтена
+            self.apply(state, trade, cash_change)
+        self.on_update.trigger(state)
+
+    @staticmethod
+    def trade_time(trade: AccountTrade) -> float:
+        """Время сделки по часам сервера"""
+        return trade.timestamp.seconds + trade.timestamp.nanos / 1e9
+
+    def cash_change(self, trade: AccountTrade) -> Optional[tuple[str, float]]:
+        """Изменение свободных средств по сделке: валюта, сумма. None - не изменяются до следующего состояния счета"""
+        ticker, _, mic = trade.symbol.rpartition('@')
+        si = self.fp_provider.symbols.get((ticker, mic))  # Спецификация инструмента из справочника. Запрос к серверу задержал бы поток подписки
+        if si is None and (ticker, mic) not in self.loading:  # Если спецификация не загружена и не загружается
+            self.loading.add((ticker, mic))
+            Thread(target=self.load_symbol_info, args=(ticker, mic), name='AccountsSymbolInfoThread', daemon=True).start()  # то загружаем ее для следующих сделок
+        if si is None or si.type not in self.cash_types or not si.quote_currency:  # Если стоимость сделки не равна цене, умноженной на кол-во
+            return None
+        amount = self.decimal(trade.size) * self.decimal(trade.price)  # Стоимость сделки
+        return si.quote_currency, -amount if trade.side == SIDE_BUY else amount  # Покупка уменьшает свободные средства, продажа увеличивает
+
+    def load_symbol_info(self, ticker, mic) -> None:
+        """Загрузка спецификации инструмента вне потока подписки"""
+        if self.fp_provider.get_symbol_info(ticker, mic) is None:
+            self.logger.warning('Не найдена спецификация %s@%s. Свободные средства по сделкам учитываются со следующим состоянием счета', ticker, mic)
+        self.loading.discard((ticker, mic))
+
+    def apply(self, state, trade: AccountTrade, cash_change) -> None:
+        """Учет сделки в состоянии счета. Вызывается под блокировкой"""
+        size = self.decimal(trade.size) * (1 if trade.side == SIDE_BUY else -1)  # Кол-во со знаком
+        price = self.decimal(trade.price)
+        position = state.positions.get(trade.symbol)
+        if position is None:  # Если позиции по инструменту не было
+            position = state.positions[trade.symbol] = PositionState(trade.symbol, current_price=price)
+        quantity = position.quantity + size  # Новое кол-во
+        if quantity == 0:  # Если позиция закрыта
+            del state.positions[trade.symbol]
+        else:
+            if position.quantity == 0 or (position.quantity > 0) != (quantity > 0):  # Если позиция открыта или перевернута
+                position.average_price = price  # то средняя цена - цена сделки
+            elif abs(quantity) > abs(position.quantity):  # Если позиция увеличена
+                position.average_price = (position.average_price * position.quantity + price * size) / quantity
+            position.quantity = quantity  # При уменьшении позиции средняя цена не изменяется
+            position.current_price = price
+        if cash_change is not None and cash_change[0] in state.cash:  # Если свободные средства в валюте сделки известны
+            state.cash[cash_change[0]] += cash_change[1]
+        state.fills.append((trade, cash_change))
+
+    @staticmethod
+    def decimal(value) -> float:
+        """Значение google.type.Decimal"""
+        return float(value.value) if value.value else 0.0
+
+    def get_account(self, account_id) -> Optional[AccountState]:
+        """Состояние счета"""
+        return self.accounts.get(account_id)
+
+    def get_position(self, account_id, symbol) -> float:
+        """Кол-во в позиции со знаком. 0 - позиции нет"""
+        state = self.accounts.get(account_id)
+        position = None if state is None else state.positions.get(symbol)
+        return 0.0 if position is None else position.quantity
+
+    def get_cash(self, account_id, currency='RUB') -> float:
+        """Свободные средства в валюте"""
+        state = self.accounts.get(account_id)
+        return 0.0 if state is None else state.cash.get(currency, 0.0)
+
+    def get_equity(self, account_id) -> float:
+        """Оценка счета"""
+        state = self.accounts.get(account_id)
+        return 0.0 if state is None else state.equity
+
+    def get_unrealized_profit(self, account_id) -> float:
+        """Нереализованная прибыль по счету"""
+        state = self.accounts.get(account_id)
+        return 0.0 if state is None else state.unrealized_profit
+
+
+class AccountHistoryError(ConnectionError):
+    """Часть периода истории счета не загружена"""
+    def __init__(self, start_dt, end_dt, ex=None):
+        """Инициализация
+
+        :param datetime start_dt: Московское время начала незагруженной части. С него загрузку можно продолжить
+        :param datetime end_dt: Московское время окончания незагруженной части
+        :param RpcError ex: Ошибка запроса
+        """
+        self.start_dt = start_dt  # Начало незагруженной части
+        self.end_dt = end_dt  # Окончание незагруженной части
+        self.ex = ex  # Ошибка запроса
+        super().__init__(f'Часть периода {start_dt} - {end_dt} не загружена: {"нет ответа" if ex is None else ex.details()}')
+
+
+class AccountHistory:
+    """История своих сделок AccountsService.Trades и транзакций AccountsService.Transactions за любой период
+
+    Период делится на части, которые загружаются одновременно, не больше window запросов сразу и requests_per_minute в минуту.
+    Если в ответе на часть ровно limit записей (ответ мог быть обрезан), то часть делится пополам и загружается снова.
+    Записи на границах частей не повторяются. Записи выдаются по возрастанию времени по мере загрузки.
+    Если часть не загружена, то выдача прерывается AccountHistoryError с границами этой части. Записи до нее уже выданы
+    """
+    logger = logging.getLogger('FinamPy.AccountHistory')  # Будем вести лог
+    min_slice = 0.001  # Минимальная часть периода в секундах. Меньше не делим
+
+    def __init__(self, fp_provider, slice_seconds=24 * 60 * 60, limit=1000, window=4, requests_per_minute=180):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param float slice_seconds: Размер части периода в секундах
+        :param int limit: Макс. кол-во записей в ответе на запрос
+        :param int window: Макс. кол-во одновременных запросов
+        :param int requests_per_minute: Макс. кол-во запросов в минуту
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.slice_seconds = slice_seconds  # Размер части периода
+        self.limit = limit  # Макс. кол-во записей в ответе
+        self.window = window  # Макс. кол-во одновременных запросов
+        self.requests_per_minute = requests_per_minute  # Макс. кол-во запросов в минуту
+        self.request_times: deque[float] = deque()  # Время запросов за последнюю минуту
+
+    def iter_trades(self, account_id, start_dt, end_dt=None) -> Iterator:
+        """Свои сделки за период по возрастанию времени
+
+        :param str account_id: Номер счета
+        :param datetime start_dt: Московское время начала
+        :param datetime end_dt: Московское время окончания. None - текущее время
+        :return: Сделки AccountTrade
+        """
+        return self.iter_records(
+            self.fp_provider.accounts_stub.Trades,
+            lambda interval: accounts_service.TradesRequest(account_id=account_id, limit=self.limit, interval=interval),
+            lambda response: response.trades, lambda trade: trade.trade_id, start_dt, end_dt)
+
+    def iter_transactions(self, account_id, start_dt, end_dt=None) -> Iterator:
+        """Транзакции за период по возрастанию времени
+
+        :param str account_id: Номер счета
+        :param datetime start_dt: Московское время начала
+        :param datetime end_dt: Московское время окончания. None - текущее время
+        :return: Транзакции Transaction
+        """
+        return self.iter_records(
+            self.fp_provider.accounts_stub.Transactions,
+            lambda interval: accounts_service.TransactionsRequest(account_id=account_id, limit=self.limit, interval=interval),
+            lambda response: response.transactions, lambda transaction: transaction.id, start_dt, end_dt)
+
+    def get_trades(self, account_id, start_dt, end_dt=None) -> 'np.ndarray':
+        """Свои сделки за период в массиве account_trade_dtype. pip install FinamPy[numpy]"""
+        return self.trades_to_array(self.iter_trades(account_id, start_dt, end_dt))
+
+    def get_transactions(self, account_id, start_dt, end_dt=None) -> 'np.ndarray':
+        """Транзакции за период в массиве transaction_dtype. pip install FinamPy[numpy]"""
+        return self.transactions_to_array(self.iter_transactions(account_id, start_dt, end_dt))
+
+    @staticmethod
+    def timestamp(record) -> float:
+        """Время записи в секундах UTC"""
+        return record.timestamp.seconds + record.timestamp.nanos / 1e9
+
+    @staticmethod
+    def interval(start, end) -> Interval:
+        """Интервал запроса по времени в секундах UTC"""
+        return Interval(start_time=Timestamp(seconds=int(start), nanos=int(round(start % 1 * 1e9)) % 1_000_000_000),
+                        end_time=Timestamp(seconds=int(end), nanos=int(round(end % 1 * 1e9)) % 1_000_000_000))
+
+    def iter_records(self, func, make_request, records_of, id_of, start_dt, end_dt=None) -> Iterator:
+        """Записи за период по частям
+
+        :param func: Функция, например, accounts_stub.Trades
+        :param make_request: Запрос по интервалу части
+        :param records_of: Записи из ответа
+        :param id_of: Уникальный номер записи
+        :param datetime start_dt: Московское время начала
+        :param datetime end_dt: Московское время окончания. None - текущее время
+        :raises AccountHistoryError: Часть периода не загружена
+        """
+        end_dt = datetime.now(self.fp_provider.tz_msk).replace(tzinfo=None) if end_dt is None else end_dt
+        start = float(self.fp_provider.msk_datetime_to_timestamp(start_dt))
+        end = float(self.fp_provider.msk_datetime_to_timestamp(end_dt))
+        pending = deque()  # Части периода по возрастанию времени: начало, окончание, записи (None - не загружены)
+        while start < end:
+            pending.append([start, min(start + self.slice_seconds, end), None])
+            start += self.slice_seconds
+        seen = set()  # Номера выданных записей
+        while pending:
+            to_load = list(islice((part for part in pending if part[2] is None), self.window))  # Первые незагруженные части
+            if to_load:
+                self.pace(len(to_load))
+                results = self.fp_provider.call_functions(func, [make_request(self.interval(part[0], part[1])) for part in to_load], self.window)
+                split = {}  # Части, которые нужно разделить
+                for part, (response, ex) in zip(to_load, results):
+                    if response is None:  # Если при запросе произошла ошибка (записана в лог), то выдавать записи после пропуска нельзя
+                        raise AccountHistoryError(self.fp_provider.timestamp_to_msk_datetime(part[0]), self.fp_provider.timestamp_to_msk_datetime(part[1]), ex)
+                    records = list(records_of(response))
+                    if len(records) >= self.limit:  # Если ответ мог быть обрезан
+                        if part[1] - part[0] > self.min_slice:  # и часть можно разделить
+                            split[id(part)] = part
+                            continue
+                        self.logger.warning('В части периода %s - %s не меньше %s записей. Часть записей может быть пропущена', part[0], part[1], self.limit)
+                    part[2] = records
+                if split:  # Делим обрезанные части пополам
+                    parts = deque()
+                    for part in pending:
+                        if id(part) in split:
+                            middle = (part[0] + part[1]) / 2
+                            parts.extend(([part[0], middle, None], [middle, part[1], None]))
+                        else:
+                            parts.append(part)
+                    pending = parts
+            while pending and pending[0][2] is not None:  # Выдаем загруженные части с начала периода
+                for record in sorted(pending.popleft()[2], key=self.timestamp):
+                    record_id = id_of(record)
+                    if record_id in seen:  # Запись на границе частей уже выдана
+                        continue
+                    seen.add(record_id)
+                    yield record
+
+    def pace(self, count) -> None:
+        """Ожидание, чтобы count запросов не превысили ограничение запросов в минуту"""
+        count = min(count, self.requests_per_minute)
+        while True:
+            now = monotonic()
+            while self.request_times and now - self.request_times[0] >= 60:  # Убираем запросы старше минуты
+                self.request_times.popleft()
+            if len(self.request_times) + count <= self.requests_per_minute:
+                break
+            sleep(60 - (now - self.request_times[0]))  # Ждем, пока самый старый запрос не выйдет из минуты
+        self.request_times.extend([monotonic()] * count)
+
+    @staticmethod
+    def trades_to_array(trades) -> 'np.ndarray':
+        """Свои сделки AccountTrade в массив account_trade_dtype"""
+        if np is None:
+            raise ImportError('Для выгрузки истории счета в массивы нужен numpy: pip install FinamPy[numpy]')
+        return np.array([(AccountHistory.timestamp(trade), trade.symbol, trade.side, float(trade.price.value or 0), float(trade.size.value or 0), trade.trade_id, trade.order_id)
+                         for trade in trades], dtype=account_trade_dtype)
+
+    @staticmethod
+    def transactions_to_array(transactions) -> 'np.ndarray':
+        """Транзакции Transaction в массив transaction_dtype"""
+        if np is None:
+            raise ImportError('Для выгрузки истории счета в массивы нужен numpy: pip install FinamPy[numpy]')
+        return np.array([(AccountHistory.timestamp(transaction), transaction.symbol, transaction.transaction_category,
+                          transaction.change.units + transaction.change.nanos / 1e9, transaction.change.currency_code, float(transaction.change_qty.value or 0),
+                          float(transaction.trade.price.value or 0), float(transaction.trade.size.value or 0), transaction.id)
+                         for transaction in transactions], dtype=transaction_dtype)
@@ -0,0 +1,265 @@
+from collections import deque  # Последние закрытые бары
+from datetime import datetime  # Смещение московского времени
+from threading import Lock  # Бары приходят из разных потоков подписок
+from typing import Optional
+
+from google.protobuf.timestamp_pb2 import Timestamp  # Время бара
+from google.type.decimal_pb2 import Decimal  # Цены и объем бара
+from google.type.interval_pb2 import Interval  # Период запроса истории
+
+from FinamPy.FinamPy import FinamPy, Event  # Провайдер Финам, событие нового бара
+from FinamPy.grpc import marketdata_service_pb2 as marketdata_service  # Рыночные данные
+
+
+class TickBarAggregator:
+    """Бары произвольного временнОго интервала, тиковые, объемные и ренко-подобные (по диапазону цены) из подписки на обезличенные сделки
+
+    Временной интервал задается строкой: S10 - 10 секунд, M3 - 3 минуты, M45 - 45 минут, T100 - 100 сделок, V1000 - объем 1000, R0.5 - диапазон цены 0.5.
+    Бары по времени выравниваются по началу дня по московскому времени, последний бар дня может быть короче. Каждая сделка обрабатывается за O(1).
+    Событие on_new_bar вызывается так же, как событие провайдера: формирующийся бар после каждого события сделок, временной интервал - строка
+    """
+    time_units = {'S': 1, 'M': 60}  # Секунд в единице временнОго интервала
+
+    def __init__(self, fp_provider, symbol, timeframe):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param str symbol: Символ инструмента тикер@биржа
+        :param str timeframe: Временной интервал: S<секунд>, M<минут>, T<сделок>, V<объем>, R<диапазон цены>
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.symbol = symbol  # Символ инструмента
+        self.timeframe = timeframe  # Временной интервал
+        self.kind, self.size = self.parse_timeframe(timeframe)  # Вид бара, размер бара (секунд, сделок, объем, диапазон)
+        self.msk_offset = int(datetime.now(FinamPy.tz_msk).utcoffset().total_seconds())  # Смещение московского времени от UTC в секундах
+        self.on_new_bar = Event()  # Формирующийся и закрытый бар (SubscribeBarsResponse, временной интервал)
+        self.bar_start = None  # Время открытия текущего бара в секундах. None - бара нет
+        self.bar_nanos = 0  # Наносекунды времени открытия текущего бара
+        self.bar_end = 0  # Время закрытия бара по времени в секундах
+        self.open = self.high = self.low = self.close = 0.0  # Цены бара
+        self.open_str = self.high_str = self.low_str = self.close_str = ''  # Цены бара в исходном виде Финама
+        self.volume = 0.0  # Объем бара
+        self.ticks = 0  # Кол-во сделок в баре
+
+    @classmethod
+    def parse_timeframe(cls, timeframe) -> tuple[str, float]:
+        """Вид и размер бара из временнОго интервала
+
+        :param str timeframe: Временной интервал: S<секунд>, M<минут>, T<сделок>, V<объем>, R<диапазон цены>
+        :return: Вид бара (time/tick/volume/range), размер бара
+        """
+        unit, value = timeframe[:1], timeframe[1:]
+        try:
+            size = float(value)
+        except ValueError:
+            raise NotImplementedError(f'Временной интервал {timeframe} не поддерживается') from None
+        if size <= 0:
+            raise NotImplementedError(f'Временной интервал {timeframe} не поддерживается')
+        if unit in cls.time_units:  # Бары по времени
+            seconds = int(size) * cls.time_units[unit]
+            if seconds != size * cls.time_units[unit] or seconds > 86400:  # Интервал должен быть целым и не больше суток
+                raise NotImplementedError(f'Временной интервал {timeframe} не поддерживается')
+            return 'time', seconds
+        if unit == 'T' and size == int(size):  # Тиковые бары
+            return 'tick', int(size)
+        if unit == 'V':  # Объемные бары
+            return 'volume', size
+        if unit == 'R':  # Бары по диапазону цены
+            return 'range', size
+        raise NotImplementedError(f'Временной интервал {timeframe} не поддерживается')
+
+    def start(self) -> 'TickBarAggregator':
+        """Начать построение баров по событиям обезличенных сделок провайдера. Поток подписки subscribe_latest_trades_thread запускается отдельно"""
+        self.fp_provider.on_latest_trades.subscribe(self.on_latest_trades, self.symbol)  # Только сделки своего инструмента
+        return self
+
+    def stop(self) -> None:
+        """Остановить построение баров"""
+        self.fp_provider.on_latest_trades.unsubscribe(self.on_latest_trades, self.symbol)
+
+    def on_latest_trades(self, event: marketdata_service.SubscribeLatestTradesResponse) -> None:
+        """Обработчик события обезличенных сделок"""
+        if event.symbol != self.symbol or not event.trades:  # Если сделки по другому инструменту или их нет
+            return  # то выходим, дальше не продолжаем
+        for trade in event.trades:  # Пробегаемся по всем сделкам
+            if self.add_trade(trade.timestamp.seconds, trade.timestamp.nanos, trade.price.value, float(trade.size.value)):  # Если сделка закрыла бар
+                self.emit()  # то отправляем закрытый бар до открытия нового
+                self.new_bar(trade.timestamp.seconds, trade.timestamp.nanos, trade.price.value, float(trade.size.value))  # Сделка открывает новый бар
+        self.emit()  # Отправляем формирующийся бар
+
+    def add_trade(self, seconds, nanos, price_str, size) -> bool:
+        """Добавить сделку в текущий бар
+
+        :param int seconds: Время сделки в секундах, прошедших с 01.01.1970 00:00 UTC
+        :param int nanos: Наносекунды времени сделки
+        :param str price_str: Цена сделки в виде Финама
+        :param float size: Размер сделки
+        :return: True, если сделка не входит в текущий бар. Текущий бар нужно закрыть, а сделкой открыть новый
+        """
+        if self.bar_start is None:  # Если бара еще нет
+            self.new_bar(seconds, nanos, price_str, size)  # то сделка открывает первый бар
+            return False
+        price = float(price_str)
+        if self.kind == 'time':
+            if seconds >= self.bar_end:  # Если сделка после закрытия бара
+                return True
+        elif self.kind == 'tick':
+            if self.ticks >= self.size:  # Если в баре уже заданное кол-во сделок
+                return True
+        elif self.kind == 'volume':
+            if self.volume >= self.size:  # Если в баре уже заданный объем
+                return True
+        elif max(self.high, price) - min(self.low, price) > self.size + 1e-9:  # Если с этой сделкой диапазон цен бара будет больше заданного
+            return True
+        if price > self.high:
+            self.high, self.high_str = price, price_str
+        if price < self.low:
+            self.low, self.low_str = price, price_str
+        self.close, self.close_str = price, price_str
+        self.volume += size
+        self.ticks += 1
+        return False
+
+    def new_bar(self, seconds, nanos, price_str, size) -> None:
+        """Открыть новый бар сделкой"""
+        price = float(price_str)
+        if self.kind == 'time':  # Для баров по времени время открытия выравниваем по началу дня по московскому времени
+            day_start = seconds - (seconds + self.msk_offset) % 86400  # Начало дня по московскому времени
+            self.bar_start = day_start + (seconds - day_start) // self.size * self.size
+            self.bar_nanos = 0
+            self.bar_end = min(self.bar_start + self.size, day_start + 86400)  # Если интервал не укладывается в сутки целое число раз, то последний бар дня короче
+        else:  # Для остальных баров время открытия - время первой сделки
+            self.bar_start, self.bar_nanos = seconds, nanos
+        self.open = self.high = self.low = self.close = price
+        self.open_str = self.high_str = self.low_str = self.close_str = price_str
+        self.volume = size
+        self.ticks = 1
+
+    def get_bar(self) -> marketdata_service.Bar:
+        """Текущий бар в виде бара Финама"""
+        volume = int(self.volume) if self.volume.is_integer() else self.volume  # Целый объем выводим без дробной части
+        return marketdata_service.Bar(timestamp=Timestamp(seconds=self.bar_start, nanos=self.bar_nanos),
+                                      open=Decimal(value=self.open_str), high=Decimal(value=self.high_str),
+                                      low=Decimal(value=self.low_str), close=Decimal(value=self.close_str),
+                                      volume=Decimal(value=str(volume)))
+
+    def emit(self) -> None:
+        """Отправить текущий бар подписчикам события on_new_bar"""
+        if self.bar_start is None:  # Если бара еще нет
+            return  # то отправлять нечего
+        self.on_new_bar.trigger(marketdata_service.SubscribeBarsResponse(symbol=self.symbol, bars=[self.get_bar()]), self.timeframe)
+
+
+class BarState:
+    """Состояние баров инструмента и временнОго интервала"""
+    def __init__(self, symbol, finam_timeframe, depth):
+        self.symbol = symbol  # Символ инструмента
+        self.finam_timeframe = finam_timeframe  # Временной интервал Финама
+        self.bar: Optional[marketdata_service.Bar] = None  # Формирующийся бар. None - баров еще не было
+        self.closed: deque[marketdata_service.Bar] = deque(maxlen=depth)  # Последние закрытые бары
+        self.reconnected = False  # Поток подписки переподключился. Следующий новый бар проверяется на пропуск
+
+
+class BarBuilder:
+    """Формирующиеся и закрытые бары из подписки на бары
+
+    Подписка SubscribeBars повторно присылает формирующийся бар при каждом его изменении. BarBuilder хранит формирующийся бар по каждому инструменту
+    и временнОму интервалу, вызывает on_bar_update только при изменении бара и on_bar_closed, когда пришел бар с бОльшим временем.
+    После переподключения потока подписки пропущенные бары загружаются из истории. Перерывы в торгах (клиринг, ночь) историю не загружают
+    """
+    @staticmethod
+    def intraday_seconds(finam_timeframe) -> Optional[int]:
+        """Длительность внутридневного бара в секундах по справочнику временнЫх интервалов провайдера. None - бар не внутридневной. Пропуски ищем только у внутридневных бар"""
+        try:
+            tf, _, intraday = FinamPy.finam_timeframe_to_timeframe(finam_timeframe)  # Внутридневные интервалы: M<минут>
+        except NotImplementedError:  # Если временной интервал Финама не поддерживается
+            return None
+        return int(tf[1:]) * 60 if intraday else None
+
+    def __init__(self, fp_provider, depth=1000):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param int depth: Кол-во хранимых закрытых бар по каждому инструменту и временнОму интервалу
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.depth = depth  # Кол-во хранимых закрытых бар
+        self.states: dict[tuple[str, int], BarState] = {}  # Состояние баров по инструменту и временнОму интервалу Финама
+        self.lock = Lock()  # Блокировка создания состояний
+        self.on_bar_update = Event()  # Изменение формирующегося бара (символ, временной интервал Финама, бар)
+        self.on_bar_closed = Event()  # Закрытие бара (символ, временной интервал Финама, бар)
+
+    def start(self) -> 'BarBuilder':
+        """Начать построение баров по событиям провайдера. Потоки подписки subscribe_bars_thread запускаются отдельно"""
+        self.fp_provider.on_new_bar.subscribe(self.on_new_bar)
+        self.fp_provider.on_stream_connected.subscribe(self.on_stream_connected)
+        return self
+
+    def stop(self) -> None:
+        """Остановить построение баров"""
+        self.fp_provider.on_new_bar.unsubscribe(self.on_new_bar)
+        self.fp_provider.on_stream_connected.unsubscribe(self.on_stream_connected)
+
+    def on_stream_connected(self, name, reconnect) -> None:
+        """Переподключение потока подписки на бары. Пока поток был отключен, бары могли быть пропущены"""
+        stream, _, rest = name.partition(':')
+        if not reconnect or stream != 'SubscribeBars':
+            return
+        symbol, _, timeframe_name = rest.rpartition(':')  # Символ инструмента, название временнОго интервала Финама
+        state = self.states.get((symbol, marketdata_service.TimeFrame.Value(timeframe_name)))
+        if state is not None:  # Если бары по подписке уже приходили
+            state.reconnected = True  # то новый бар проверим на пропуск
+
+    def get_state(self, symbol, finam_timeframe) -> BarState:
+        """Состояние баров инструмента и временнОго интервала. Создается при первом обращении"""
+        key = (symbol, finam_timeframe)
+        state = self.states.get(key)
+        if state is None:
+            with self.lock:
+                state = self.states.setdefault(key, BarState(symbol, finam_timeframe, self.depth))
+        return state
+
+    def get_bars(self, symbol, finam_timeframe) -> list[marketdata_service.Bar]:
+        """Последние закрытые бары от старых к новым"""
+        return list(self.get_state(symbol, finam_timeframe).closed)
+
+    def on_new_bar(self, event: marketdata_service.SubscribeBarsResponse, finam_timeframe) -> None:
+        """Обработчик события подписки на бары"""
+        state = self.get_state(event.symbol, finam_timeframe)
+        reconnected, state.reconnected = state.reconnected, False  # Пропуск может быть только перед первым событием после переподключения
+        for bar in event.bars:  # Пробегаемся по всем полученным барам
+            if state.bar is None:  # Если это первый бар
+                state.bar = bar  # то он формирующийся
+                self.on_bar_update.trigger(state.symbol, finam_timeframe, bar)
+            elif bar.timestamp.seconds == state.bar.timestamp.seconds:  # Если пришел формирующийся бар
+                if bar != state.bar:  # Если бар изменился
+                    state.bar = bar
+                    self.on_bar_update.trigger(state.symbol, finam_timeframe, bar)
+            elif bar.timestamp.seconds > state.bar.timestamp.seconds:  # Если пришел новый бар
+                missed = self.load_missed(state, bar.timestamp.seconds) if reconnected else []  # Бары от формирующегося до нового из истории только после переподключения
+                for closed_bar in missed or (state.bar,):  # Если история не загружалась, то закрываем формирующийся бар в последнем полученном виде
+                    state.closed.append(closed_bar)
+                    self.on_bar_closed.trigger(state.symbol, finam_timeframe, closed_bar)
+                state.bar = bar  # Новый бар формирующийся
+                self.on_bar_update.trigger(state.symbol, finam_timeframe, bar)
+            # Бары старше формирующегося пропускаем
+
+    def load_missed(self, state, new_seconds) -> list[marketdata_service.Bar]:
+        """Пропущенные бары из истории
+
+        :param BarState state: Состояние баров
+        :param int new_seconds: Время нового бара
+        :return: Бары с времени формирующегося бара до нового бара. Пустой список, если пропуска нет или история не получена
+        """
+        duration = self.intraday_seconds(state.finam_timeframe)
+        start_seconds = state.bar.timestamp.seconds  # Время формирующегося бара
+        if duration is None or new_seconds <= start_seconds + duration:  # Если бары не внутридневные или пропуска нет
+            return []  # то историю не загружаем
+        response: marketdata_service.BarsResponse = self.fp_provider.call_function(self.fp_provider.marketdata_stub.Bars, marketdata_service.BarsRequest(
+            symbol=state.symbol, timeframe=state.finam_timeframe, interval=Interval(start_time=Timestamp(seconds=start_seconds), end_time=Timestamp(seconds=new_seconds))))
+        if response is None:  # Если история не получена
+            return []
+        missed = [bar for bar in response.bars if start_seconds <= bar.timestamp.seconds < new_seconds]
+        if missed and missed[0].timestamp.seconds != start_seconds:  # Если в истории нет формирующегося бара
+            missed.insert(0, state.bar)  # то закрываем его в последнем полученном виде
+        return missed
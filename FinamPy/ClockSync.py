@@ -0,0 +1,132 @@
+from threading import Thread, Event as ThreadingEvent, local  # Поток синхронизации, остановка, отметка текущего события потока подписки
+from time import time  # Локальное время
+from typing import Optional
+
+from FinamPy.FinamPy import Event  # Событие отметки
+from FinamPy.Metrics import Histogram  # Задержки данных
+from FinamPy.grpc import assets_service_pb2 as assets_service  # Время на сервере
+from FinamPy.grpc import marketdata_service_pb2 as marketdata_service  # Рыночные данные
+
+
+class ClockSync:
+    """Синхронизация с часами сервера по AssetsService.Clock и отметка событий подписок временем получения и задержкой от биржи
+
+    Смещение и время прохождения запроса (RTT) оцениваются как в NTP: по каждому из нескольких запросов Clock
+    смещение = время сервера - середина интервала запроса. Берется запрос с минимальным RTT, т.к. его оценка точнее всего
+    """
+    def __init__(self, fp_provider, interval=60, samples=8):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param float interval: Период синхронизации в секундах
+        :param int samples: Кол-во запросов Clock за одну синхронизацию
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.interval = interval  # Период синхронизации в секундах
+        self.samples = samples  # Кол-во запросов Clock за одну синхронизацию
+        self.offset = 0.0  # Время сервера - локальное время в секундах
+        self.rtt: Optional[float] = None  # Время прохождения запроса Clock в секундах. None - синхронизации еще не было
+        self.synced_at = 0.0  # Локальное время последней успешной синхронизации
+        self.latency: dict[str, Histogram] = {}  # Задержки от биржи до клиента по потоку подписки
+        self.on_stamp = Event()  # Событие отметки события подписки (поток, событие, время получения по серверу, задержка или None)
+        self._local = local()  # Отметка текущего события в потоке подписки
+        self._stop = ThreadingEvent()  # Остановка потока синхронизации
+        self._thread: Optional[Thread] = None  # Поток синхронизации
+
+    def sync(self) -> bool:
+        """Синхронизация с часами сервера
+
+        :return: True, если получен хотя бы один ответ Clock
+        """
+        best = None  # Запрос с минимальным RTT (RTT, смещение)
+        for _ in range(self.samples):  # Делаем заданное кол-во запросов
+            t0 = time()  # Локальное время отправки запроса
+            clock: assets_service.ClockResponse = self.fp_provider.call_function(self.fp_provider.assets_stub.Clock, assets_service.ClockRequest())
+            t1 = time()  # Локальное время получения ответа
+            if clock is None:  # Если ответ не получен
+                continue  # то переходим к следующему запросу
+            server = clock.timestamp.seconds + clock.timestamp.nanos / 1e9  # Время сервера
+            rtt = t1 - t0  # Время прохождения запроса
+            if best is None or rtt < best[0]:  # Если запрос быстрее лучшего
+                best = (rtt, server - (t0 + t1) / 2)  # то запоминаем его
+        if best is None:  # Если ни одного ответа не получено
+            return False  # то смещение не меняем
+        self.rtt, self.offset = best
+        self.synced_at = time()
+        return True
+
+    def start(self) -> 'ClockSync':
+        """Запуск фоновой синхронизации. Первая синхронизация выполняется сразу"""
+        self.sync()
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='ClockSyncThread', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Остановка фоновой синхронизации"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        """Поток синхронизации"""
+        while not self._stop.wait(self.interval):  # Пока не остановили, ждем следующую синхронизацию
+            self.sync()
+
+    def now(self) -> float:
+        """Время сервера в секундах, прошедших с 01.01.1970 00:00 UTC"""
+        return time() + self.offset
+
+    def to_server_time(self, local_time) -> float:
+        """Перевод локального времени во время сервера
+
+        :param float local_time: Локальное время в секундах, прошедших с 01.01.1970 00:00 UTC
+        """
+        return local_time + self.offset
+
+    @staticmethod
+    def exchange_time(event) -> Optional[float]:
+        """Время биржи последних данных события подписки. Для баров не определено, т.к. время бара - время его открытия
+
+        :param event: Событие подписки на котировки, стакан или сделки
+        :return: Время в секундах, прошедших с 01.01.1970 00:00 UTC или None
+        """
+        if isinstance(event, marketdata_service.SubscribeQuoteResponse):
+            timestamps = [quote.timestamp for quote in event.quote]
+        elif isinstance(event, marketdata_service.SubscribeLatestTradesResponse):
+            timestamps = [trade.timestamp for trade in event.trades]
+        elif isinstance(event, marketdata_service.SubscribeOrderBookResponse):
+            timestamps = [row.timestamp for order_book in event.order_book for row in order_book.rows]
+        else:  # Для остальных событий
+            return None  # время биржи не определено
+        if not timestamps:  # Если в событии нет данных
+            return None  # то и времени нет
+        ts = max(timestamps, key=lambda t: (t.seconds, t.nanos))  # Самые свежие данные
+        return ts.seconds + ts.nanos / 1e9
+
+    def stamp(self, stream, event, receive_time) -> None:
+        """Отметка события подписки. Вызывается из потока подписки до обработчиков события
+
+        :param str stream: Название потока подписки
+        :param event: Событие подписки
+        :param float receive_time: Локальное время получения события
+        """
+        server_receive_time = receive_time + self.offset  # Время получения по часам сервера
+        exchange_time = self.exchange_time(event)  # Время биржи
+        latency = None if exchange_time is None else server_receive_time - exchange_time  # Задержка от биржи до клиента
+        self._local.stamp = (server_receive_time, latency)  # Отметка доступна обработчикам события из этого же потока
+        if latency is not None:
+            histogram = self.latency.get(stream)
+            if histogram is None:  # Если поток отмечается впервые
+                histogram = self.latency[stream] = Histogram()
+            histogram.observe(max(latency, 0.0))  # Отрицательная задержка - погрешность синхронизации
+        self.on_stamp.trigger(stream, event, server_receive_time, latency)
+
+    def current(self) -> tuple[Optional[float], Optional[float]]:
+        """Отметка события, которое сейчас обрабатывается в этом потоке подписки
+
+        :return: Время получения по часам сервера, задержка от биржи до клиента в секундах
+        """
+        return getattr(self._local, 'stamp', (None, None))
@@ -1,16 +1,25 @@
 import logging  # Будем вести лог
+import os  # Номер процесса для клиентских номеров заявок
+from random import getrandbits  # Случайная часть клиентских номеров заявок
+from dataclasses import dataclass, field  # Профиль канала
 from datetime import datetime, timedelta, timezone
-from time import sleep
+from decimal import Decimal  # Точное кол-во в заявке
+from time import perf_counter, time, sleep
+from itertools import count  # Счетчик вызовов для выборочного лога
 from zoneinfo import ZoneInfo  # ВременнАя зона
-from typing import Optional, Any  # Любой тип
+from typing import Optional, Any, NamedTuple, Callable  # Любой тип, результат заявки в пакете, функция остановки обработчика
 from queue import SimpleQueue  # Очередь подписок/отписок
+from threading import Lock, Semaphore, current_thread, Event as ThreadingEvent  # Изменение списков подписчиков событий, окно пакетных вызовов, поток подписки, остановка потока подписки
 
 import keyring  # Безопасное хранение торгового токена
 import keyring.errors  # Ошибки хранилища
-from grpc import ssl_channel_credentials, secure_channel, RpcError, StatusCode  # Защищенный канал
+from grpc import ssl_channel_credentials, secure_channel, RpcError, StatusCode, Compression  # Защищенный канал
+
+from FinamPy.Metrics import Metrics  # Метрики вызовов и подписок
 
 # Структуры
 from FinamPy.grpc import auth_service_pb2 as auth_service  # Подключение
+from FinamPy.grpc import accounts_service_pb2 as accounts_service  # Счета
 from FinamPy.grpc import assets_service_pb2 as assets_service  # Информация о биржах и тикерах
 from FinamPy.grpc import marketdata_service_pb2 as marketdata_service  # Рыночные данные
 from FinamPy.grpc import orders_service_pb2 as orders_service  # Заявки
@@ -30,15 +39,37 @@ class FinamPy:
     server = 'api.finam.ru:443'  # Сервер для исполнения вызовов
     jwt_token_ttl = 15 * 60  # Время жизни токена JWT 15 минут в секундах
     logger = logging.getLogger('FinamPy')  # Будем вести лог
+    wire_logger = logging.getLogger('FinamPy.Wire')  # Лог вызовов: функция, статус, размеры, задержка
+    log_max_size = 4096  # Сообщения больше этого размера в байтах в лог не выводим целиком, только тип и размер
+    wire_log_sample = 0  # Каждый какой вызов записывать в лог вызовов. 0 - не записывать
     metadata: tuple[str, str]  # Токен JWT в запросах
-
-    def __init__(self, access_token=None):
+    final_order_statuses = frozenset((
+        orders_service.ORDER_STATUS_FILLED, orders_service.ORDER_STATUS_DONE_FOR_DAY, orders_service.ORDER_STATUS_CANCELED,
+        orders_service.ORDER_STATUS_REPLACED, orders_service.ORDER_STATUS_REJECTED, orders_service.ORDER_STATUS_EXPIRED,
+        orders_service.ORDER_STATUS_FAILED, orders_service.ORDER_STATUS_DENIED_BY_BROKER, orders_service.ORDER_STATUS_REJECTED_BY_EXCHANGE,
+        orders_service.ORDER_STATUS_EXECUTED, orders_service.ORDER_STATUS_DISABLED, orders_service.ORDER_STATUS_SL_EXECUTED,
+        orders_service.ORDER_STATUS_TP_EXECUTED))  # Статусы завершенных заявок. Остальные заявки активные
+    batch_window = 64  # Макс. кол-во одновременных запросов в пакетных вызовах
+    replace_modes = ('concurrent', 'cancel_first', 'place_first')  # Порядок снятия и выставления при замене заявки
+
+    def __init__(self, access_token=None, channel_profile=None, metrics=None, channel=None):
         """Инициализация
 
         :param str access_token: Торговый токен
+        :param ChannelProfile channel_profile: Профиль канала (сжатие, окна, размер сообщений, keepalive). По умолчанию, настройки gRPC
+        :param Metrics metrics: Метрики вызовов и подписок, например, MetricsRegistry(). По умолчанию, метрики не записываются
+        :param grpc.Channel channel: Готовый канал, например, к тестовому серверу MockServer. Торговый токен для него в хранилище не сохраняется. По умолчанию, защищенный канал к серверу Финама
         """
-        self.channel = secure_channel(self.server, ssl_channel_credentials())  # Защищенный канал
-        self.order_trade_queue: SimpleQueue[orders_service.OrderTradeRequest] = SimpleQueue()  # Буфер команд заявок/сделок
+        self.metrics = Metrics() if metrics is None else metrics  # Метрики
+        self.clock_sync = None  # Синхронизация с часами сервера ClockSync. Если задана, то события подписок отмечаются временем получения и задержкой
+        self.risk_gate = None  # Проверка заявок перед отправкой RiskGate. Если задана, то заявки, не прошедшие проверку, на сервер не отправляются
+        self.order_latency = None  # Задержки заявок OrderLatency. Если заданы, то отправка и ответ на PlaceOrder отмечаются
+        self.channel_profile = ChannelProfile() if channel_profile is None else channel_profile  # Профиль канала
+        self.wire_log_counter = count()  # Счетчик вызовов для выборочного лога
+        if channel is None:  # Если канал не задан
+            channel = secure_channel(self.server, ssl_channel_credentials(), options=self.channel_profile.options(), compression=self.channel_profile.get_compression())  # то создаем защищенный канал к серверу Финама
+        self.channel = channel  # Канал
+        self.order_trade_queue: SimpleQueue[Optional[orders_service.OrderTradeRequest]] = SimpleQueue()  # Буфер команд заявок/сделок текущего подключения. None - признак закрытия
 
         # Сервисы
         self.auth_stub = AuthServiceStub(self.channel)
@@ -54,12 +85,15 @@ class FinamPy:
         self.on_new_bar = Event()  # Свечи по инструменту и временнОму интервалу
         self.on_order = Event()  # Свои заявки
         self.on_trade = Event()  # Свои сделки
+        self.on_account = Event()  # Состояние счета: позиции, свободные средства, оценка
+        self.on_stream_connected = Event()  # Подключение потока подписки (название, переподключение). При переподключении события могли быть пропущены
 
         if access_token is None:  # Если торговый токен не указан
             self.access_token = self.get_long_token_from_keyring('FinamPy', 'access_token')  # то получаем его из защищенного хранилища по частям
         else:  # Если указан торговый токен
             self.access_token = access_token  # Торговый токен
-            self.set_long_token_to_keyring('FinamPy', 'access_token', self.access_token)  # Сохраняем его в защищенное хранилище
+            if channel is None:  # Если подключаемся к серверу Финама
+                self.set_long_token_to_keyring('FinamPy', 'access_token', self.access_token)  # Сохраняем его в защищенное хранилище
 
         self.jwt_token = ''  # Токен JWT
         self.jwt_token_issued = 0  # UNIX время в секундах выдачи токена JWT
@@ -70,6 +104,9 @@ class FinamPy:
         self.assets: Optional[assets_service.AssetsResponse] = None  # Справочник всех доступных инструментов
         self.symbols = {}  # Справочник тикеров
         self.subscriptions = {}  # Список подписок на свои заявки и сделки
+        self.client_order_id_generator = ClientOrderIdGenerator()  # Клиентские номера заявок
+        self.streams: dict[str, StreamHandle] = {}  # Состояние потоков подписок по названию
+        self.workers: list[tuple[str, Callable[[Optional[float]], bool]]] = []  # Обработчики событий со своими потоками: название, остановка за время в секундах (True - поток завершился)
 
     # Подключение
 
@@ -100,83 +137,386 @@ class FinamPy:
         self.auth()  # Получаем токен JWT
         # noinspection PyProtectedMember
         func_name = func._method.decode('utf-8')  # Название функции
-        self.logger.debug(f'Запрос : {func_name}({request})')
+        compression = self.channel_profile.get_compression(func_name)  # Сжатие для функции
+        debug = self.logger.isEnabledFor(logging.DEBUG)  # Строки для лога формируем только, если он ведется
+        if debug:
+            self.logger.debug('Запрос : %s(%s)', func_name, self.message_to_log(request))
+        wire = self.wire_log_sample > 0 and next(self.wire_log_counter) % self.wire_log_sample == 0 and self.wire_logger.isEnabledFor(logging.INFO)  # Записываем ли вызов в лог вызовов
+        start = perf_counter()  # Время начала вызова
         while True:  # Пока не получим ответ или ошибку
             try:  # Пытаемся
-                response, call = func.with_call(request=request, metadata=(self.metadata,))  # вызвать функцию
-                self.logger.debug(f'Ответ  : {response}')
+                response, call = func.with_call(request=request, metadata=(self.metadata,), compression=compression)  # вызвать функцию
+                if debug:
+                    self.logger.debug('Ответ  : %s', self.message_to_log(response))
+                if wire or self.metrics.enabled:  # Размеры сообщений вычисляем только, если они нужны
+                    self.record_call(func_name, StatusCode.OK, request, response, perf_counter() - start, wire)
                 return response  # и вернуть ответ
             except RpcError as ex:  # Если получили ошибку канала
-                details = ex.args[0].details  # Сообщение об ошибке
+                if wire or self.metrics.enabled:
+                    self.record_call(func_name, ex.code(), request, None, perf_counter() - start, wire)
                 if 'GetAsset' not in func_name:  # При переводе канонического названия тикера в вид Финама приходится подбирать биржу. Поэтому, ошибки ф-ии GetAsset игнорируем
-                    self.logger.error(f'Ошибка {details} при вызове функции {func_name}({request})')
+                    self.logger.error('Ошибка %s при вызове функции %s(%s)', ex.args[0].details, func_name, self.message_to_log(request))
                 return None  # Возвращаем пустое значение
 
+    def message_to_log(self, message) -> str:
+        """Сообщение для лога. Большие сообщения заменяются на тип и размер, чтобы не переводить их в строку целиком
+
+        :param message: Сообщение protobuf
+        :return: Сообщение или его тип и размер в виде строки
+        """
+        size = message.ByteSize()  # Размер сообщения в байтах. Вычисляется без перевода в строку
+        if size > self.log_max_size:  # Если сообщение большое
+            return f'<{type(message).__name__} {size} байт>'  # то выводим только его тип и размер
+        return str(message)
+
+    def record_call(self, func_name, status, request, response, latency, wire) -> None:
+        """Запись вызова в метрики и лог вызовов. Поля записи лога доступны обработчикам как атрибуты method, status, bytes_out, bytes_in, latency
+
+        :param str func_name: Название функции
+        :param StatusCode status: Статус вызова
+        :param request: Запрос
+        :param response: Ответ или None при ошибке
+        :param float latency: Задержка вызова в секундах
+        :param bool wire: Записывать вызов в лог вызовов
+        """
+        bytes_out = request.ByteSize()  # Размер запроса
+        bytes_in = 0 if response is None else response.ByteSize()  # Размер ответа
+        self.metrics.request(func_name, status, latency, bytes_out, bytes_in)
+        if wire:
+            self.wire_logger.info('%s %s out=%d in=%d %.3f мс', func_name, status.name, bytes_out, bytes_in, latency * 1000,
+                                  extra={'method': func_name, 'status': status.name, 'bytes_out': bytes_out, 'bytes_in': bytes_in, 'latency': latency})
+
+    # Заявки
+
+    def place_order(self, order: orders_service.Order) -> Optional[orders_service.OrderState]:
+        """Выставление заявки с проверкой risk_gate, если она задана
+
+        :param order: Заявка
+        :return: Состояние заявки или None, если заявка отклонена проверкой или сервером
+        """
+        if self.risk_gate is not None:  # Если задана проверка заявок
+            reason = self.risk_gate.check(order)  # то проверяем заявку до отправки
+            if reason is not None:  # Если заявка не прошла проверку
+                self.logger.error('Заявка отклонена до отправки: %s. %s', reason, self.message_to_log(order))
+                return None  # то на сервер ее не отправляем
+        if self.order_latency is None:  # Если задержки заявок не отмечаются
+            return self.call_function(self.orders_stub.PlaceOrder, order)
+        if not order.client_order_id:  # Заявку без клиентского номера не сопоставить с подписками
+            order.client_order_id = self.new_client_order_id()
+        self.order_latency.sent(order)
+        order_state = self.call_function(self.orders_stub.PlaceOrder, order)
+        self.order_latency.acknowledged(order, order_state)
+        return order_state
+
+    def new_client_order_id(self) -> str:
+        """Новый клиентский номер заявки: возрастающий, уникальный, сортируемый по времени создания"""
+        return self.client_order_id_generator.next()
+
+    def place_order_idempotent(self, order: orders_service.Order, timeout=1.0, attempts=3) -> Optional[orders_service.OrderState]:
+        """Выставление заявки с повтором после таймаута без риска выставить заявку дважды
+
+        Если ответ не получен за timeout, то заявка могла дойти до сервера. Перед повтором она ищется по клиентскому номеру в GetOrders.
+        Повтор отправляется с тем же клиентским номером, только если заявки на сервере точно нет.
+        Если заявки не получены и после attempts запросов, то повтор не отправляется: вызывается ConnectionError
+
+        :param order: Заявка. Если клиентский номер не задан, то он присваивается
+        :param float timeout: Время ожидания ответа на PlaceOrder в секундах
+        :param int attempts: Макс. кол-во отправок заявки
+        :return: Состояние заявки или None, если заявка не выставлена
+        :raises ConnectionError: Ответа на заявку нет, и найти ее не удалось. Заявка могла быть выставлена
+        """
+        if not order.client_order_id:  # Если клиентский номер не задан
+            order.client_order_id = self.new_client_order_id()  # то присваиваем его
+        if self.risk_gate is not None:  # Если задана проверка заявок
+            reason = self.risk_gate.check(order)
+            if reason is not None:
+                self.logger.error('Заявка отклонена до отправки: %s. %s', reason, self.message_to_log(order))
+                return None
+        self.auth()  # Получаем токен JWT
+        # noinspection PyProtectedMember
+        func_name = self.orders_stub.PlaceOrder._method.decode('utf-8')  # Название функции
+        compression = self.channel_profile.get_compression(func_name)  # Сжатие для функции
+        if self.order_latency is not None:  # Задержку отмечаем от первой отправки
+            self.order_latency.sent(order)
+        for attempt in range(1, attempts + 1):
+            start = perf_counter()  # Время начала вызова
+            try:
+                response, call = self.orders_stub.PlaceOrder.with_call(request=order, metadata=(self.metadata,), timeout=timeout, compression=compression)
+                if self.metrics.enabled:
+                    self.record_call(func_name, StatusCode.OK, order, response, perf_counter() - start, False)
+                if self.order_latency is not None:
+                    self.order_latency.acknowledged(order, response)
+                return response
+            except RpcError as ex:
+                if self.metrics.enabled:
+                    self.record_call(func_name, ex.code(), order, None, perf_counter() - start, False)
+                if attempt > 1 or ex.code() in (StatusCode.DEADLINE_EXCEEDED, StatusCode.UNAVAILABLE):  # Если заявка могла дойти до сервера (таймаут, разрыв, отказ повтора как дубликата)
+                    try:
+                        order_state = self.find_order(order.account_id, order.client_order_id, attempts, timeout)  # то ищем ее по клиентскому номеру
+                    except ConnectionError:  # Если найти заявку не удалось, то повтор может выставить ее дважды
+                        self.logger.error('Заявка %s могла быть выставлена, но найти ее не удалось. Повтор не отправлен', order.client_order_id)
+                        raise
+                    if order_state is not None:  # Если заявка на сервере есть
+                        return order_state  # то повтор не нужен
+                if ex.code() not in (StatusCode.DEADLINE_EXCEEDED, StatusCode.UNAVAILABLE):  # Если сервер ответил ошибкой
+                    self.logger.error('Ошибка %s при вызове функции %s(%s)', ex.details(), func_name, self.message_to_log(order))
+                    return None  # то заявка не выставлена
+                self.logger.warning('Нет ответа на заявку %s (попытка %s из %s): %s', order.client_order_id, attempt, attempts, ex.code().name)
+        self.logger.error('Заявка %s не выставлена за %s попыток', order.client_order_id, attempts)
+        return None
+
+    def find_order(self, account_id, client_order_id, attempts=1, delay=1.0) -> Optional[orders_service.OrderState]:
+        """Поиск заявки по клиентскому номеру в GetOrders
+
+        :param str account_id: Номер счета
+        :param str client_order_id: Клиентский номер заявки
+        :param int attempts: Макс. кол-во запросов GetOrders
+        :param float delay: Пауза между запросами в секундах
+        :return: Состояние заявки или None, если заявки на сервере нет
+        :raises ConnectionError: Заявки не получены. Есть ли заявка на сервере, неизвестно
+        """
+        for attempt in range(1, attempts + 1):
+            response: orders_service.OrdersResponse = self.call_function(self.orders_stub.GetOrders, orders_service.OrdersRequest(account_id=account_id))
+            if response is not None:  # Если заявки получены
+                break
+            if attempt < attempts:
+                sleep(delay)
+        else:  # Если заявки так и не получены
+            raise ConnectionError(f'Заявка {client_order_id} не найдена: заявки счета {account_id} не получены за {attempts} попыток')
+        return next((order_state for order_state in response.orders if order_state.order.client_order_id == client_order_id), None)
+
+    def call_functions(self, func, requests, window=None) -> list[tuple[Any, Optional[RpcError]]]:
+        """Конвейерный вызов функции для нескольких запросов. Запросы отправляются, не дожидаясь ответов на предыдущие
+
+        :param func: Функция, например, orders_stub.CancelOrder
+        :param list requests: Запросы
+        :param int window: Макс. кол-во одновременных запросов. По умолчанию, batch_window
+        :return: Ответ и ошибка по каждому запросу в порядке запросов. Если ошибки нет, то None. Если есть, то ответ None
+        """
+        self.auth()  # Получаем токен JWT
+        window = Semaphore(window or self.batch_window)  # Окно одновременных запросов
+        futures = []  # Вызовы
+        for request in requests:
+            window.acquire()  # Ждем, пока в окне освободится место
+            futures.append(self.call_future(func, request, window))
+        return [self.future_result(future) for future in futures]
+
+    def call_future(self, func, request, window=None):
+        """Вызов функции без ожидания ответа. Ответ получается из future_result
+
+        :param func: Функция, например, orders_stub.PlaceOrder
+        :param request: Запрос
+        :param Semaphore window: Окно одновременных запросов, место в котором освобождается по завершении вызова
+        :return: Вызов grpc.Future
+        """
+        # noinspection PyProtectedMember
+        func_name = func._method.decode('utf-8')  # Название функции
+        if self.order_latency is not None and func_name.endswith('/PlaceOrder'):  # Если отмечаются задержки заявок
+            self.order_latency.sent(request)
+        start = perf_counter()  # Время начала вызова
+        future = func.future(request=request, metadata=(self.metadata,), compression=self.channel_profile.get_compression(func_name))
+        future.add_done_callback(lambda f: self._call_done(func_name, request, f, start, window))
+        return future
+
+    @staticmethod
+    def future_result(future) -> tuple[Any, Optional[RpcError]]:
+        """Ожидание ответа на вызов call_future
+
+        :return: Ответ и ошибка. Если ошибки нет, то None. Если есть, то ответ None
+        """
+        if future.cancelled():  # Если вызов отменен
+            return None, future  # то ошибка - сам вызов gRPC со статусом CANCELLED
+        try:
+            return future.result(), None
+        except RpcError as ex:  # Ошибку в лог уже записали при завершении вызова
+            return None, ex
+
+    def _call_done(self, func_name, request, future, start, window) -> None:
+        """Завершение вызова без ожидания ответа: освобождение места в окне, метрики и лог"""
+        try:
+            cancelled = future.cancelled()  # exception() и result() отмененного вызова вызывают исключение
+            ex = None if cancelled else future.exception()  # Ошибка вызова или None
+            response = None if cancelled or ex is not None else future.result()
+            if self.order_latency is not None and func_name.endswith('/PlaceOrder'):
+                self.order_latency.acknowledged(request, response)
+            if self.metrics.enabled:
+                self.record_call(func_name, StatusCode.CANCELLED if cancelled else StatusCode.OK if ex is None else ex.code(), request, response, perf_counter() - start, False)
+            if cancelled:
+                self.logger.warning('Вызов функции %s(%s) отменен', func_name, self.message_to_log(request))
+            elif ex is not None:
+                self.logger.error('Ошибка %s при вызове функции %s(%s)', ex.details(), func_name, self.message_to_log(request))
+        finally:  # Место в окне освобождаем при любом завершении вызова
+            if window is not None:
+                window.release()
+
+    def place_orders(self, orders, window=None) -> list['OrderOutcome']:
+        """Выставление нескольких заявок конвейером. Заявкам без клиентского номера он присваивается
+
+        :param list[orders_service.Order] orders: Заявки
+        :param int window: Макс. кол-во одновременных запросов. По умолчанию, batch_window
+        :return: Результат по каждой заявке в порядке заявок
+        """
+        outcomes: list[Optional[OrderOutcome]] = [None] * len(orders)
+        send = []  # Номера заявок, прошедших проверку
+        for i, order in enumerate(orders):
+            if not order.client_order_id:  # Если клиентский номер не задан
+                order.client_order_id = self.new_client_order_id()  # то присваиваем его
+            reason = None if self.risk_gate is None else self.risk_gate.check(order)
+            if reason is not None:  # Если заявка не прошла проверку
+                self.logger.error('Заявка отклонена до отправки: %s. %s', reason, self.message_to_log(order))
+                outcomes[i] = OrderOutcome(order.client_order_id, '', None, reason)
+            else:
+                send.append(i)
+        results = self.call_functions(self.orders_stub.PlaceOrder, [orders[i] for i in send], window)
+        for i, (order_state, ex) in zip(send, results):
+            outcomes[i] = OrderOutcome(orders[i].client_order_id, '' if order_state is None else order_state.order_id, order_state, None if ex is None else ex.details())
+        return outcomes
+
+    def cancel_orders(self, account_id=None, order_ids=None, symbol=None, window=None) -> list['OrderOutcome']:
+        """Отмена нескольких заявок конвейером
+
+        :param str account_id: Номер счета. По умолчанию, первый из списка
+        :param list[str] | str order_ids: Номера заявок. None или 'all' - все активные заявки счета из GetOrders
+        :param str symbol: Отменять только заявки по инструменту тикер@биржа
+        :param int window: Макс. кол-во одновременных запросов. По умолчанию, batch_window
+        :return: Результат по каждой заявке
+        """
+        if account_id is None:  # Если не указан счет
+            account_id = self.account_ids[0]  # то берем первый из списка
+        if order_ids is None or order_ids == 'all':  # Если нужно отменить все активные заявки
+            response: orders_service.OrdersResponse = self.call_function(self.orders_stub.GetOrders, orders_service.OrdersRequest(account_id=account_id))
+            if response is None:  # Если заявки не получены
+                return []  # то отменять нечего
+            order_ids = [order_state.order_id for order_state in response.orders
+                         if order_state.status not in self.final_order_statuses and (symbol is None or order_state.order.symbol == symbol)]
+        requests = [orders_service.CancelOrderRequest(account_id=account_id, order_id=order_id) for order_id in order_ids]
+        results = self.call_functions(self.orders_stub.CancelOrder, requests, window)
+        return [OrderOutcome('' if order_state is None else order_state.order.client_order_id, order_id, order_state, None if ex is None else ex.details())
+                for order_id, (order_state, ex) in zip(order_ids, results)]
+
+    def replace_order(self, account_id, order_id, order: orders_service.Order, mode='concurrent', timeout=5.0, adjust_quantity=True) -> 'ReplaceOutcome':
+        """Замена заявки: снятие старой и выставление новой
+
+        Порядок замены mode:
+        concurrent - снятие и выставление отправляются одновременно, замена за время одного запроса. Пока старая заявка не снята, она может исполниться вместе с новой
+        cancel_first - новая заявка выставляется после снятия старой. Если старая успела исполниться, то новая не выставляется
+        place_first - старая заявка снимается после выставления новой, в стакане все время есть заявка
+
+        Если ответ на снятие пришел до окончательного статуса (например, ORDER_STATUS_PENDING_CANCEL), то окончательный статус ожидается из подписки на заявки
+
+        :param str account_id: Номер счета
+        :param str order_id: Номер заменяемой заявки
+        :param order: Новая заявка. Если клиентский номер не задан, то он присваивается
+        :param str mode: Порядок замены: concurrent, cancel_first, place_first
+        :param float timeout: Время ожидания окончательного статуса снятия из подписки на заявки в секундах
+        :param bool adjust_quantity: Уменьшать кол-во новой заявки на исполненное по старой. Только для cancel_first
+        :return: Результаты снятия и выставления. None - действие не выполнялось
+        """
+        if mode not in self.replace_modes:
+            raise ValueError(f'Неизвестный порядок замены заявки {mode}')
+        if not order.client_order_id:  # Если клиентский номер не задан
+            order.client_order_id = self.new_client_order_id()  # то присваиваем его
+        reason = None if self.risk_gate is None else self.risk_gate.check(order)
+        if reason is not None:  # Если новая заявка не прошла проверку, то старую не снимаем
+            self.logger.error('Заявка отклонена до отправки: %s. %s', reason, self.message_to_log(order))
+            return ReplaceOutcome(None, OrderOutcome(order.client_order_id, '', None, reason))
+        self.auth()  # Получаем токен JWT
+        cancel_request = orders_service.CancelOrderRequest(account_id=account_id, order_id=order_id)
+        states = []  # Изменения заменяемой заявки из подписки
+        canceled = ThreadingEvent()  # Заменяемая заявка завершена
+
+        def on_order(order_state: orders_service.OrderState):
+            if order_state.order_id == order_id:
+                states.append(order_state)
+                if order_state.status in self.final_order_statuses:
+                    canceled.set()
+
+        self.on_order.subscribe(on_order)  # Подписываемся до отправки, чтобы не пропустить изменения
+        try:
+            if mode == 'concurrent':
+                cancel_future = self.call_future(self.orders_stub.CancelOrder, cancel_request)
+                place_future = self.call_future(self.orders_stub.PlaceOrder, order)
+                cancel = self._cancel_outcome(order_id, cancel_future, states, canceled, timeout)
+                place = self._place_outcome(order, place_future)
+            elif mode == 'cancel_first':
+                cancel = self._cancel_outcome(order_id, self.call_future(self.orders_stub.CancelOrder, cancel_request), states, canceled, timeout)
+                if cancel.error is not None or cancel.order_state.status != orders_service.ORDER_STATUS_CANCELED:  # Если заявка не снята (например, исполнилась)
+                    return ReplaceOutcome(cancel, None)  # то новую не выставляем
+                executed = cancel.order_state.executed_quantity.value  # Исполнено по старой заявке
+                if adjust_quantity and executed and Decimal(executed) > 0:  # Если старая заявка исполнилась частично
+                    quantity = Decimal(order.quantity.value) - Decimal(executed)  # то уменьшаем кол-во новой
+                    if quantity <= 0:  # Если по новой заявке выставлять нечего
+                        return ReplaceOutcome(cancel, None)
+                    order.quantity.value = str(quantity)
+                place = self._place_outcome(order, self.call_future(self.orders_stub.PlaceOrder, order))
+            else:  # place_first
+                place = self._place_outcome(order, self.call_future(self.orders_stub.PlaceOrder, order))
+                if place.error is not None:  # Если новая заявка не выставлена
+                    return ReplaceOutcome(None, place)  # то старую не снимаем
+                cancel = self._cancel_outcome(order_id, self.call_future(self.orders_stub.CancelOrder, cancel_request), states, canceled, timeout)
+        finally:
+            self.on_order.unsubscribe(on_order)
+        return ReplaceOutcome(cancel, place)
+
+    def _cancel_outcome(self, order_id, future, states, canceled, timeout) -> 'OrderOutcome':
+        """Результат снятия заявки с ожиданием окончательного статуса из подписки"""
+        order_state, ex = self.future_result(future)
+        if ex is None and order_state.status not in self.final_order_statuses:  # Если снятие принято, но заявка еще не снята
+            if canceled.wait(timeout) or states:  # Если дождались окончательного статуса или есть более позднее изменение
+                order_state = states[-1]
+        return OrderOutcome('' if order_state is None else order_state.order.client_order_id, order_id, order_state, None if ex is None else ex.details())
+
+    def _place_outcome(self, order, future) -> 'OrderOutcome':
+        """Результат выставления заявки"""
+        order_state, ex = self.future_result(future)
+        return OrderOutcome(order.client_order_id, '' if order_state is None else order_state.order_id, order_state, None if ex is None else ex.details())
+
     # Подписки
 
     def subscribe_quote_thread(self, symbols):
         """Подписка на котировки по инструменту"""
-        while True:  # Пока мы не закрыли канал
-            try:
-                stream = self.marketdata_stub.SubscribeQuote(request=marketdata_service.SubscribeQuoteRequest(symbols=symbols), metadata=(self.metadata,))  # Поток подписки
-                while True:  # Пока можем получать данные из потока
-                    event: marketdata_service.SubscribeQuoteResponse = next(stream)  # Читаем событие из потока подписки
-                    self.on_quote.trigger(event)  # Вызываем событие
-            except ValueError:  # Если канал уже закрыт (Cannot invoke RPC: Channel closed!)
-                break  # то выходим из потока, дальше не продолжаем
-            except RpcError as rpc_error:
-                if rpc_error.code() == StatusCode.CANCELLED:  # Если закрываем канал (grpc._channel._MultiThreadedRendezvous)
-                    break  # то выходим из потока, дальше не продолжаем
-                else:  # При другой ошибке
-                    sleep(5)  # попытаемся переподключиться через 5 секунд
+        self._subscribe_thread(
+            f'SubscribeQuote:{",".join(symbols)}',
+            lambda: self.marketdata_stub.SubscribeQuote(request=marketdata_service.SubscribeQuoteRequest(symbols=symbols), metadata=(self.metadata,), compression=self.channel_profile.get_compression('SubscribeQuote')),
+            lambda event: self.trigger_quote(self.on_quote, event))
 
     def subscribe_order_book_thread(self, symbol):
         """Подписка на стакан по инструменту"""
-        while True:  # Пока мы не закрыли канал
-            try:
-                stream = self.marketdata_stub.SubscribeOrderBook(request=marketdata_service.SubscribeOrderBookRequest(symbol=symbol), metadata=(self.metadata,))  # Поток подписки
-                while True:  # Пока можем получать данные из потока
-                    event: marketdata_service.SubscribeOrderBookResponse = next(stream)  # Читаем событие из потока подписки
-                    self.on_order_book.trigger(event)  # Вызываем событие
-            except ValueError:  # Если канал уже закрыт (Cannot invoke RPC: Channel closed!)
-                break  # то выходим из потока, дальше не продолжаем
-            except RpcError as rpc_error:
-                if rpc_error.code() == StatusCode.CANCELLED:  # Если закрываем канал (grpc._channel._MultiThreadedRendezvous)
-                    break  # то выходим из потока, дальше не продолжаем
-                else:  # При другой ошибке
-                    sleep(5)  # попытаемся переподключиться через 5 секунд
+        self._subscribe_thread(
+            f'SubscribeOrderBook:{symbol}',
+            lambda: self.marketdata_stub.SubscribeOrderBook(request=marketdata_service.SubscribeOrderBookRequest(symbol=symbol), metadata=(self.metadata,), compression=self.channel_profile.get_compression('SubscribeOrderBook')),
+            lambda event: self.on_order_book.trigger_keyed(symbol, event))
 
     def subscribe_latest_trades_thread(self, symbol):
         """Подписка на сделки по инструменту"""
-        while True:  # Пока мы не закрыли канал
-            try:
-                stream = self.marketdata_stub.SubscribeLatestTrades(request=marketdata_service.SubscribeLatestTradesRequest(symbol=symbol), metadata=(self.metadata,))  # Поток подписки
-                while True:  # Пока можем получать данные из потока
-                    event: marketdata_service.SubscribeLatestTradesResponse = next(stream)  # Читаем событие из потока подписки
-                    self.on_latest_trades.trigger(event)  # Вызываем событие
-            except ValueError:  # Если канал уже закрыт (Cannot invoke RPC: Channel closed!)
-                break  # то выходим из потока, дальше не продолжаем
-            except RpcError as rpc_error:
-                if rpc_error.code() == StatusCode.CANCELLED:  # Если закрываем канал (grpc._channel._MultiThreadedRendezvous)
-                    break  # то выходим из потока, дальше не продолжаем
-                else:  # При другой ошибке
-                    sleep(5)  # попытаемся переподключиться через 5 секунд
+        self._subscribe_thread(
+            f'SubscribeLatestTrades:{symbol}',
+            lambda: self.marketdata_stub.SubscribeLatestTrades(request=marketdata_service.SubscribeLatestTradesRequest(symbol=symbol), metadata=(self.metadata,), compression=self.channel_profile.get_compression('SubscribeLatestTrades')),
+            lambda event: self.on_latest_trades.trigger_keyed(symbol, event))
 
     def subscribe_bars_thread(self, symbol, finam_timeframe: marketdata_service.TimeFrame.ValueType):
         """Подписка на свечи по инструменту и временнОму интервалу"""
-        while True:  # Пока мы не закрыли канал
-            try:
-                stream = self.marketdata_stub.SubscribeBars(request=marketdata_service.SubscribeBarsRequest(symbol=symbol, timeframe=finam_timeframe), metadata=(self.metadata,))  # Поток подписки
-                while True:  # Пока можем получать данные из потока
-                    event: marketdata_service.SubscribeBarsResponse = next(stream)  # Читаем событие из потока подписки
-                    self.on_new_bar.trigger(event, finam_timeframe)  # Вызываем событие
-            except ValueError:  # Если канал уже закрыт (Cannot invoke RPC: Channel closed!)
-                break  # то выходим из потока, дальше не продолжаем
-            except RpcError as rpc_error:
-                if rpc_error.code() == StatusCode.CANCELLED:  # Если закрываем канал (grpc._channel._MultiThreadedRendezvous)
-                    break  # то выходим из потока, дальше не продолжаем
-                else:  # При другой ошибке
-                    sleep(5)  # попытаемся переподключиться через 5 секунд
+        self._subscribe_thread(
+            f'SubscribeBars:{symbol}:{marketdata_service.TimeFrame.Name(finam_timeframe)}',
+            lambda: self.marketdata_stub.SubscribeBars(request=marketdata_service.SubscribeBarsRequest(symbol=symbol, timeframe=finam_timeframe), metadata=(self.metadata,), compression=self.channel_profile.get_compression('SubscribeBars')),
+            lambda event: self.on_new_bar.trigger_keyed((symbol, finam_timeframe), event, finam_timeframe))
+
+    @staticmethod
+    def trigger_quote(on_quote, event: marketdata_service.SubscribeQuoteResponse) -> None:
+        """Вызов события котировок. Подписчики по символу получают котировки только своего инструмента
+
+        :param Event on_quote: Событие котировок
+        :param event: Котировки по одному или нескольким инструментам
+        """
+        on_quote.trigger(event)  # Подписчикам на все инструменты отправляем событие целиком
+        if not on_quote.has_keyed():  # Если подписчиков по символу нет
+            return  # то событие не разбираем
+        quotes = {}  # Котировки по символу инструмента
+        for quote in event.quote:
+            quotes.setdefault(quote.symbol, []).append(quote)
+        for symbol, symbol_quotes in quotes.items():
+            if on_quote.has_keyed(symbol):  # Событие по инструменту создаем только, если на него подписались
+                on_quote.trigger_key(symbol, marketdata_service.SubscribeQuoteResponse(quote=symbol_quotes))
 
     def subscribe_orders_thread(self, account_id=None):
         """Подписка на свои заявки
@@ -185,20 +525,15 @@ class FinamPy:
         """
         if account_id is None:  # Если не указан счет
             account_id = self.account_ids[0]  # то берем первый из списка
-        while True:  # Пока мы не закрыли канал
-            try:
-                stream = self.orders_stub.SubscribeOrders(request=orders_service.SubscribeOrdersRequest(account_id=account_id), metadata=(self.metadata,))  # Поток подписки
-                while True:  # Пока можем получать данные из потока
-                    event: orders_service.SubscribeOrdersResponse = next(stream)  # Читаем событие из потока подписки
-                    for order in event.orders:  # Пробегаемся по всем пришедшим заявкам
-                        self.on_order.trigger(order)
-            except ValueError:  # Если канал уже закрыт (Cannot invoke RPC: Channel closed!)
-                break  # то выходим из потока, дальше не продолжаем
-            except RpcError as rpc_error:
-                if rpc_error.code() == StatusCode.CANCELLED:  # Если закрываем канал (grpc._channel._MultiThreadedRendezvous)
-                    break  # то выходим из потока, дальше не продолжаем
-                else:  # При другой ошибке
-                    sleep(5)  # попытаемся переподключиться через 5 секунд
+
+        def on_event(event: orders_service.SubscribeOrdersResponse):
+            for order in event.orders:  # Пробегаемся по всем пришедшим заявкам
+                self.on_order.trigger(order)
+
+        self._subscribe_thread(
+            f'SubscribeOrders:{account_id}',
+            lambda: self.orders_stub.SubscribeOrders(request=orders_service.SubscribeOrdersRequest(account_id=account_id), metadata=(self.metadata,), compression=self.channel_profile.get_compression('SubscribeOrders')),
+            on_event)
 
     def subscribe_trades_thread(self, account_id=None):
         """Подписка на свои сделки
@@ -207,48 +542,150 @@ class FinamPy:
         """
         if account_id is None:  # Если не указан счет
             account_id = self.account_ids[0]  # то берем первый из списка
-        while True:  # Пока мы не закрыли канал
-            try:
-                stream = self.orders_stub.SubscribeTrades(request=orders_service.SubscribeTradesRequest(account_id=account_id), metadata=(self.metadata,))  # Поток подписки
-                while True:  # Пока можем получать данные из потока
-                    event: orders_service.SubscribeTradesResponse = next(stream)  # Читаем событие из потока подписки
-                    for trade in event.trades:  # Пробегаемся по всем пришедшим сделкам
-                        self.on_trade.trigger(trade)
-            except ValueError:  # Если канал уже закрыт (Cannot invoke RPC: Channel closed!)
-                break  # то выходим из потока, дальше не продолжаем
-            except RpcError as rpc_error:
-                if rpc_error.code() == StatusCode.CANCELLED:  # Если закрываем канал (grpc._channel._MultiThreadedRendezvous)
-                    break  # то выходим из потока, дальше не продолжаем
-                else:  # При другой ошибке
-                    sleep(5)  # попытаемся переподключиться через 5 секунд
+
+        def on_event(event: orders_service.SubscribeTradesResponse):
+            for trade in event.trades:  # Пробегаемся по всем пришедшим сделкам
+                self.on_trade.trigger(trade)
+
+        self._subscribe_thread(
+            f'SubscribeTrades:{account_id}',
+            lambda: self.orders_stub.SubscribeTrades(request=orders_service.SubscribeTradesRequest(account_id=account_id), metadata=(self.metadata,), compression=self.channel_profile.get_compression('SubscribeTrades')),
+            on_event)
+
+    def subscribe_account_thread(self, account_id=None):
+        """Подписка на состояние счета: позиции, свободные средства, оценка
+
+        param str account_id: Номер счета
+        """
+        if account_id is None:  # Если не указан счет
+            account_id = self.account_ids[0]  # то берем первый из списка
+        self._subscribe_thread(
+            f'SubscribeAccount:{account_id}',
+            lambda: self.accounts_stub.SubscribeAccount(request=accounts_service.GetAccountRequest(account_id=account_id), metadata=(self.metadata,), compression=self.channel_profile.get_compression('SubscribeAccount')),
+            lambda event: self.on_account.trigger_keyed(event.account_id, event))
 
     def subscribe_orders_trades_thread(self):
         """Подписка на свои заявки и сделки для совместимости. В будущих версиях будет удалена Финамом"""
-        while True:  # Пока мы не закрыли канал
-            try:
-                for account_id, (orders, trades) in self.subscriptions.items():  # Для каждого счета
-                    self.subscribe_orders_trades(orders=orders, trades=trades, account_id=account_id)  # Восстанавливаем подписку
-                stream = self.orders_stub.SubscribeOrderTrade(request_iterator=self._request_order_trade_iterator(), metadata=(self.metadata,))  # Двунаправленный поток подписки
-                while True:  # Пока можем получать данные из потока
-                    event: orders_service.OrderTradeResponse = next(stream)  # Читаем событие из потока подписки
-                    if event.orders:  # Если пришли заявки
-                        for order in event.orders:
-                            self.on_order.trigger(order)
-                    if event.trades:  # Если пришли сделки
-                        for t in event.trades:
-                            self.on_trade.trigger(t)
-            except ValueError:  # Если канал уже закрыт (Cannot invoke RPC: Channel closed!)
-                break  # то выходим из потока, дальше не продолжаем
-            except RpcError as rpc_error:
-                if rpc_error.code() == StatusCode.CANCELLED:  # Если закрываем канал (grpc._channel._MultiThreadedRendezvous)
+        def subscribe():
+            previous_queue, self.order_trade_queue = self.order_trade_queue, SimpleQueue()  # У каждого подключения свой буфер команд
+            previous_queue.put(None)  # Поток запросов прежнего подключения завершаем признаком закрытия
+            for account_id, (orders, trades) in list(self.subscriptions.items()):  # Для каждого счета
+                self.subscribe_orders_trades(orders=orders, trades=trades, account_id=account_id)  # Восстанавливаем подписку
+            return self.orders_stub.SubscribeOrderTrade(request_iterator=self._request_order_trade_iterator(self.order_trade_queue), metadata=(self.metadata,), compression=self.channel_profile.get_compression('SubscribeOrderTrade'))  # Двунаправленный поток подписки
+
+        def on_event(event: orders_service.OrderTradeResponse):
+            if event.orders:  # Если пришли заявки
+                for order in event.orders:
+                    self.on_order.trigger(order)
+            if event.trades:  # Если пришли сделки
+                for t in event.trades:
+                    self.on_trade.trigger(t)
+
+        self._subscribe_thread('SubscribeOrderTrade', subscribe, on_event)
+
+    def _subscribe_thread(self, name, subscribe, on_event):
+        """Чтение потока подписки с переподключением при ошибках
+
+        :param str name: Название потока для метрик
+        :param subscribe: Функция без параметров, которая открывает поток подписки
+        :param on_event: Функция обработки события из потока подписки
+        """
+        metrics = self.metrics  # Метрики
+        handle = self.streams.get(name)  # Состояние потока подписки
+        if handle is None:  # Если поток запускается впервые
+            handle = self.streams[name] = StreamHandle(name)
+        handle.thread = current_thread()  # Поток, в котором читается подписка
+        handle.state = 'connecting'
+        handle.stop_event.clear()
+        try:
+            while not handle.stop_event.is_set():  # Пока мы не закрыли канал или не отменили подписку
+                try:
+                    handle.connected_time = time()  # Время подключения
+                    stream = subscribe()  # Поток подписки
+                    handle.call = stream  # Запоминаем вызов, чтобы его можно было отменить
+                    handle.connects += 1
+                    try:
+                        self.on_stream_connected.trigger(name, handle.connects > 1)
+                    except Exception as ex:  # Ошибка в обработчике события не должна останавливать подписку
+                        handle.callback_errors += 1
+                        handle.last_error = repr(ex)
+                        self.logger.exception('Ошибка в обработчике подключения потока подписки %s', name)
+                    last_received = None  # Время получения предыдущего события
+                    while True:  # Пока можем получать данные из потока
+                        event = next(stream)  # Читаем событие из потока подписки
+                        received = perf_counter()  # Время получения события
+                        handle.last_message_time = time()
+                        handle.messages += 1
+                        handle.state = 'streaming'
+                        if self.clock_sync is not None:  # Если задана синхронизация с часами сервера
+                            try:
+                                self.clock_sync.stamp(name, event, handle.last_message_time)  # то отмечаем событие временем получения и задержкой
+                            except Exception as ex:  # Ошибка в обработчике отметки не должна останавливать подписку и обработку события
+                                handle.callback_errors += 1
+                                handle.last_error = repr(ex)
+                                self.logger.exception('Ошибка в обработчике отметки события потока подписки %s', name)
+                        metrics.stream_message(name, None if last_received is None else received - last_received)  # Интервал между событиями
+                        last_received = received
+                        try:
+                            on_event(event)  # Вызываем событие
+                        except Exception as ex:  # Ошибка в обработчике события не должна останавливать подписку
+                            handle.callback_errors += 1
+                            handle.last_error = repr(ex)
+                            self.logger.exception('Ошибка в обработчике события потока подписки %s', name)
+                        metrics.stream_callback(name, perf_counter() - received)  # Время обработки события
+                except ValueError:  # Если канал уже закрыт (Cannot invoke RPC: Channel closed!)
                     break  # то выходим из потока, дальше не продолжаем
-                else:  # При другой ошибке
-                    sleep(5)  # попытаемся переподключиться через 5 секунд
+                except StopIteration:  # Если сервер завершил поток подписки
+                    handle.reconnects += 1
+                    handle.state = 'reconnecting'
+                    metrics.stream_reconnect(name, StatusCode.OK)
+                    handle.stop_event.wait(1)  # то переподключаемся через секунду, если подписку не отменили
+                except RpcError as rpc_error:
+                    if rpc_error.code() == StatusCode.CANCELLED and handle.resubscribe:  # Если вызов отменили для переподключения
+                        handle.resubscribe = False
+                        handle.reconnects += 1
+                        handle.state = 'reconnecting'
+                        metrics.stream_reconnect(name, rpc_error.code())  # то переподключаемся сразу
+                    elif rpc_error.code() == StatusCode.CANCELLED:  # Если закрываем канал (grpc._channel._MultiThreadedRendezvous) или отменили подписку
+                        break  # то выходим из потока, дальше не продолжаем
+                    else:  # При другой ошибке
+                        handle.reconnects += 1
+                        handle.state = 'reconnecting'
+                        handle.last_error = rpc_error.code().name
+                        metrics.stream_reconnect(name, rpc_error.code())
+                        handle.stop_event.wait(5)  # попытаемся переподключиться через 5 секунд, если подписку не отменили
+            handle.state = 'stopped'
+        except Exception as ex:  # Если поток подписки завершился с непредвиденной ошибкой
+            handle.state = 'failed'
+            handle.last_error = repr(ex)
+            self.logger.exception('Поток подписки %s завершился с ошибкой', name)
+        finally:
+            handle.call = None
+
+    def resubscribe(self, name) -> bool:
+        """Переподключение потока подписки. Текущий вызов отменяется, поток подписки открывает новый
+
+        :param str name: Название потока подписки
+        :return: True, если вызов отменен
+        """
+        handle = self.streams.get(name)
+        if handle is None or handle.call is None:  # Если потока нет или он не подключен
+            return False
+        handle.resubscribe = True  # Отмена вызова - для переподключения, а не для выхода
+        handle.call.cancel()
+        return True
 
-    def _request_order_trade_iterator(self):
-        """Генератор запросов на подписку/отписку своих заявок и сделок"""
-        while True:  # Будем пытаться читать из очереди до закрытия канала
-            yield self.order_trade_queue.get()  # Возврат из этой функции. При повторном ее вызове исполнение продолжится с этой строки
+    @staticmethod
+    def _request_order_trade_iterator(queue):
+        """Генератор запросов на подписку/отписку своих заявок и сделок
+
+        :param SimpleQueue queue: Буфер команд подключения
+        """
+        while True:  # Будем пытаться читать из очереди до закрытия канала или переподключения
+            request = queue.get()  # Ждем запрос
+            if request is None:  # Если получили признак закрытия
+                return  # то завершаем поток запросов
+            yield request  # Возврат из этой функции. При повторном ее вызове исполнение продолжится с этой строки
 
     def subscribe_orders_trades(self, orders=True, trades=True, account_id=None):
         if account_id is None:  # Если не указан счет
@@ -265,6 +702,7 @@ class FinamPy:
         else:  # Если не подписываемся
             data_type_subscribe = None
             data_type_unsubscribe = orders_service.OrderTradeRequest.DataType.DATA_TYPE_ALL
+        self.subscriptions[account_id] = (orders, trades)  # Запоминаем подписку до отправки, чтобы при переподключении она не потерялась
         if data_type_subscribe is not None:  # Если подписываемся
             self.order_trade_queue.put(orders_service.OrderTradeRequest(  # Ставим в буфер команд/сделок
                 action=orders_service.OrderTradeRequest.Action.ACTION_SUBSCRIBE,  # Подписываемся
@@ -275,18 +713,66 @@ class FinamPy:
                 action=orders_service.OrderTradeRequest.Action.ACTION_UNSUBSCRIBE,  # Отменяем подписку
                 data_type=data_type_unsubscribe,  # на свои заявки/сделки
                 account_id=account_id))  # по торговому счету
-        self.subscriptions[account_id] = (orders, trades)  # Запоминаем подписку
 
     # Выход и закрытие
 
+    def register_worker(self, name, stop) -> None:
+        """Регистрация обработчика событий со своим потоком, который останавливается при shutdown
+
+        :param str name: Название обработчика для лога
+        :param stop: Остановка обработчика stop(timeout): дождаться обработки очереди и завершения потока не дольше timeout секунд. Возвращает True, если поток завершился
+        """
+        self.workers.append((name, stop))
+
+    def unregister_worker(self, stop) -> None:
+        """Отмена регистрации обработчика событий по функции остановки"""
+        self.workers = [(name, worker_stop) for name, worker_stop in self.workers if worker_stop != stop]
+
+    def __enter__(self):
+        return self
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close_channel()
+        self.shutdown()
 
     def __del__(self):
-        self.close_channel()
+        try:  # При завершении интерпретатора модули и атрибуты могут быть уже удалены
+            self.close_channel()
+        except Exception:
+            pass
+
+    def shutdown(self, timeout=5.0) -> list[str]:
+        """Остановка всех потоков подписок и закрытие канала за ограниченное время
+
+        :param float timeout: Максимальное время ожидания завершения потоков подписок в секундах
+        :return: Названия обработчиков и потоков подписок, которые не завершились за это время
+        """
+        if self.clock_sync is not None:  # Если задана синхронизация с часами сервера
+            self.clock_sync.stop()  # то останавливаем ее
+        for handle in list(self.streams.values()):  # Отменяем все подписки
+            handle.cancel()
+        deadline = perf_counter() + timeout  # Время, до которого ждем завершения потоков
+        alive = []  # Незавершенные потоки обработчиков и подписок
+        for name, stop in list(self.workers):  # Обработчики событий останавливаем до закрытия канала, чтобы они могли выполнить действия из своих очередей
+            try:
+                if not stop(max(0.0, deadline - perf_counter())):
+                    alive.append(name)
+            except Exception:  # Ошибка остановки одного обработчика не должна мешать остановке остальных
+                self.logger.exception('Ошибка при остановке обработчика %s', name)
+        self.close_channel()  # Закрываем канал. Потоки запросов SubscribeOrderTrade завершаются признаком закрытия
+        for handle in list(self.streams.values()):
+            thread = handle.thread
+            if thread is None or thread is current_thread():  # Если поток не запускался или это текущий поток (shutdown из обработчика события)
+                continue  # то его не ждем
+            thread.join(max(0.0, deadline - perf_counter()))
+            if thread.is_alive():
+                alive.append(handle.name)
+        if alive:
+            self.logger.warning('Не завершились потоки: %s', ', '.join(alive))
+        return alive
 
     def close_channel(self):
         """Закрытие канала"""
+        self.order_trade_queue.put(None)  # Признак закрытия для потока запросов SubscribeOrderTrade
         if self.channel is not None:  # Если канал открыт
             self.channel.close()  # то закрываем канал
             self.channel = None  # Помечаем канал как закрытый
@@ -579,20 +1065,266 @@ class FinamPy:
             self.logger.fatal(f'Ошибка доступа к системному хранилищу: {e}')
 
 
+@dataclass
+class ChannelProfile:
+    """Профиль канала gRPC. Пустые значения оставляют настройки gRPC по умолчанию
+
+    Сжатие задается алгоритмом 'gzip' или 'deflate' для всего канала и/или для отдельных функций по их названию (Bars, Assets, SubscribeOrderBook, ...).
+    Сжатие применяется к запросам. Ответы сервер сжимает сам, если поддерживает алгоритм, который канал объявляет принимаемым
+    """
+    compression: Optional[str] = None  # Сжатие канала: None/'gzip'/'deflate'
+    call_compression: dict[str, Optional[str]] = field(default_factory=dict)  # Сжатие по названию функции. Перекрывает сжатие канала
+    initial_window_size: Optional[int] = None  # Начальный размер окна потока HTTP/2 в байтах. Отключает автоподбор окна (BDP)
+    max_receive_message_length: Optional[int] = None  # Максимальный размер получаемого сообщения в байтах. -1 - без ограничений
+    max_send_message_length: Optional[int] = None  # Максимальный размер отправляемого сообщения в байтах. -1 - без ограничений
+    keepalive_time_ms: Optional[int] = None  # Период отправки пингов keepalive в миллисекундах
+    keepalive_timeout_ms: Optional[int] = None  # Время ожидания ответа на пинг keepalive в миллисекундах
+    keepalive_permit_without_calls: Optional[bool] = None  # Отправлять пинги keepalive без активных вызовов
+    max_pings_without_data: Optional[int] = None  # Максимальное кол-во пингов без данных. 0 - без ограничений
+    extra_options: list[tuple[str, Any]] = field(default_factory=list)  # Дополнительные параметры канала gRPC
+
+    compression_map = {
+        None: None,  # Сжатие канала по умолчанию
+        'none': Compression.NoCompression,  # Без сжатия
+        'gzip': Compression.Gzip,
+        'deflate': Compression.Deflate,
+    }  # Справочник алгоритмов сжатия
+
+    def options(self) -> list[tuple[str, Any]]:
+        """Параметры канала gRPC"""
+        options = []  # Параметры канала
+        if self.initial_window_size is not None:  # Если задан начальный размер окна
+            options.append(('grpc.http2.lookahead_bytes', self.initial_window_size))  # то задаем его
+            options.append(('grpc.http2.bdp_probe', 0))  # и отключаем автоподбор окна, чтобы он не изменял заданный размер
+        if self.max_receive_message_length is not None:
+            options.append(('grpc.max_receive_message_length', self.max_receive_message_length))
+        if self.max_send_message_length is not None:
+            options.append(('grpc.max_send_message_length', self.max_send_message_length))
+        if self.keepalive_time_ms is not None:
+            options.append(('grpc.keepalive_time_ms', self.keepalive_time_ms))
+        if self.keepalive_timeout_ms is not None:
+            options.append(('grpc.keepalive_timeout_ms', self.keepalive_timeout_ms))
+        if self.keepalive_permit_without_calls is not None:
+            options.append(('grpc.keepalive_permit_without_calls', int(self.keepalive_permit_without_calls)))
+        if self.max_pings_without_data is not None:
+            options.append(('grpc.http2.max_pings_without_data', self.max_pings_without_data))
+        options.extend(self.extra_options)  # Дополнительные параметры добавляем в конец, чтобы они могли перекрыть заданные выше
+        return options
+
+    def get_compression(self, func_name=None) -> Optional[Compression]:
+        """Сжатие для канала или функции
+
+        :param str func_name: Полное (/grpc.tradeapi.v1.marketdata.MarketDataService/Bars) или короткое (Bars) название функции. None - сжатие канала
+        :return: Алгоритм сжатия gRPC или None, если используется сжатие канала
+        """
+        if func_name is not None:  # Если задана функция
+            short_name = func_name.rsplit('/', 1)[-1]  # Короткое название функции
+            if short_name in self.call_compression:  # Если для функции задано сжатие
+                return self.compression_map[self.call_compression[short_name]]  # то возвращаем его
+            return None  # Для остальных функций используется сжатие канала
+        return self.compression_map[self.compression]
+
+
+class ClientOrderIdGenerator:
+    """Клиентские номера заявок: возрастающие, уникальные, сортируемые по времени создания
+
+    Номер - строка из цифр и строчных латинских букв фиксированной длины (17 символов + префикс): время создания в миллисекундах (9 символов),
+    номер в пределах миллисекунды (4 символа) и случайная часть, своя у каждого процесса (4 символа). Строки сравниваются в том же порядке, что и время создания.
+    Если часы перевели назад, то время номеров не уменьшается, а продолжает расти
+    """
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'  # Цифры в порядке возрастания кодов символов
+
+    def __init__(self, prefix=''):
+        """Инициализация
+
+        :param str prefix: Префикс номеров, например, код стратегии. Не больше 3 символов, чтобы номер поместился в 20 символов
+        """
+        if len(prefix) > 3:
+            raise ValueError('Префикс клиентского номера заявки не больше 3 символов')
+        self.prefix = prefix  # Префикс номеров
+        self.salt = self.encode((os.getpid() << 20 ^ getrandbits(32)) % 36 ** 4, 4)  # Случайная часть процесса
+        self.lock = Lock()  # Номера выдаются из разных потоков
+        self.last_ms = 0  # Время последнего номера в миллисекундах
+        self.sequence = 0  # Номер в пределах миллисекунды
+
+    @classmethod
+    def encode(cls, value, width) -> str:
+        """Число в строку фиксированной длины по основанию 36"""
+        chars = []
+        for _ in range(width):
+            value, digit = divmod(value, 36)
+            chars.append(cls.digits[digit])
+        return ''.join(reversed(chars))
+
+    def next(self) -> str:
+        """Новый номер"""
+        now_ms = int(time() * 1000)
+        with self.lock:
+            if now_ms > self.last_ms:  # Если наступила новая миллисекунда
+                self.last_ms, self.sequence = now_ms, 0
+            else:  # В той же миллисекунде или часы переведены назад
+                self.sequence += 1
+                if self.sequence >= 36 ** 4:  # Если номера в миллисекунде закончились
+                    self.last_ms, self.sequence = self.last_ms + 1, 0  # то занимаем следующую
+            return f'{self.prefix}{self.encode(self.last_ms, 9)}{self.encode(self.sequence, 4)}{self.salt}'
+
+    @classmethod
+    def timestamp(cls, client_order_id, prefix='') -> float:
+        """Время создания номера в секундах, прошедших с 01.01.1970 00:00 UTC"""
+        return int(client_order_id[len(prefix):len(prefix) + 9], 36) / 1000
+
+
+class OrderOutcome(NamedTuple):
+    """Результат выставления или отмены заявки в пакете"""
+    client_order_id: str  # Клиентский номер заявки
+    order_id: str  # Номер заявки. Пусто, если заявка не выставлена
+    order_state: Optional[orders_service.OrderState]  # Состояние заявки. None - ошибка
+    error: Optional[str]  # Ошибка или причина отказа проверки заявки. None - успешно
+
+
+class ReplaceOutcome(NamedTuple):
+    """Результат замены заявки"""
+    cancel: Optional[OrderOutcome]  # Снятие старой заявки. None - не выполнялось
+    place: Optional[OrderOutcome]  # Выставление новой заявки. None - не выполнялось
+
+    @property
+    def ok(self) -> bool:
+        """Старая заявка снята, новая выставлена"""
+        return (self.cancel is not None and self.cancel.error is None and self.cancel.order_state.status == orders_service.ORDER_STATUS_CANCELED
+                and self.place is not None and self.place.error is None)
+
+
+class StreamHandle:
+    """Состояние потока подписки"""
+    def __init__(self, name):
+        self.name = name  # Название потока подписки
+        self.state = 'connecting'  # connecting - подключение, streaming - получение событий, reconnecting - переподключение, stopped - остановлен, failed - завершился с ошибкой
+        self.thread = None  # Поток, в котором читается подписка
+        self.call = None  # Текущий вызов gRPC потока подписки
+        self.resubscribe = False  # Вызов отменяется для переподключения
+        self.connected_time = 0.0  # Время последнего подключения
+        self.stop_event = ThreadingEvent()  # Подписка отменена
+        self.last_message_time = 0.0  # Время получения последнего события
+        self.messages = 0  # Кол-во событий
+        self.connects = 0  # Кол-во подключений
+        self.reconnects = 0  # Кол-во переподключений
+        self.callback_errors = 0  # Кол-во ошибок в обработчиках событий
+        self.last_error: Optional[str] = None  # Последняя ошибка
+
+    def last_message_age(self) -> Optional[float]:
+        """Сколько секунд назад было последнее событие. None - событий еще не было"""
+        return time() - self.last_message_time if self.messages else None
+
+    def cancel(self) -> None:
+        """Отмена подписки. Поток подписки завершается"""
+        self.stop_event.set()  # Прерываем ожидание переподключения
+        self.resubscribe = False
+        call = self.call
+        if call is not None:  # Если поток подключен
+            call.cancel()  # то отменяем вызов
+
+    def join(self, timeout=None) -> bool:
+        """Ожидание завершения потока подписки
+
+        :param float timeout: Максимальное время ожидания в секундах. None - без ограничения
+        :return: True, если поток завершен
+        """
+        if self.thread is not None:
+            self.thread.join(timeout)
+        return self.thread is None or not self.thread.is_alive()
+
+    def silence(self) -> float:
+        """Сколько секунд нет событий с последнего события или подключения"""
+        return time() - max(self.last_message_time, self.connected_time)
+
+
 class Event:
-    """Событие с подпиской / отменой подписки"""
-    def __init__(self):
-        self._callbacks: set[Any] = set()  # Избегаем дубликатов функций при помощи set
+    """Событие с подпиской / отменой подписки
 
-    def subscribe(self, callback) -> None:
-        """Подписаться на событие"""
-        self._callbacks.add(callback)  # Добавляем функцию в список
+    Подписка бывает на все события или по ключу: символу инструмента, для баров - символу и временнОму интервалу Финама.
+    Подписчики по ключу вызываются только для событий своего ключа.
+    Подписчики хранятся в кортежах, которые при подписке / отмене подписки заменяются новыми (копирование при записи).
+    Поэтому вызов события перебирает неизменяемый кортеж без копирования и блокировок
+    """
+    logger = logging.getLogger('FinamPy.Event')  # Будем вести лог
 
-    def unsubscribe(self, callback) -> None:
-        """Отписаться от события"""
-        self._callbacks.discard(callback)  # Удаляем функцию из списка. Если функции нет в списке, то не будет ошибки
+    def __init__(self, isolate=False):
+        """Инициализация
+
+        :param bool isolate: Перехватывать исключения каждого подписчика, чтобы ошибка одного не прерывала вызов остальных и поток подписки
+        """
+        self._callbacks: tuple[Any, ...] = ()  # Подписчики на все события в порядке подписки
+        self._keyed: dict[Any, tuple[Any, ...]] = {}  # Подписчики по ключу
+        self._lock = Lock()  # Блокировка изменения подписчиков
+        self.isolate = isolate  # Перехватывать исключения подписчиков
+        self.on_error = None  # Функция (подписчик, исключение), вызываемая при исключении подписчика. None - исключение записывается в лог
+        self.errors = 0  # Кол-во перехваченных исключений подписчиков
+
+    def subscribe(self, callback, key=None) -> None:
+        """Подписаться на событие
+
+        :param callback: Функция
+        :param key: Ключ: символ инструмента или (символ, временной интервал Финама) для баров. None - все события
+        """
+        with self._lock:
+            if key is None:  # Если подписываемся на все события
+                if callback not in self._callbacks:  # Избегаем дубликатов функций
+                    self._callbacks = (*self._callbacks, callback)  # Новый кортеж с добавленной функцией
+            else:  # Если подписываемся по ключу
+                callbacks = self._keyed.get(key, ())
+                if callback not in callbacks:
+                    self._keyed = {**self._keyed, key: (*callbacks, callback)}  # Новый словарь, чтобы вызов события не видел его изменения
+
+    def unsubscribe(self, callback, key=None) -> None:
+        """Отписаться от события. Если функция не подписана, то не будет ошибки"""
+        with self._lock:
+            if key is None:
+                self._callbacks = tuple(c for c in self._callbacks if c != callback)
+                return
+            callbacks = tuple(c for c in self._keyed.get(key, ()) if c != callback)
+            keyed = dict(self._keyed)
+            if callbacks:
+                keyed[key] = callbacks
+            else:  # Если по ключу больше нет функций
+                keyed.pop(key, None)  # то удаляем ключ, чтобы не проверять его при вызове
+            self._keyed = keyed
+
+    def has_keyed(self, key=None) -> bool:
+        """Есть ли подписчики по ключу. None - по любому ключу"""
+        return bool(self._keyed) if key is None else key in self._keyed
 
     def trigger(self, *args, **kwargs) -> None:
         """Вызвать событие"""
-        for callback in list(self._callbacks):  # Пробегаемся по копии списка, чтобы избежать исключения при удалении
+        if self.isolate:
+            self._trigger_isolated(self._callbacks, args, kwargs)
+            return
+        for callback in self._callbacks:  # Кортеж не меняется, даже если подписчик отпишется во время вызова
             callback(*args, **kwargs)  # Вызываем функцию
+
+    def trigger_key(self, key, *args, **kwargs) -> None:
+        """Вызвать событие только для подписчиков по ключу"""
+        callbacks = self._keyed.get(key)
+        if not callbacks:
+            return
+        if self.isolate:
+            self._trigger_isolated(callbacks, args, kwargs)
+            return
+        for callback in callbacks:
+            callback(*args, **kwargs)
+
+    def trigger_keyed(self, key, *args, **kwargs) -> None:
+        """Вызвать событие для подписчиков на все события и подписчиков по ключу"""
+        self.trigger(*args, **kwargs)
+        self.trigger_key(key, *args, **kwargs)
+
+    def _trigger_isolated(self, callbacks, args, kwargs) -> None:
+        """Вызов подписчиков с перехватом исключений каждого из них"""
+        for callback in callbacks:
+            try:
+                callback(*args, **kwargs)
+            except Exception as ex:  # Если в подписчике произошла ошибка
+                self.errors += 1
+                if self.on_error is None:  # Если обработчик ошибок не задан
+                    self.logger.exception('Ошибка в обработчике события %s', getattr(callback, '__qualname__', callback))
+                else:
+                    self.on_error(callback, ex)
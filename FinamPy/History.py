@@ -0,0 +1,189 @@
+import logging  # Будем вести лог
+from datetime import datetime  # Дата и время
+from threading import Lock  # Кэш используется из разных потоков
+
+import numpy as np  # Векторная агрегация баров. pip install FinamPy[numpy]
+from google.protobuf.timestamp_pb2 import Timestamp
+from google.type.interval_pb2 import Interval
+
+from FinamPy.FinamPy import FinamPy  # Временные интервалы Финама
+from FinamPy.grpc import assets_service_pb2 as assets_service  # Расписание торгов
+from FinamPy.grpc import marketdata_service_pb2 as marketdata_service  # История
+
+
+bar_dtype = np.dtype([('timestamp', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'), ('volume', 'f8')])  # Бар: время открытия в секундах UTC, цены и объем Финама
+
+
+class HistoryError(ConnectionError):
+    """Часть истории баров не загружена"""
+    def __init__(self, symbol, tf, start_dt, end_dt):
+        """Инициализация
+
+        :param str symbol: Символ инструмента тикер@биржа
+        :param str tf: Временной интервал Финама
+        :param datetime start_dt: Московское время начала незагруженной части
+        :param datetime end_dt: Московское время окончания незагруженной части
+        """
+        self.symbol = symbol  # Символ инструмента
+        self.tf = tf  # Временной интервал Финама
+        self.start_dt = start_dt  # Начало незагруженной части
+        self.end_dt = end_dt  # Окончание незагруженной части
+        super().__init__(f'История {symbol} {tf} за {start_dt} - {end_dt} не загружена')
+
+
+class History:
+    """История баров любых внутридневных временнЫх интервалов
+
+    Временные интервалы Финама (M1, M5, ..., MN3) загружаются напрямую. Остальные внутридневные (M2, M10, M45, H3 = M180, ...) строятся
+    из самого крупного временнОго интервала Финама, на который делятся без остатка и они, и начало торговой сессии
+    (M1 для M3, M5 для M10, M60 для M180 с началом сессии 10:00, M5 для M180 с началом сессии 06:50).
+    Бары выравниваются по началу торговой сессии из расписания AssetsService.Schedule. Загруженная история кэшируется.
+    Если часть истории не загружена, то вызывается HistoryError, а в кэш ничего не попадает
+    """
+    logger = logging.getLogger('FinamPy.History')  # Будем вести лог
+    native_minutes = (480, 240, 120, 60, 30, 15, 5, 1)  # Внутридневные временнЫе интервалы Финама в минутах по убыванию
+
+    def __init__(self, fp_provider, cache_size=64):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param int cache_size: Кол-во запросов в кэше
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.cache_size = cache_size  # Кол-во запросов в кэше
+        self.cache: dict[tuple, np.ndarray] = {}  # Кэш истории по инструменту, временнОму интервалу и периоду
+        self.anchors: dict[str, int] = {}  # Начало торговой сессии в секундах от начала дня по инструменту
+        self.lock = Lock()  # Блокировка кэша
+
+    @staticmethod
+    def parse_timeframe(tf, anchor=0) -> tuple[str, int]:
+        """Временной интервал Финама и кол-во минут для построения
+
+        :param str tf: Временной интервал M<минут>, H<часов> или временной интервал Финама D1/W1/MN1/MN3
+        :param int anchor: Начало торговой сессии в секундах от начала дня по московскому времени. Бары Финама не должны пересекать границы строящихся баров
+        :return: Временной интервал, из которого строятся бары, кол-во минут в баре (0 - временной интервал Финама)
+        """
+        if tf[:1] == 'H' and tf[1:].isdigit():  # Часы переводим в минуты
+            tf = f'M{int(tf[1:]) * 60}'
+        try:
+            FinamPy.timeframe_to_finam_timeframe(tf)  # Если временной интервал есть у Финама
+            return tf, 0  # то строить его не нужно
+        except NotImplementedError:
+            pass
+        if tf[:1] != 'M' or not tf[1:].isdigit() or not 0 < int(tf[1:]) <= 24 * 60:  # Строить можем только внутридневные интервалы
+            raise NotImplementedError(f'Временной интервал {tf} не поддерживается')
+        minutes = int(tf[1:])
+        anchor_minutes = anchor // 60 if anchor % 60 == 0 else 1  # Начало сессии в минутах от начала дня. Начало не на целой минуте - только M1
+        utc_offset = int(datetime.now(FinamPy.tz_msk).utcoffset().total_seconds()) // 60  # Бары Финама выравниваются по UTC, строящиеся - по московскому времени
+        native = next(m for m in History.native_minutes if minutes % m == 0 and anchor_minutes % m == 0 and utc_offset % m == 0)  # Самый крупный временной интервал Финама с общими границами. M1 подходит всегда
+        return f'M{native}', minutes
+
+    def get_bars(self, symbol, tf, start_dt, end_dt=None) -> np.ndarray:
+        """История баров
+
+        :param str symbol: Символ инструмента тикер@биржа
+        :param str tf: Временной интервал M<минут>, H<часов>, D1, W1, MN1, MN3
+        :param datetime start_dt: Московское время начала
+        :param datetime end_dt: Московское время окончания. None - текущее время
+        :return: Массив bar_dtype, отсортированный по времени
+        :raises HistoryError: Часть истории не загружена. Ничего не кэшируется
+        """
+        end_dt = datetime.now(self.fp_provider.tz_msk).replace(tzinfo=None) if end_dt is None else end_dt
+        source_tf, minutes = self.parse_timeframe(tf)
+        key = (symbol, f'M{minutes}' if minutes else source_tf, start_dt, end_dt)  # Ключ кэша
+        with self.lock:
+            bars = self.cache.get(key)
+        if bars is not None:  # Если история есть в кэше
+            return bars  # то возвращаем ее
+        anchor = 0  # Начало торговой сессии нужно только для построения баров
+        if minutes:  # Если бары нужно строить
+            anchor = self.get_anchor(symbol)
+            source_tf, _ = self.parse_timeframe(tf, anchor)  # то из временнОго интервала Финама с общими границами
+        bars = self.load(symbol, source_tf, start_dt, end_dt)  # Загружаем историю Финама
+        if minutes:  # Если бары нужно строить
+            bars = self.resample(bars, minutes * 60, anchor)
+            bars = bars[bars['timestamp'] >= self.fp_provider.msk_datetime_to_timestamp(start_dt)]  # Как и у Финама, бары открываются не раньше начала. Первый бар мог быть построен не полностью
+        if end_dt < datetime.now(self.fp_provider.tz_msk).replace(tzinfo=None):  # Кэшируем только прошлое. Текущий бар может измениться
+            with self.lock:
+                self.cache[key] = bars
+                while len(self.cache) > self.cache_size:  # Если кэш переполнен
+                    del self.cache[next(iter(self.cache))]  # то удаляем самый старый запрос
+        return bars
+
+    def load(self, symbol, tf, start_dt, end_dt) -> np.ndarray:
+        """Загрузка истории временнОго интервала Финама частями максимального размера
+
+        :param str symbol: Символ инструмента тикер@биржа
+        :param str tf: Временной интервал Финама
+        :param datetime start_dt: Московское время начала
+        :param datetime end_dt: Московское время окончания
+        :return: Массив bar_dtype
+        :raises HistoryError: Часть истории не загружена
+        """
+        finam_tf, tf_range, _ = self.fp_provider.timeframe_to_finam_timeframe(tf)  # Временной интервал Финама и максимальный размер запроса
+        chunks = []  # Части истории
+        last_timestamp = None  # Время последнего загруженного бара
+        chunk_start = start_dt
+        while chunk_start < end_dt:  # Пока не дошли до даты окончания
+            chunk_end = min(chunk_start + tf_range, end_dt)  # Запрос максимального размера
+            request = marketdata_service.BarsRequest(symbol=symbol, timeframe=finam_tf, interval=Interval(
+                start_time=Timestamp(seconds=self.fp_provider.msk_datetime_to_timestamp(chunk_start)),
+                end_time=Timestamp(seconds=self.fp_provider.msk_datetime_to_timestamp(chunk_end))))
+            response: marketdata_service.BarsResponse = self.fp_provider.call_function(self.fp_provider.marketdata_stub.Bars, request)
+            if response is None:  # Если при запросе произошла ошибка (записана в лог), то история с пропуском неверна
+                raise HistoryError(symbol, tf, chunk_start, chunk_end)
+            rows = [(bar.timestamp.seconds, float(bar.open.value), float(bar.high.value), float(bar.low.value), float(bar.close.value), float(bar.volume.value))
+                    for bar in response.bars if last_timestamp is None or bar.timestamp.seconds > last_timestamp]  # Бары на границе запросов не повторяем
+            if rows:
+                chunks.append(np.array(rows, dtype=bar_dtype))
+                last_timestamp = rows[-1][0]
+            chunk_start = chunk_end
+        self.logger.debug('Загружено бар %s %s: %s', symbol, tf, sum(len(chunk) for chunk in chunks))
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=bar_dtype)
+
+    def get_anchor(self, symbol) -> int:
+        """Начало торговой сессии инструмента в секундах от начала дня по московскому времени. По расписанию торгов, 0 - если расписания нет
+
+        :param str symbol: Символ инструмента тикер@биржа
+        """
+        anchor = self.anchors.get(symbol)
+        if anchor is not None:
+            return anchor
+        schedule: assets_service.ScheduleResponse = self.fp_provider.call_function(self.fp_provider.assets_stub.Schedule, assets_service.ScheduleRequest(symbol=symbol))
+        starts = [] if schedule is None else [self.fp_provider.timestamp_to_msk_datetime(session.interval.start_time.seconds)
+                                              for session in schedule.sessions if 'CLOSED' not in session.type.upper()]  # Начала торговых сессий
+        anchor = min((dt.hour * 3600 + dt.minute * 60 + dt.second for dt in starts), default=0)  # Самое раннее начало сессии
+        self.anchors[symbol] = anchor
+        return anchor
+
+    def resample(self, bars, seconds, anchor=0) -> np.ndarray:
+        """Построение баров большего временнОго интервала
+
+        :param np.ndarray bars: Массив bar_dtype, отсортированный по времени
+        :param int seconds: Временной интервал строящихся баров в секундах
+        :param int anchor: Начало торговой сессии в секундах от начала дня по московскому времени. От него отсчитываются бары
+        :return: Массив bar_dtype
+        """
+        if len(bars) == 0:
+            return bars
+        offset = int(datetime.now(self.fp_provider.tz_msk).utcoffset().total_seconds())  # Смещение московского времени от UTC
+        msk = bars['timestamp'] + offset  # Время по Москве
+        day_start = msk - msk % 86400  # Начало дня
+        session_start = day_start + anchor  # Начало сессии
+        bar_start = np.maximum(session_start + (msk - session_start) // seconds * seconds, day_start) - offset  # Начало бара. Бары до начала сессии не переходят на предыдущий день
+        first = np.flatnonzero(np.r_[True, bar_start[1:] != bar_start[:-1]])  # Индексы первых баров в группах
+        last = np.r_[first[1:] - 1, len(bars) - 1]  # Индексы последних баров в группах
+        result = np.empty(len(first), dtype=bar_dtype)
+        result['timestamp'] = bar_start[first]
+        result['open'] = bars['open'][first]
+        result['high'] = np.maximum.reduceat(bars['high'], first)
+        result['low'] = np.minimum.reduceat(bars['low'], first)
+        result['close'] = bars['close'][last]
+        result['volume'] = np.add.reduceat(bars['volume'], first)
+        return result
+
+    def clear_cache(self) -> None:
+        """Очистить кэш истории и расписаний"""
+        with self.lock:
+            self.cache.clear()
+            self.anchors.clear()
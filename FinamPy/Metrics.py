@@ -0,0 +1,217 @@
+from bisect import bisect_left  # Поиск корзины гистограммы
+from threading import Lock  # Метрики пишутся из разных потоков
+from time import time  # Время последнего события потока
+
+
+class Metrics:
+    """Метрики вызовов и потоков подписок. По умолчанию ничего не записывают"""
+    enabled = False  # Метрики не записываются. Размеры сообщений не вычисляются
+
+    def request(self, method, status, latency, bytes_out, bytes_in) -> None:
+        """Вызов функции
+
+        :param str method: Название функции
+        :param StatusCode status: Статус вызова
+        :param float latency: Задержка вызова в секундах
+        :param int bytes_out: Размер запроса в байтах
+        :param int bytes_in: Размер ответа в байтах
+        """
+        pass
+
+    def stream_message(self, stream, gap) -> None:
+        """Событие из потока подписки
+
+        :param str stream: Название потока
+        :param float gap: Интервал в секундах с предыдущего события или None для первого события после подключения
+        """
+        pass
+
+    def stream_callback(self, stream, duration) -> None:
+        """Обработка события потока подписки
+
+        :param str stream: Название потока
+        :param float duration: Время выполнения обработчиков события в секундах
+        """
+        pass
+
+    def stream_reconnect(self, stream, status) -> None:
+        """Переподключение потока подписки
+
+        :param str stream: Название потока
+        :param StatusCode status: Статус ошибки, из-за которой поток переподключается
+        """
+        pass
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами"""
+    default_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Верхние границы корзин в секундах
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = tuple(buckets)  # Верхние границы корзин по возрастанию
+        self.counts = [0] * (len(self.buckets) + 1)  # Кол-во значений в корзинах. Последняя корзина - значения больше всех границ
+        self.count = 0  # Кол-во значений
+        self.sum = 0.0  # Сумма значений
+        self.max = 0.0  # Максимальное значение
+
+    def observe(self, value) -> None:
+        """Добавить значение"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q) -> float:
+        """Оценка квантиля по верхней границе корзины
+
+        :param float q: Квантиль от 0 до 1
+        """
+        if self.count == 0:  # Если значений нет
+            return 0.0  # то и квантиля нет
+        rank = q * self.count  # Номер значения квантиля
+        total = 0  # Кол-во значений в просмотренных корзинах
+        for i, bucket_count in enumerate(self.counts):
+            total += bucket_count
+            if total >= rank:  # Если квантиль попал в корзину
+                return self.buckets[i] if i < len(self.buckets) else self.max  # то возвращаем ее верхнюю границу
+        return self.max
+
+    def snapshot(self) -> dict:
+        """Состояние гистограммы"""
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+                'buckets': dict(zip((*self.buckets, float('inf')), self.counts))}
+
+
+class StreamStats:
+    """Статистика потока подписки"""
+    def __init__(self):
+        self.messages = 0  # Кол-во событий
+        self.first_time = 0.0  # Время первого события
+        self.last_time = 0.0  # Время последнего события
+        self.reconnects = 0  # Кол-во переподключений
+        self.errors: dict[str, int] = {}  # Кол-во ошибок по статусу
+        self.gaps = Histogram()  # Интервалы между событиями
+        self.callbacks = Histogram()  # Время обработки событий
+
+
+class MetricsRegistry(Metrics):
+    """Метрики в памяти процесса. Состояние выдается словарем snapshot() или текстом Prometheus prometheus()"""
+    enabled = True  # Метрики записываются
+
+    def __init__(self):
+        self.lock = Lock()  # Блокировка записи метрик из разных потоков
+        self.latency: dict[str, Histogram] = {}  # Задержки вызовов по функции
+        self.errors: dict[tuple[str, str], int] = {}  # Кол-во ошибок вызовов по функции и статусу
+        self.bytes_out: dict[str, int] = {}  # Отправлено байт по функции
+        self.bytes_in: dict[str, int] = {}  # Получено байт по функции
+        self.streams: dict[str, StreamStats] = {}  # Статистика по потоку подписки
+
+    def request(self, method, status, latency, bytes_out, bytes_in) -> None:
+        with self.lock:
+            histogram = self.latency.get(method)
+            if histogram is None:  # Если функция вызывается впервые
+                histogram = self.latency[method] = Histogram()  # то создаем для нее гистограмму
+            histogram.observe(latency)
+            self.bytes_out[method] = self.bytes_out.get(method, 0) + bytes_out
+            self.bytes_in[method] = self.bytes_in.get(method, 0) + bytes_in
+            if status.name != 'OK':  # Если вызов с ошибкой
+                key = (method, status.name)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def _stream(self, stream) -> StreamStats:
+        """Статистика потока подписки. Создается при первом обращении"""
+        stats = self.streams.get(stream)
+        if stats is None:
+            stats = self.streams[stream] = StreamStats()
+        return stats
+
+    def stream_message(self, stream, gap) -> None:
+        now = time()  # Время события
+        with self.lock:
+            stats = self._stream(stream)
+            if stats.messages == 0:  # Если это первое событие потока
+                stats.first_time = now  # то запоминаем его время для расчета частоты
+            stats.messages += 1
+            stats.last_time = now
+            if gap is not None:  # Если это не первое событие после подключения
+                stats.gaps.observe(gap)
+
+    def stream_callback(self, stream, duration) -> None:
+        with self.lock:
+            self._stream(stream).callbacks.observe(duration)
+
+    def stream_reconnect(self, stream, status) -> None:
+        with self.lock:
+            stats = self._stream(stream)
+            stats.reconnects += 1
+            stats.errors[status.name] = stats.errors.get(status.name, 0) + 1
+
+    def reset(self) -> None:
+        """Сбросить все метрики"""
+        with self.lock:
+            self.latency.clear()
+            self.errors.clear()
+            self.bytes_out.clear()
+            self.bytes_in.clear()
+            self.streams.clear()
+
+    def snapshot(self) -> dict:
+        """Состояние всех метрик в виде словаря"""
+        with self.lock:
+            requests = {method: {**histogram.snapshot(),
+                                 'bytes_out': self.bytes_out.get(method, 0),
+                                 'bytes_in': self.bytes_in.get(method, 0),
+                                 'errors': {status: count for (m, status), count in self.errors.items() if m == method}}
+                        for method, histogram in self.latency.items()}
+            streams = {}
+            for stream, stats in self.streams.items():
+                elapsed = stats.last_time - stats.first_time  # Время между первым и последним событием
+                streams[stream] = {'messages': stats.messages,
+                                   'rate': (stats.messages - 1) / elapsed if elapsed > 0 else 0.0,  # Событий в секунду
+                                   'last_message_age': time() - stats.last_time if stats.messages else None,  # Сколько секунд назад было последнее событие
+                                   'reconnects': stats.reconnects,
+                                   'errors': dict(stats.errors),
+                                   'gaps': stats.gaps.snapshot(),
+                                   'callbacks': stats.callbacks.snapshot()}
+        return {'requests': requests, 'streams': streams}
+
+    def prometheus(self, prefix='finampy') -> str:
+        """Состояние всех метрик в текстовом формате Prometheus"""
+        lines = []
+
+        def histogram_lines(name, labels, histogram: Histogram):
+            total = 0  # Значения в гистограмме Prometheus накапливаются
+            for bound, bucket_count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                total += bucket_count
+                lines.append(f'{prefix}_{name}_bucket{{{labels},le="{bound}"}} {total}')
+            lines.append(f'{prefix}_{name}_sum{{{labels}}} {histogram.sum}')
+            lines.append(f'{prefix}_{name}_count{{{labels}}} {histogram.count}')
+
+        with self.lock:
+            lines.append(f'# TYPE {prefix}_request_latency_seconds histogram')
+            for method, histogram in self.latency.items():
+                histogram_lines('request_latency_seconds', f'method="{method}"', histogram)
+            lines.append(f'# TYPE {prefix}_request_errors_total counter')
+            for (method, status), count in self.errors.items():
+                lines.append(f'{prefix}_request_errors_total{{method="{method}",code="{status}"}} {count}')
+            lines.append(f'# TYPE {prefix}_request_bytes_out_total counter')
+            for method, value in self.bytes_out.items():
+                lines.append(f'{prefix}_request_bytes_out_total{{method="{method}"}} {value}')
+            lines.append(f'# TYPE {prefix}_request_bytes_in_total counter')
+            for method, value in self.bytes_in.items():
+                lines.append(f'{prefix}_request_bytes_in_total{{method="{method}"}} {value}')
+            lines.append(f'# TYPE {prefix}_stream_messages_total counter')
+            for stream, stats in self.streams.items():
+                lines.append(f'{prefix}_stream_messages_total{{stream="{stream}"}} {stats.messages}')
+            lines.append(f'# TYPE {prefix}_stream_reconnects_total counter')
+            for stream, stats in self.streams.items():
+                lines.append(f'{prefix}_stream_reconnects_total{{stream="{stream}"}} {stats.reconnects}')
+            lines.append(f'# TYPE {prefix}_stream_gap_seconds histogram')
+            for stream, stats in self.streams.items():
+                histogram_lines('stream_gap_seconds', f'stream="{stream}"', stats.gaps)
+            lines.append(f'# TYPE {prefix}_stream_callback_seconds histogram')
+            for stream, stats in self.streams.items():
+                histogram_lines('stream_callback_seconds', f'stream="{stream}"', stats.callbacks)
+        return '\n'.join(lines) + '\n'
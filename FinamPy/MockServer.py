@@ -0,0 +1,718 @@
+from concurrent.futures import ThreadPoolExecutor  # Пул потоков сервера
+from datetime import datetime, timedelta, timezone
+from itertools import count  # Номера заявок, сделок, токенов
+from math import sin  # Детерминированное движение цены
+from queue import SimpleQueue, Empty  # Очереди событий подписок на свои заявки, сделки, счет
+from threading import Lock, Thread, Event as ThreadingEvent  # Состояние заявок меняется из разных потоков
+from time import time, sleep, perf_counter
+from typing import NamedTuple, Optional
+from zlib import crc32  # Детерминированный шум цены
+
+import grpc  # Сервер и канал
+from google.protobuf.timestamp_pb2 import Timestamp
+from google.type.date_pb2 import Date
+from google.type.decimal_pb2 import Decimal
+from google.type.interval_pb2 import Interval
+from google.type.money_pb2 import Money
+
+from FinamPy.grpc import auth_service_pb2 as auth_service, auth_service_pb2_grpc
+from FinamPy.grpc import assets_service_pb2 as assets_service, assets_service_pb2_grpc
+from FinamPy.grpc import marketdata_service_pb2 as marketdata_service, marketdata_service_pb2_grpc
+from FinamPy.grpc import orders_service_pb2 as orders_service, orders_service_pb2_grpc
+from FinamPy.grpc import accounts_service_pb2 as accounts_service, accounts_service_pb2_grpc
+from FinamPy.grpc import reports_service_pb2 as reports_service, reports_service_pb2_grpc
+from FinamPy.grpc import usage_metrics_service_pb2 as usage_metrics_service, usage_metrics_service_pb2_grpc
+from FinamPy.grpc import side_pb2 as side
+from FinamPy.grpc.trade_pb2 import AccountTrade
+
+
+class MockInstrument(NamedTuple):
+    """Синтетический инструмент"""
+    ticker: str  # Тикер
+    mic: str  # Код биржи
+    board: str  # Режим торгов Финама
+    name: str  # Название
+    type: str  # Тип инструмента
+    decimals: int  # Кол-во десятичных знаков цены
+    min_step: int  # Шаг цены в единицах последнего десятичного знака
+    lot_size: int  # Лот в штуках
+    price: float  # Базовая цена
+
+    @property
+    def symbol(self) -> str:
+        """Тикер Финама"""
+        return f'{self.ticker}@{self.mic}'
+
+
+class MockServer:
+    """Локальный сервер Finam Trade API для тестов и замеров без сети и торгового токена
+
+    Инструменты синтетические. Цены, бары, котировки и стаканы детерминированы: зависят только от тикера и времени.
+    Подписки на рыночные данные выдают события с заданной частотой. Заявки исполняются по текущей цене:
+    рыночные сразу, лимитные и стоп заявки при достижении цены
+    """
+    tz_msk = timezone(timedelta(hours=3))  # Московское время без перехода на летнее время
+    session_start = timedelta(hours=10)  # Начало торговой сессии по МСК
+    session_end = timedelta(hours=19)  # Окончание торговой сессии по МСК
+    account_id = 'MOCK0001'  # Торговый счет
+    initial_cash = 1_000_000  # Начальные свободные средства в рублях
+    default_instruments = (
+        MockInstrument('SBER', 'MISX', 'TQBR', 'Сбербанк', 'EQUITIES', 2, 1, 10, 300.0),
+        MockInstrument('GAZP', 'MISX', 'TQBR', 'Газпром', 'EQUITIES', 2, 1, 10, 130.0),
+        MockInstrument('LKOH', 'MISX', 'TQBR', 'Лукойл', 'EQUITIES', 1, 5, 1, 7000.0),
+        MockInstrument('SU26238RMFS4', 'MISX', 'TQOB', 'ОФЗ 26238', 'BONDS', 3, 1, 1, 60.0),
+        MockInstrument('SiZ6', 'RTSX', 'FUT', 'Si-12.26', 'FUTURES', 0, 1, 1, 95000.0),
+    )  # Инструменты по умолчанию
+    timeframe_seconds = {
+        marketdata_service.TimeFrame.TIME_FRAME_M1: 60,
+        marketdata_service.TimeFrame.TIME_FRAME_M5: 5 * 60,
+        marketdata_service.TimeFrame.TIME_FRAME_M15: 15 * 60,
+        marketdata_service.TimeFrame.TIME_FRAME_M30: 30 * 60,
+        marketdata_service.TimeFrame.TIME_FRAME_H1: 60 * 60,
+        marketdata_service.TimeFrame.TIME_FRAME_H2: 2 * 60 * 60,
+        marketdata_service.TimeFrame.TIME_FRAME_H4: 4 * 60 * 60,
+        marketdata_service.TimeFrame.TIME_FRAME_H8: 8 * 60 * 60,
+        marketdata_service.TimeFrame.TIME_FRAME_D: 24 * 60 * 60,
+        marketdata_service.TimeFrame.TIME_FRAME_W: 7 * 24 * 60 * 60,
+        marketdata_service.TimeFrame.TIME_FRAME_MN: 30 * 24 * 60 * 60,
+        marketdata_service.TimeFrame.TIME_FRAME_QR: 91 * 24 * 60 * 60,
+    }  # Длительность бара в секундах. Месяц и квартал приблизительно
+
+    def __init__(self, port=0, latency=0.0, message_rate=10.0, instruments=None, extra_instruments=0, max_workers=64, always_open=True, compression=None):
+        """Инициализация
+
+        :param int port: Порт сервера. 0 - любой свободный
+        :param float latency: Задержка ответа на запрос и первого события подписки в секундах
+        :param float message_rate: Событий в секунду в подписках на рыночные данные. 0 - с максимальной скоростью
+        :param instruments: Инструменты MockInstrument. По умолчанию, default_instruments
+        :param int extra_instruments: Кол-во дополнительных синтетических акций для большого справочника
+        :param int max_workers: Кол-во потоков сервера. Каждая подписка занимает поток
+        :param bool always_open: Торги идут круглосуточно. Иначе, только в сессию по будним дням
+        :param str compression: Сжатие ответов сервера: None/'gzip'/'deflate'
+        """
+        self.port = port  # Порт сервера
+        self.latency = latency  # Задержка ответа в секундах
+        self.message_rate = message_rate  # Событий в секунду в подписках
+        self.max_workers = max_workers  # Кол-во потоков сервера
+        self.always_open = always_open  # Торги идут круглосуточно
+        self.compression = compression  # Сжатие ответов сервера
+        instruments = list(self.default_instruments if instruments is None else instruments)
+        instruments += [MockInstrument(f'T{i:05d}', 'MISX', 'TQBR', f'Акция {i}', 'EQUITIES', 2, 1, 10, 10.0 + i % 1000) for i in range(extra_instruments)]
+        self.instruments: dict[str, MockInstrument] = {instrument.symbol: instrument for instrument in instruments}  # Инструменты по тикеру Финама
+        self.lock = Lock()  # Блокировка состояния заявок и счета
+        self.orders: dict[str, orders_service.OrderState] = {}  # Заявки по номеру
+        self.trades: list[AccountTrade] = []  # Сделки
+        self.cash = float(self.initial_cash)  # Свободные средства
+        self.positions: dict[str, list[float]] = {}  # Позиции по тикеру Финама: [кол-во, средняя цена]
+        self.order_ids = count(1)  # Номера заявок
+        self.trade_ids = count(1)  # Номера сделок
+        self.token_ids = count(1)  # Номера токенов JWT
+        self.order_queues: list[SimpleQueue] = []  # Очереди подписок на свои заявки
+        self.trade_queues: list[SimpleQueue] = []  # Очереди подписок на свои сделки
+        self.account_queues: list[SimpleQueue] = []  # Очереди подписок на счет
+        self.stopped = ThreadingEvent()  # Сервер остановлен
+        self.server: Optional[grpc.Server] = None  # Сервер gRPC
+        self.matcher: Optional[Thread] = None  # Поток исполнения лимитных и стоп заявок
+
+    # Запуск и остановка
+
+    @property
+    def address(self) -> str:
+        """Адрес сервера"""
+        return f'localhost:{self.port}'
+
+    def start(self) -> 'MockServer':
+        """Запуск сервера"""
+        self.stopped.clear()
+        compression = {None: None, 'gzip': grpc.Compression.Gzip, 'deflate': grpc.Compression.Deflate}[self.compression]  # Алгоритм сжатия ответов gRPC
+        self.server = grpc.server(ThreadPoolExecutor(max_workers=self.max_workers), compression=compression)
+        auth_service_pb2_grpc.add_AuthServiceServicer_to_server(MockAuthService(self), self.server)
+        assets_service_pb2_grpc.add_AssetsServiceServicer_to_server(MockAssetsService(self), self.server)
+        marketdata_service_pb2_grpc.add_MarketDataServiceServicer_to_server(MockMarketDataService(self), self.server)
+        orders_service_pb2_grpc.add_OrdersServiceServicer_to_server(MockOrdersService(self), self.server)
+        accounts_service_pb2_grpc.add_AccountsServiceServicer_to_server(MockAccountsService(self), self.server)
+        reports_service_pb2_grpc.add_ReportsServiceServicer_to_server(MockReportsService(self), self.server)
+        usage_metrics_service_pb2_grpc.add_UsageMetricsServiceServicer_to_server(MockUsageMetricsService(self), self.server)
+        self.port = self.server.add_insecure_port(f'localhost:{self.port}')  # Если порт не задан, то получаем свободный
+        self.server.start()
+        self.matcher = Thread(target=self._match_thread, name='MockMatcherThread', daemon=True)
+        self.matcher.start()
+        return self
+
+    def stop(self, grace=None) -> None:
+        """Остановка сервера
+
+        :param float grace: Время в секундах на завершение текущих вызовов. None - прервать сразу
+        """
+        self.stopped.set()  # Завершаем подписки
+        if self.server is not None:
+            self.server.stop(grace).wait()
+            self.server = None
+        if self.matcher is not None:
+            self.matcher.join()
+            self.matcher = None
+
+    def connect(self, **kwargs):
+        """Провайдер FinamPy, подключенный к этому серверу
+
+        :param kwargs: Параметры FinamPy, кроме access_token и channel
+        :return: FinamPy
+        """
+        from FinamPy.FinamPy import FinamPy  # Импорт при вызове, т.к. FinamPy не зависит от тестового сервера
+        channel_profile = kwargs.get('channel_profile')
+        options = [] if channel_profile is None else channel_profile.options()
+        compression = None if channel_profile is None else channel_profile.get_compression()
+        return FinamPy('mock-access-token', channel=grpc.insecure_channel(self.address, options=options, compression=compression), **kwargs)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    # Синтетические данные
+
+    @staticmethod
+    def timestamp(seconds) -> Timestamp:
+        """Время в google.protobuf.Timestamp"""
+        return Timestamp(seconds=int(seconds), nanos=int(seconds % 1 * 1e9))
+
+    @staticmethod
+    def decimal(value, decimals=0) -> Decimal:
+        """Число в google.type.Decimal"""
+        return Decimal(value=f'{value:.{decimals}f}')
+
+    def instrument(self, symbol, context) -> MockInstrument:
+        """Инструмент по тикеру Финама. Если не найден, то вызов завершается с ошибкой NOT_FOUND"""
+        instrument = self.instruments.get(symbol)
+        if instrument is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, f'Instrument {symbol} not found')
+        return instrument
+
+    def delay(self) -> None:
+        """Задержка ответа"""
+        if self.latency > 0:
+            sleep(self.latency)
+
+    def is_trading(self, seconds) -> bool:
+        """Идут ли торги в заданное время"""
+        if self.always_open:
+            return True
+        dt = datetime.fromtimestamp(seconds, self.tz_msk)
+        since_midnight = timedelta(hours=dt.hour, minutes=dt.minute, seconds=dt.second)
+        return dt.weekday() < 5 and self.session_start <= since_midnight < self.session_end
+
+    @staticmethod
+    def noise(symbol, seconds, salt='') -> float:
+        """Детерминированный шум от -1 до 1 по тикеру и времени"""
+        return crc32(f'{symbol}:{int(seconds)}:{salt}'.encode()) / 0x7FFFFFFF - 1
+
+    def price(self, instrument: MockInstrument, seconds) -> float:
+        """Цена инструмента в заданное время, округленная до шага цены"""
+        phase = crc32(instrument.ticker.encode()) % 1000  # Сдвиг волн, чтобы инструменты двигались по-разному
+        change = 0.01 * sin((seconds + phase * 37) / 3600) + 0.03 * sin((seconds + phase * 997) / 259200) + 0.001 * self.noise(instrument.symbol, seconds)
+        step = instrument.min_step / 10 ** instrument.decimals  # Шаг цены
+        return round(round(instrument.price * (1 + change) / step) * step, instrument.decimals)
+
+    def bar_start(self, seconds, duration) -> int:
+        """Время начала бара, выровненное по московской полуночи для внутридневных баров"""
+        offset = 3 * 60 * 60  # Смещение МСК от UTC
+        if duration <= 24 * 60 * 60:
+            return int(seconds - (seconds + offset) % duration)
+        return int(seconds - seconds % duration)
+
+    def bar(self, instrument: MockInstrument, start, duration, until=None) -> marketdata_service.Bar:
+        """Бар инструмента
+
+        :param MockInstrument instrument: Инструмент
+        :param int start: Время начала бара
+        :param int duration: Длительность бара в секундах
+        :param float until: Время, до которого сформирован бар. None - бар завершен
+        """
+        end = start + duration if until is None else max(start + 1, int(until) + 1)
+        step = max(1, (end - start) // 12)  # Цену берем не чаще, чем 12 раз за бар
+        prices = [self.price(instrument, t) for t in range(start, end, step)]
+        close = self.price(instrument, end - 1)
+        prices.append(close)
+        volume = int((self.noise(instrument.symbol, start, 'volume') + 1.5) * 1000 * max(1, duration // 60) ** 0.5)
+        decimals = instrument.decimals
+        return marketdata_service.Bar(timestamp=self.timestamp(start),
+                                      open=self.decimal(prices[0], decimals), high=self.decimal(max(prices), decimals), low=self.decimal(min(prices), decimals), close=self.decimal(close, decimals),
+                                      volume=self.decimal(volume))
+
+    def quote(self, instrument: MockInstrument, seconds) -> marketdata_service.Quote:
+        """Котировка инструмента"""
+        last = self.price(instrument, seconds)
+        step = instrument.min_step / 10 ** instrument.decimals
+        day_start = self.bar_start(seconds, 24 * 60 * 60)
+        decimals = instrument.decimals
+        return marketdata_service.Quote(symbol=instrument.symbol, timestamp=self.timestamp(seconds),
+                                        ask=self.decimal(last + step, decimals), ask_size=self.decimal(100 + int(self.noise(instrument.symbol, seconds, 'ask') * 50)),
+                                        bid=self.decimal(last - step, decimals), bid_size=self.decimal(100 + int(self.noise(instrument.symbol, seconds, 'bid') * 50)),
+                                        last=self.decimal(last, decimals), last_size=self.decimal(1 + int(abs(self.noise(instrument.symbol, seconds, 'size')) * 10)),
+                                        open=self.decimal(self.price(instrument, day_start), decimals), close=self.decimal(last, decimals))
+
+    def order_book_rows(self, instrument: MockInstrument, seconds, depth=10) -> list[tuple[float, int, int]]:
+        """Строки стакана: цена, объем на продажу, объем на покупку"""
+        last = self.price(instrument, seconds)
+        step = instrument.min_step / 10 ** instrument.decimals
+        rows = []
+        for level in range(depth, 0, -1):  # Продажи сверху
+            rows.append((round(last + level * step, instrument.decimals), 10 + int(abs(self.noise(instrument.symbol, seconds, f's{level}')) * 500), 0))
+        for level in range(1, depth + 1):  # Покупки снизу
+            rows.append((round(last - level * step, instrument.decimals), 0, 10 + int(abs(self.noise(instrument.symbol, seconds, f'b{level}')) * 500)))
+        return rows
+
+    def market_trades(self, instrument: MockInstrument, seconds, count_=5) -> list[marketdata_service.Trade]:
+        """Обезличенные сделки"""
+        trades = []
+        for i in range(count_):
+            t = seconds - (count_ - 1 - i) * 0.01  # Сделки через 10 мс
+            trades.append(marketdata_service.Trade(trade_id=str(int(t * 1000)), timestamp=self.timestamp(t),
+                                                   price=self.decimal(self.price(instrument, t), instrument.decimals),
+                                                   size=self.decimal(1 + int(abs(self.noise(instrument.symbol, t * 100, 'trade')) * 20)),
+                                                   side=side.SIDE_BUY if self.noise(instrument.symbol, t * 100, 'side') > 0 else side.SIDE_SELL))
+        return trades
+
+    def paced(self, context):
+        """Генератор, задающий частоту событий подписки, пока клиент подписан и сервер работает"""
+        self.delay()
+        interval = 1 / self.message_rate if self.message_rate > 0 else 0  # Интервал между событиями
+        next_time = perf_counter()
+        while context.is_active() and not self.stopped.is_set():
+            yield
+            if interval:
+                next_time += interval
+                wait = next_time - perf_counter()
+                if wait > 0:
+                    sleep(wait)
+
+    # Заявки и счет
+
+    def place_order(self, order: orders_service.Order, context) -> orders_service.OrderState:
+        """Новая заявка"""
+        instrument = self.instrument(order.symbol, context)
+        quantity = float(order.quantity.value or 0)
+        if quantity <= 0:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Quantity must be positive')
+        if order.type not in (orders_service.ORDER_TYPE_MARKET, orders_service.ORDER_TYPE_LIMIT, orders_service.ORDER_TYPE_STOP, orders_service.ORDER_TYPE_STOP_LIMIT):
+            context.abort(grpc.StatusCode.UNIMPLEMENTED, 'Order type is not supported')
+        now = time()
+        with self.lock:
+            order_id = str(next(self.order_ids))
+            state = orders_service.OrderState(order_id=order_id, exec_id=f'E{order_id}', status=orders_service.ORDER_STATUS_NEW, order=order,
+                                              transact_at=self.timestamp(now), accept_at=self.timestamp(now),
+                                              initial_quantity=order.quantity, executed_quantity=self.decimal(0), remaining_quantity=order.quantity)
+            if order.type in (orders_service.ORDER_TYPE_STOP, orders_service.ORDER_TYPE_STOP_LIMIT):
+                state.status = orders_service.ORDER_STATUS_WATCHING  # Стоп заявка ждет условия
+            self.orders[order_id] = state
+            self._publish_order(state)
+            self._try_fill(state, instrument, now)
+            return orders_service.OrderState().FromString(state.SerializeToString())  # Копия, чтобы не отдавать изменяемое состояние
+
+    def cancel_order(self, account_id, order_id, context) -> orders_service.OrderState:
+        """Отмена заявки"""
+        with self.lock:
+            state = self.orders.get(order_id)
+            if state is None or state.order.account_id != account_id:
+                context.abort(grpc.StatusCode.NOT_FOUND, f'Order {order_id} not found')
+            if state.status not in (orders_service.ORDER_STATUS_NEW, orders_service.ORDER_STATUS_PARTIALLY_FILLED, orders_service.ORDER_STATUS_WATCHING):
+                context.abort(grpc.StatusCode.FAILED_PRECONDITION, f'Order {order_id} is not active')
+            state.status = orders_service.ORDER_STATUS_CANCELED
+            state.withdraw_at.CopyFrom(self.timestamp(time()))
+            self._publish_order(state)
+            return orders_service.OrderState().FromString(state.SerializeToString())
+
+    def _try_fill(self, state: orders_service.OrderState, instrument: MockInstrument, now) -> None:
+        """Исполнение заявки по текущей цене, если выполнено ее условие. Вызывается под блокировкой"""
+        order = state.order
+        price = self.price(instrument, now)
+        buy = order.side == side.SIDE_BUY
+        if state.status == orders_service.ORDER_STATUS_WATCHING:  # Стоп заявка
+            stop_price = float(order.stop_price.value or 0)
+            if order.stop_condition == orders_service.STOP_CONDITION_LAST_DOWN:
+                triggered = price <= stop_price
+            else:  # STOP_CONDITION_LAST_UP или не задано
+                triggered = price >= stop_price
+            if not triggered:
+                return
+            state.status = orders_service.ORDER_STATUS_NEW  # Условие выполнено. Стоп заявка исполняется как рыночная, стоп-лимит как лимитная
+        if state.status not in (orders_service.ORDER_STATUS_NEW, orders_service.ORDER_STATUS_PARTIALLY_FILLED):
+            return
+        if order.type in (orders_service.ORDER_TYPE_LIMIT, orders_service.ORDER_TYPE_STOP_LIMIT):
+            limit_price = float(order.limit_price.value or 0)
+            if buy and price > limit_price or not buy and price < limit_price:  # Если цена не дошла до лимитной
+                return  # то заявка остается в стакане
+            price = min(price, limit_price) if buy else max(price, limit_price)
+        quantity = float(state.remaining_quantity.value)
+        state.status = orders_service.ORDER_STATUS_FILLED
+        state.transact_at.CopyFrom(self.timestamp(now))  # Время последней транзакции
+        state.executed_quantity.CopyFrom(state.initial_quantity)
+        state.remaining_quantity.CopyFrom(self.decimal(0))
+        trade = AccountTrade(trade_id=str(next(self.trade_ids)), symbol=order.symbol, price=self.decimal(price, instrument.decimals), size=self.decimal(quantity),
+                             side=order.side, timestamp=self.timestamp(now), order_id=state.order_id, account_id=order.account_id)
+        self.trades.append(trade)
+        signed = quantity if buy else -quantity  # Изменение позиции
+        self.cash -= signed * price
+        position = self.positions.setdefault(order.symbol, [0.0, 0.0])
+        if position[0] == 0 or (position[0] > 0) == (signed > 0):  # Если позиция открывается или наращивается
+            position[1] = (position[0] * position[1] + signed * price) / (position[0] + signed)  # то пересчитываем среднюю цену
+        elif abs(signed) > abs(position[0]):  # Если позиция переворачивается
+            position[1] = price  # то новая позиция открыта по цене сделки
+        position[0] += signed
+        if position[0] == 0:
+            del self.positions[order.symbol]
+        self._publish_order(state)
+        for queue in list(self.trade_queues):
+            queue.put(trade)
+        self._publish_account()
+
+    def _match_thread(self) -> None:
+        """Исполнение лимитных и стоп заявок при достижении цены"""
+        while not self.stopped.wait(0.05):
+            now = time()
+            with self.lock:
+                for state in self.orders.values():
+                    if state.status in (orders_service.ORDER_STATUS_NEW, orders_service.ORDER_STATUS_PARTIALLY_FILLED, orders_service.ORDER_STATUS_WATCHING):
+                        self._try_fill(state, self.instruments[state.order.symbol], now)
+
+    def _publish_order(self, state) -> None:
+        """Рассылка состояния заявки подписчикам. Вызывается под блокировкой"""
+        copy = orders_service.OrderState().FromString(state.SerializeToString())
+        for queue in list(self.order_queues):
+            queue.put(copy)
+
+    def _publish_account(self) -> None:
+        """Рассылка состояния счета подписчикам. Вызывается под блокировкой"""
+        account = self.account()
+        for queue in list(self.account_queues):
+            queue.put(account)
+
+    def account(self) -> accounts_service.GetAccountResponse:
+        """Состояние счета. Вызывается под блокировкой"""
+        now = time()
+        positions = []
+        unrealized = 0.0
+        market_value = 0.0
+        for symbol, (quantity, average_price) in self.positions.items():
+            instrument = self.instruments[symbol]
+            current_price = self.price(instrument, now)
+            pnl = (current_price - average_price) * quantity
+            unrealized += pnl
+            market_value += current_price * quantity
+            positions.append(accounts_service.Position(symbol=symbol, quantity=self.decimal(quantity), average_price=self.decimal(average_price, instrument.decimals + 2),
+                                                       current_price=self.decimal(current_price, instrument.decimals), unrealized_pnl=self.decimal(pnl, 2)))
+        units = int(self.cash // 1)
+        return accounts_service.GetAccountResponse(account_id=self.account_id, type='UNION', status='ACCOUNT_ACTIVE',
+                                                   equity=self.decimal(self.cash + market_value, 2), unrealized_profit=self.decimal(unrealized, 2), positions=positions,
+                                                   cash=[Money(currency_code='RUB', units=units, nanos=int(round((self.cash - units) * 1e9)))])
+
+    @staticmethod
+    def queue_stream(queue: SimpleQueue, context, stopped):
+        """Генератор событий из очереди, пока клиент подписан и сервер работает"""
+        while context.is_active() and not stopped.is_set():
+            try:
+                yield queue.get(timeout=0.1)
+            except Empty:
+                continue
+
+
+class MockAuthService(auth_service_pb2_grpc.AuthServiceServicer):
+    """Подключение"""
+    def __init__(self, mock: MockServer):
+        self.mock = mock
+
+    def Auth(self, request, context):
+        self.mock.delay()
+        return auth_service.AuthResponse(token=f'mock-jwt-{next(self.mock.token_ids)}')
+
+    def TokenDetails(self, request, context):
+        self.mock.delay()
+        now = time()
+        return auth_service.TokenDetailsResponse(created_at=self.mock.timestamp(now), expires_at=self.mock.timestamp(now + 15 * 60), account_ids=[self.mock.account_id])
+
+
+class MockAssetsService(assets_service_pb2_grpc.AssetsServiceServicer):
+    """Инструменты"""
+    def __init__(self, mock: MockServer):
+        self.mock = mock
+
+    def Exchanges(self, request, context):
+        self.mock.delay()
+        return assets_service.ExchangesResponse(exchanges=[assets_service.Exchange(mic='MISX', name='Московская Биржа'), assets_service.Exchange(mic='RTSX', name='Московская Биржа - Срочный рынок')])
+
+    def _assets(self):
+        return [assets_service.Asset(symbol=i.symbol, id=str(crc32(i.symbol.encode())), ticker=i.ticker, mic=i.mic, isin=f'RU{crc32(i.symbol.encode()):010d}', type=i.type, name=i.name)
+                for i in self.mock.instruments.values()]
+
+    def Assets(self, request, context):
+        self.mock.delay()
+        return assets_service.AssetsResponse(assets=self._assets())
+
+    def AllAssets(self, request, context):
+        self.mock.delay()
+        return assets_service.AllAssetsResponse(assets=self._assets())
+
+    def GetAsset(self, request, context):
+        self.mock.delay()
+        i = self.mock.instrument(request.symbol, context)
+        expiration_date = Date(year=2026, month=12, day=17) if i.board == 'FUT' else None
+        return assets_service.GetAssetResponse(board=i.board, id=str(crc32(i.symbol.encode())), ticker=i.ticker, mic=i.mic, type=i.type, name=i.name,
+                                               decimals=i.decimals, min_step=i.min_step, lot_size=Decimal(value=str(i.lot_size)), expiration_date=expiration_date, quote_currency='RUB')
+
+    def GetAssetParams(self, request, context):
+        self.mock.delay()
+        self.mock.instrument(request.symbol, context)
+        return assets_service.GetAssetParamsResponse(symbol=request.symbol, account_id=request.account_id, tradeable=True)
+
+    def OptionsChain(self, request, context):
+        self.mock.delay()
+        return assets_service.OptionsChainResponse(symbol=request.underlying_symbol)
+
+    def Schedule(self, request, context):
+        self.mock.delay()
+        self.mock.instrument(request.symbol, context)
+        today = datetime.now(self.mock.tz_msk).replace(hour=0, minute=0, second=0, microsecond=0)
+        sessions = []
+        for day in range(7):  # Сессии на неделю вперед
+            dt = today + timedelta(days=day)
+            if dt.weekday() >= 5:  # Выходные
+                continue
+            start = (dt + self.mock.session_start).timestamp()
+            end = (dt + self.mock.session_end).timestamp()
+            sessions.append(assets_service.ScheduleResponse.Sessions(type='CORE_TRADING', interval=Interval(start_time=self.mock.timestamp(start), end_time=self.mock.timestamp(end))))
+        return assets_service.ScheduleResponse(symbol=request.symbol, sessions=sessions)
+
+    def Clock(self, request, context):
+        self.mock.delay()
+        return assets_service.ClockResponse(timestamp=self.mock.timestamp(time()))
+
+
+class MockMarketDataService(marketdata_service_pb2_grpc.MarketDataServiceServicer):
+    """Рыночные данные"""
+    def __init__(self, mock: MockServer):
+        self.mock = mock
+
+    def Bars(self, request, context):
+        self.mock.delay()
+        instrument = self.mock.instrument(request.symbol, context)
+        duration = self.mock.timeframe_seconds.get(request.timeframe)
+        if duration is None:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Timeframe is not supported')
+        start = request.interval.start_time.seconds
+        end = min(request.interval.end_time.seconds, int(time()))  # Будущих баров нет
+        bars = []
+        t = self.mock.bar_start(start, duration)
+        if t < start:
+            t += duration
+        while t < end:
+            if duration >= 24 * 60 * 60 or self.mock.is_trading(t):  # Внутридневные бары только в торговую сессию
+                bars.append(self.mock.bar(instrument, t, duration, None if t + duration <= time() else time()))
+            t += duration
+        return marketdata_service.BarsResponse(symbol=request.symbol, bars=bars)
+
+    def LastQuote(self, request, context):
+        self.mock.delay()
+        instrument = self.mock.instrument(request.symbol, context)
+        return marketdata_service.QuoteResponse(symbol=request.symbol, quote=self.mock.quote(instrument, time()))
+
+    def OrderBook(self, request, context):
+        self.mock.delay()
+        instrument = self.mock.instrument(request.symbol, context)
+        now = time()
+        rows = [marketdata_service.OrderBook.Row(price=self.mock.decimal(price, instrument.decimals), sell_size=self.mock.decimal(sell), buy_size=self.mock.decimal(buy), timestamp=self.mock.timestamp(now))
+                for price, sell, buy in self.mock.order_book_rows(instrument, now)]
+        return marketdata_service.OrderBookResponse(symbol=request.symbol, orderbook=marketdata_service.OrderBook(rows=rows))
+
+    def LatestTrades(self, request, context):
+        self.mock.delay()
+        instrument = self.mock.instrument(request.symbol, context)
+        return marketdata_service.LatestTradesResponse(symbol=request.symbol, trades=self.mock.market_trades(instrument, time()))
+
+    def SubscribeQuote(self, request, context):
+        instruments = [self.mock.instrument(symbol, context) for symbol in request.symbols]
+        for _ in self.mock.paced(context):
+            now = time()
+            yield marketdata_service.SubscribeQuoteResponse(quote=[self.mock.quote(instrument, now) for instrument in instruments])
+
+    def SubscribeOrderBook(self, request, context):
+        instrument = self.mock.instrument(request.symbol, context)
+        for _ in self.mock.paced(context):
+            now = time()
+            rows = [marketdata_service.StreamOrderBook.Row(price=self.mock.decimal(price, instrument.decimals), sell_size=self.mock.decimal(sell), buy_size=self.mock.decimal(buy),
+                                                           action=marketdata_service.StreamOrderBook.Row.ACTION_UPDATE, timestamp=self.mock.timestamp(now))
+                    for price, sell, buy in self.mock.order_book_rows(instrument, now)]
+            yield marketdata_service.SubscribeOrderBookResponse(order_book=[marketdata_service.StreamOrderBook(symbol=request.symbol, rows=rows)])
+
+    def SubscribeLatestTrades(self, request, context):
+        instrument = self.mock.instrument(request.symbol, context)
+        for _ in self.mock.paced(context):
+            yield marketdata_service.SubscribeLatestTradesResponse(symbol=request.symbol, trades=self.mock.market_trades(instrument, time(), 1))
+
+    def SubscribeBars(self, request, context):
+        instrument = self.mock.instrument(request.symbol, context)
+        duration = self.mock.timeframe_seconds.get(request.timeframe)
+        if duration is None:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Timeframe is not supported')
+        for _ in self.mock.paced(context):
+            now = time()
+            yield marketdata_service.SubscribeBarsResponse(symbol=request.symbol, bars=[self.mock.bar(instrument, self.mock.bar_start(now, duration), duration, now)])  # Формирующийся бар
+
+
+class MockOrdersService(orders_service_pb2_grpc.OrdersServiceServicer):
+    """Заявки"""
+    def __init__(self, mock: MockServer):
+        self.mock = mock
+
+    def PlaceOrder(self, request, context):
+        self.mock.delay()
+        return self.mock.place_order(request, context)
+
+    def CancelOrder(self, request, context):
+        self.mock.delay()
+        return self.mock.cancel_order(request.account_id, request.order_id, context)
+
+    def GetOrders(self, request, context):
+        self.mock.delay()
+        with self.mock.lock:
+            return orders_service.OrdersResponse(orders=[state for state in self.mock.orders.values() if state.order.account_id == request.account_id])
+
+    def GetOrder(self, request, context):
+        self.mock.delay()
+        with self.mock.lock:
+            state = self.mock.orders.get(request.order_id)
+            if state is None or state.order.account_id != request.account_id:
+                context.abort(grpc.StatusCode.NOT_FOUND, f'Order {request.order_id} not found')
+            return state
+
+    def SubscribeOrders(self, request, context):
+        queue = SimpleQueue()
+        self.mock.order_queues.append(queue)
+        try:
+            for state in self.mock.queue_stream(queue, context, self.mock.stopped):
+                if state.order.account_id == request.account_id:
+                    yield orders_service.SubscribeOrdersResponse(orders=[state])
+        finally:
+            self.mock.order_queues.remove(queue)
+
+    def SubscribeTrades(self, request, context):
+        queue = SimpleQueue()
+        self.mock.trade_queues.append(queue)
+        try:
+            for trade in self.mock.queue_stream(queue, context, self.mock.stopped):
+                if trade.account_id == request.account_id:
+                    yield orders_service.SubscribeTradesResponse(trades=[trade])
+        finally:
+            self.mock.trade_queues.remove(queue)
+
+    def SubscribeOrderTrade(self, request_iterator, context):
+        subscriptions: dict[str, int] = {}  # Тип данных подписки по счету
+        queue = SimpleQueue()  # Общая очередь заявок и сделок
+
+        def read_requests():
+            try:
+                for request in request_iterator:  # Подписки и отписки от клиента
+                    if request.action == orders_service.OrderTradeRequest.Action.ACTION_SUBSCRIBE:
+                        subscriptions[request.account_id] = request.data_type
+                    else:
+                        subscriptions.pop(request.account_id, None)
+            except grpc.RpcError:  # Клиент отменил вызов
+                pass
+
+        Thread(target=read_requests, name='MockOrderTradeRequestsThread', daemon=True).start()
+        self.mock.order_queues.append(queue)
+        self.mock.trade_queues.append(queue)
+        data_type = orders_service.OrderTradeRequest.DataType
+        try:
+            for item in self.mock.queue_stream(queue, context, self.mock.stopped):
+                if isinstance(item, orders_service.OrderState):
+                    if subscriptions.get(item.order.account_id) in (data_type.DATA_TYPE_ALL, data_type.DATA_TYPE_ORDERS):
+                        yield orders_service.OrderTradeResponse(orders=[item])
+                elif subscriptions.get(item.account_id) in (data_type.DATA_TYPE_ALL, data_type.DATA_TYPE_TRADES):
+                    yield orders_service.OrderTradeResponse(trades=[item])
+        finally:
+            self.mock.order_queues.remove(queue)
+            self.mock.trade_queues.remove(queue)
+
+
+class MockAccountsService(accounts_service_pb2_grpc.AccountsServiceServicer):
+    """Счета"""
+    def __init__(self, mock: MockServer):
+        self.mock = mock
+
+    def GetAccount(self, request, context):
+        self.mock.delay()
+        if request.account_id != self.mock.account_id:
+            context.abort(grpc.StatusCode.NOT_FOUND, f'Account {request.account_id} not found')
+        with self.mock.lock:
+            return self.mock.account()
+
+    def _trades(self, request):
+        """Свои сделки счета за интервал не больше лимита"""
+        start = request.interval.start_time.seconds + request.interval.start_time.nanos / 1e9
+        end = request.interval.end_time.seconds + request.interval.end_time.nanos / 1e9 if request.interval.HasField('end_time') else float('inf')
+        with self.mock.lock:
+            trades = [trade for trade in self.mock.trades
+                      if trade.account_id == request.account_id and start <= trade.timestamp.seconds + trade.timestamp.nanos / 1e9 < end]
+        return trades[:request.limit] if request.limit > 0 else trades
+
+    def Trades(self, request, context):
+        self.mock.delay()
+        return accounts_service.TradesResponse(trades=self._trades(request))
+
+    def Transactions(self, request, context):
+        self.mock.delay()
+        transactions = []
+        for trade in self._trades(request):
+            size = float(trade.size.value)
+            amount = size * float(trade.price.value) * (-1 if trade.side == side.SIDE_BUY else 1)  # Покупка уменьшает деньги
+            units = int(amount)
+            transactions.append(accounts_service.Transaction(id=trade.trade_id, category='TRADE', timestamp=trade.timestamp, symbol=trade.symbol,
+                                                             change=Money(currency_code='RUB', units=units, nanos=int(round((amount - units) * 1e9))),
+                                                             trade=accounts_service.Transaction.Trade(size=trade.size, price=trade.price),
+                                                             transaction_name='Сделка', change_qty=Decimal(value=str(size if trade.side == side.SIDE_BUY else -size))))
+        return accounts_service.TransactionsResponse(transactions=transactions)
+
+    def SubscribeAccount(self, request, context):
+        queue = SimpleQueue()
+        with self.mock.lock:
+            queue.put(self.mock.account())  # Сначала текущее состояние счета
+            self.mock.account_queues.append(queue)
+        try:
+            for account in self.mock.queue_stream(queue, context, self.mock.stopped):
+                if account.account_id == request.account_id:
+                    yield account
+        finally:
+            self.mock.account_queues.remove(queue)
+
+
+class MockReportsService(reports_service_pb2_grpc.ReportsServiceServicer):
+    """Отчеты. Отчет готов сразу после создания"""
+    def __init__(self, mock: MockServer):
+        self.mock = mock
+        self.reports: dict[str, reports_service.AccountReportInfo] = {}  # Отчеты по номеру
+        self.report_ids = count(1)  # Номера отчетов
+
+    def CreateAccountReport(self, request, context):
+        self.mock.delay()
+        report_id = str(next(self.report_ids))
+        self.reports[report_id] = reports_service.AccountReportInfo(report_id=report_id, status=reports_service.SUCCESS, date_range=request.date_range,
+                                                                    report_form=request.report_form, account_id=request.account_id)
+        self.reports[report_id].url.value = f'http://{self.mock.address}/reports/{report_id}'
+        return reports_service.CreateAccountReportResponse(report_id=report_id)
+
+    def GetAccountReportInfo(self, request, context):
+        self.mock.delay()
+        info = self.reports.get(request.report_id, reports_service.AccountReportInfo(report_id=request.report_id, status=reports_service.NOT_FOUND))
+        return reports_service.GetAccountReportInfoResponse(info=info)
+
+
+class MockUsageMetricsService(usage_metrics_service_pb2_grpc.UsageMetricsServiceServicer):
+    """Использование квот"""
+    def __init__(self, mock: MockServer):
+        self.mock = mock
+
+    def GetUsageMetrics(self, request, context):
+        self.mock.delay()
+        quota = usage_metrics_service.GetUsageMetricsResponse.QuotaUsage(name='requests_per_minute', limit=200, remaining=200, reset_time=self.mock.timestamp(time() + 60))
+        return usage_metrics_service.GetUsageMetricsResponse(quotas=[quota])
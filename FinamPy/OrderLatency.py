@@ -0,0 +1,154 @@
+from threading import Lock  # Отметки пишутся из разных потоков
+from time import perf_counter  # Монотонное время отметок
+from typing import Optional
+
+from FinamPy.Metrics import Histogram  # Гистограммы задержек
+from FinamPy.grpc import orders_service_pb2 as orders_service  # Заявки
+from FinamPy.grpc.trade_pb2 import AccountTrade  # Свои сделки
+
+
+class OrderTimeline:
+    """Отметки времени жизни заявки в секундах perf_counter"""
+    def __init__(self, client_order_id, symbol, order_type, submit):
+        self.client_order_id = client_order_id  # Клиентский номер заявки
+        self.symbol = symbol  # Символ инструмента тикер@биржа
+        self.order_type = order_type  # Тип заявки, например, ORDER_TYPE_LIMIT
+        self.order_id = ''  # Номер заявки. Пусто, пока не известен
+        self.submit = submit  # Отправка PlaceOrder
+        self.ack: Optional[float] = None  # Ответ на PlaceOrder
+        self.error = False  # PlaceOrder завершился ошибкой
+        self.first_update: Optional[float] = None  # Первое изменение заявки из подписки
+        self.fills: list[float] = []  # Сделки по заявке из подписки
+
+
+class OrderLatency:
+    """Задержки заявок: от отправки до ответа на PlaceOrder, первого изменения из подписки на заявки и сделок из подписки на сделки
+
+    Отметки ставятся по клиентскому номеру заявки. Задержки собираются в гистограммы по инструменту и типу заявки.
+    Выставление заявок через place_order, place_orders, place_order_idempotent и replace_order провайдера отмечается автоматически после start()
+    """
+    stages = ('ack', 'first_update', 'first_fill', 'fill')  # Этапы, задержки до которых от отправки заявки собираются. fill - каждая сделка
+
+    def __init__(self, fp_provider, max_orders=10000):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param int max_orders: Макс. кол-во хранимых заявок. Отметки самых старых заявок удаляются
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.max_orders = max_orders  # Макс. кол-во хранимых заявок
+        self.timelines: dict[str, OrderTimeline] = {}  # Отметки по клиентскому номеру в порядке отправки
+        self.order_ids: dict[str, str] = {}  # Клиентский номер по номеру заявки
+        self.pending_fills: dict[str, list[float]] = {}  # Сделки, пришедшие до того, как стал известен номер заявки
+        self.histograms: dict[tuple[str, str, str], Histogram] = {}  # Гистограммы по инструменту, типу заявки и этапу
+        self.lock = Lock()  # Блокировка отметок
+
+    def start(self) -> 'OrderLatency':
+        """Начало отметок"""
+        self.fp_provider.order_latency = self
+        self.fp_provider.on_order.subscribe(self.on_order)
+        self.fp_provider.on_trade.subscribe(self.on_trade)
+        return self
+
+    def stop(self) -> None:
+        """Окончание отметок"""
+        self.fp_provider.order_latency = None
+        self.fp_provider.on_order.unsubscribe(self.on_order)
+        self.fp_provider.on_trade.unsubscribe(self.on_trade)
+
+    def sent(self, order: orders_service.Order) -> None:
+        """Отправка PlaceOrder"""
+        now = perf_counter()
+        if not order.client_order_id:  # Без клиентского номера заявку не сопоставить
+            return
+        with self.lock:
+            self.timelines[order.client_order_id] = OrderTimeline(order.client_order_id, order.symbol, orders_service.OrderType.Name(order.type), now)
+            while len(self.timelines) > self.max_orders:  # Удаляем самые старые заявки
+                old = self.timelines.pop(next(iter(self.timelines)))
+                self.order_ids.pop(old.order_id, None)
+                self.pending_fills.pop(old.order_id, None)
+
+    def acknowledged(self, order: orders_service.Order, order_state: Optional[orders_service.OrderState]) -> None:
+        """Ответ на PlaceOrder
+
+        :param order: Заявка
+        :param order_state: Состояние заявки. None - PlaceOrder завершился ошибкой
+        """
+        now = perf_counter()
+        with self.lock:
+            timeline = self.timelines.get(order.client_order_id)
+            if timeline is None or timeline.ack is not None:  # Если заявка не отмечалась или ответ уже отмечен
+                return
+            timeline.ack = now
+            if order_state is None:
+                timeline.error = True
+                return
+            self.observe(timeline, 'ack', now)
+            self.set_order_id(timeline, order_state.order_id)
+
+    def on_order(self, order_state: orders_service.OrderState) -> None:
+        """Изменение заявки из подписки"""
+        now = perf_counter()
+        with self.lock:
+            timeline = self.timelines.get(order_state.order.client_order_id) or self.timelines.get(self.order_ids.get(order_state.order_id, ''))
+            if timeline is None or timeline.first_update is not None:  # Если заявка не отмечалась или первое изменение уже отмечено
+                return
+            timeline.first_update = now
+            self.observe(timeline, 'first_update', now)
+            self.set_order_id(timeline, order_state.order_id)
+
+    def on_trade(self, trade: AccountTrade) -> None:
+        """Сделка из подписки"""
+        now = perf_counter()
+        with self.lock:
+            client_order_id = self.order_ids.get(trade.order_id)
+            if client_order_id is None:  # Если номер заявки еще не известен (сделка пришла раньше ответа на PlaceOrder)
+                self.pending_fills.setdefault(trade.order_id, []).append(now)  # то отметим сделку, когда он станет известен
+                while len(self.pending_fills) > self.max_orders:  # Сделки не своих заявок не накапливаем
+                    self.pending_fills.pop(next(iter(self.pending_fills)))
+                return
+            self.add_fill(self.timelines[client_order_id], now)
+
+    def set_order_id(self, timeline, order_id) -> None:
+        """Номер заявки стал известен. Вызывается под блокировкой"""
+        if timeline.order_id or not order_id:  # Если номер уже известен
+            return
+        timeline.order_id = order_id
+        self.order_ids[order_id] = timeline.client_order_id
+        for fill_time in self.pending_fills.pop(order_id, ()):  # Сделки, пришедшие раньше
+            self.add_fill(timeline, fill_time)
+
+    def add_fill(self, timeline, fill_time) -> None:
+        """Сделка по заявке. Вызывается под блокировкой"""
+        timeline.fills.append(fill_time)
+        if len(timeline.fills) == 1:
+            self.observe(timeline, 'first_fill', fill_time)
+        self.observe(timeline, 'fill', fill_time)
+
+    def observe(self, timeline, stage, stage_time) -> None:
+        """Задержка от отправки до этапа. Вызывается под блокировкой"""
+        key = (timeline.symbol, timeline.order_type, stage)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(stage_time - timeline.submit)
+
+    def get_timeline(self, client_order_id) -> Optional[OrderTimeline]:
+        """Отметки заявки по клиентскому номеру"""
+        return self.timelines.get(client_order_id)
+
+    def snapshot(self) -> dict:
+        """Гистограммы задержек по инструменту, типу заявки и этапу"""
+        result = {}
+        with self.lock:
+            for (symbol, order_type, stage), histogram in self.histograms.items():
+                result.setdefault(symbol, {}).setdefault(order_type, {})[stage] = histogram.snapshot()
+        return result
+
+    def reset(self) -> None:
+        """Сбросить отметки и гистограммы"""
+        with self.lock:
+            self.timelines.clear()
+            self.order_ids.clear()
+            self.pending_fills.clear()
+            self.histograms.clear()
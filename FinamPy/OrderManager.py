@@ -0,0 +1,445 @@
+import logging  # Будем вести лог
+from decimal import Decimal, ROUND_FLOOR, ROUND_CEILING  # Стоп цена по шагу цены
+from queue import SimpleQueue  # Очередь действий
+from threading import Thread, RLock, current_thread  # Поток действий, изменение групп и стопов из разных потоков подписок
+from time import sleep  # Пауза между попытками восстановления
+from typing import Optional
+
+from FinamPy.FinamPy import FinamPy, OrderOutcome, Event  # Статусы завершенных заявок, результат выставления заявки, событие потери стоп заявки
+from FinamPy.grpc import orders_service_pb2 as orders_service  # Заявки
+from FinamPy.grpc import marketdata_service_pb2 as marketdata_service  # Котировки
+from FinamPy.grpc.side_pb2 import SIDE_BUY  # Направление заявки
+from FinamPy.grpc.trade_pb2 import AccountTrade  # Свои сделки
+
+
+class TrailingStop:
+    """Следящая стоп заявка"""
+    def __init__(self, order_state: orders_service.OrderState, distance, step):
+        self.order_state = order_state  # Состояние стоп заявки
+        self.distance = distance  # Расстояние стоп цены от последней цены
+        self.step = step  # Минимальное изменение стоп цены для переставления заявки
+        self.stop_price = Decimal(order_state.order.stop_price.value or '0')  # Текущая стоп цена
+        self.moving = False  # Заявка переставляется
+
+
+class OrderManager:
+    """Группы OCO (одна отменяет другие) и следящие стоп заявки на стороне клиента
+
+    Реагирует на события провайдера on_order, on_trade и котировки on_quote, без опроса GetOrders. При сделке по заявке группы остальные заявки группы снимаются.
+    Стоп цена следящей заявки переставляется за последней ценой на заданном расстоянии, только в сторону прибыли.
+    Группа и параметры слежения записываются в комментарий заявки, поэтому после перезапуска состояние восстанавливается из GetOrders.
+    Снятие и переставление заявок выполняются в отдельном потоке, чтобы не задерживать потоки подписок.
+    Если при переставлении старая заявка снята, а новая не выставлена, то заявка выставляется повторно по новой, а затем по прежней стоп цене.
+    Если и это не удалось, то вызывается событие on_stop_lost: позиция осталась без стоп заявки.
+    Котировки по инструментам следящих заявок должны быть подписаны subscribe_quote_thread
+    """
+    logger = logging.getLogger('FinamPy.OrderManager')  # Будем вести лог
+    tag = 'FPOM'  # Признак заявки менеджера в начале комментария
+
+    def __init__(self, fp_provider, account_ids=None, replace_mode='cancel_first'):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param list[str] account_ids: Номера счетов, заявки которых восстанавливаются. По умолчанию, все счета провайдера
+        :param str replace_mode: Порядок переставления следящей заявки replace_order. По умолчанию, сначала снятие, чтобы не было двух стоп заявок сразу
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.account_ids = list(fp_provider.account_ids if account_ids is None else account_ids)  # Номера счетов
+        self.replace_mode = replace_mode  # Порядок переставления следящей заявки
+        self.groups: dict[str, dict[str, orders_service.OrderState]] = {}  # Активные заявки по номеру группы OCO
+        self.order_groups: dict[str, str] = {}  # Номер группы по номеру заявки
+        self.trailing: dict[str, TrailingStop] = {}  # Следящие стоп заявки по номеру заявки
+        self.trailing_symbols: dict[str, set[str]] = {}  # Номера следящих заявок по символу инструмента
+        self.triggered: dict[str, str] = {}  # Номер исполнившейся заявки по номеру активной группы OCO. Заявки группы, выставленные позже, тоже снимаются
+        self.finished: dict[str, str] = {}  # Номер исполнившейся заявки по номеру завершенной группы OCO. Храним только последние
+        self.executions: dict[str, None] = {}  # Номера заявок со сделками, пришедшими раньше ответа на выставление
+        self.lock = RLock()  # Блокировка групп и следящих заявок
+        self.actions: SimpleQueue = SimpleQueue()  # Очередь действий: функция и параметры. None - остановка
+        self.thread: Optional[Thread] = None  # Поток действий
+        self.on_stop_lost = Event()  # Следящая заявка снята, но не выставлена заново или ее состояние неизвестно (номер снятой заявки, заявка, которую выставить не удалось)
+
+    # Запуск и остановка
+
+    def start(self) -> 'OrderManager':
+        """Восстановление состояния из GetOrders и начало работы по событиям провайдера. Потоки подписок запускаются отдельно"""
+        self.thread = Thread(target=self._run, name='OrderManagerThread', daemon=True)
+        self.thread.start()
+        self.fp_provider.register_worker('OrderManager', self.stop)  # Провайдер останавливает поток действий при shutdown
+        self.fp_provider.on_order.subscribe(self.on_order)
+        self.fp_provider.on_trade.subscribe(self.on_trade)
+        try:
+            self.restore()
+        except ConnectionError:  # Без восстановленного состояния работать нельзя
+            self.stop()
+            raise
+        return self
+
+    def stop(self, timeout=None) -> bool:
+        """Окончание работы. Действия, уже поставленные в очередь, выполняются. Заявки остаются на сервере
+
+        :param float timeout: Максимальное время ожидания завершения потока действий в секундах. None - без ограничения
+        :return: True, если поток действий завершился
+        """
+        self.fp_provider.unregister_worker(self.stop)
+        self.fp_provider.on_order.unsubscribe(self.on_order)
+        self.fp_provider.on_trade.unsubscribe(self.on_trade)
+        with self.lock:
+            for symbol in self.trailing_symbols:
+                self.fp_provider.on_quote.unsubscribe(self.on_quote, key=symbol)
+        thread, self.thread = self.thread, None
+        if thread is None:  # Если поток действий не запускался или уже остановлен
+            return True
+        self.actions.put(None)  # Признак остановки после действий в очереди
+        if thread is current_thread():  # Если остановка из самого потока действий
+            return True  # то он завершится после текущего действия
+        thread.join(timeout)
+        if thread.is_alive():
+            self.logger.warning('Поток действий не завершился за %s с', timeout)
+            return False
+        return True
+
+    def _run(self) -> None:
+        """Поток действий"""
+        while True:
+            action = self.actions.get()
+            if action is None:  # Если пришел признак остановки
+                return
+            func, args = action
+            try:
+                func(*args)
+            except Exception:  # Ошибка одного действия не должна останавливать поток
+                self.logger.exception('Ошибка при выполнении %s%s', func.__name__, args)
+
+    # Комментарий заявки
+
+    @classmethod
+    def make_comment(cls, group_id=None, distance=None, step=None, comment='') -> str:
+        """Комментарий заявки менеджера: признак, группа OCO, параметры слежения и комментарий пользователя
+
+        :param str group_id: Номер группы OCO
+        :param distance: Расстояние стоп цены от последней цены
+        :param step: Минимальное изменение стоп цены
+        :param str comment: Комментарий пользователя
+        """
+        parts = [cls.tag]
+        if group_id is not None:
+            parts.append(f'oco={group_id}')
+        if distance is not None:
+            parts.append(f'trail={distance},{step or 0}')
+        if comment:
+            parts.append(comment)
+        return ';'.join(parts)[:128]  # Комментарий заявки не больше 128 символов
+
+    @classmethod
+    def parse_comment(cls, comment) -> Optional[dict]:
+        """Группа OCO и параметры слежения из комментария заявки. None - заявка не менеджера"""
+        parts = comment.split(';')
+        if parts[0] != cls.tag:
+            return None
+        result = {'group_id': None, 'distance': None, 'step': None}
+        for part in parts[1:]:
+            name, _, value = part.partition('=')
+            if name == 'oco':
+                result['group_id'] = value
+            elif name == 'trail':
+                distance, _, step = value.partition(',')
+                result['distance'], result['step'] = Decimal(distance), Decimal(step or '0')
+        return result
+
+    # Выставление заявок
+
+    def place_oco(self, orders, group_id=None) -> list[OrderOutcome]:
+        """Выставление группы OCO: при сделке по любой заявке группы остальные заявки снимаются
+
+        :param list[orders_service.Order] orders: Заявки группы
+        :param str group_id: Номер группы. По умолчанию, новый
+        :return: Результат по каждой заявке
+        """
+        group_id = group_id or self.fp_provider.new_client_order_id()
+        for order in orders:
+            order.comment = self.make_comment(group_id=group_id, comment=order.comment)
+        outcomes = self.fp_provider.place_orders(orders)
+        for outcome in outcomes:
+            if outcome.order_state is not None:
+                self.track(outcome.order_state)
+        if any(outcome.error is not None for outcome in outcomes):  # Если группа выставлена не полностью
+            self.logger.warning('Группа OCO %s выставлена не полностью', group_id)
+        return outcomes
+
+    def place_trailing_stop(self, order: orders_service.Order, distance, step=0) -> Optional[orders_service.OrderState]:
+        """Выставление следящей стоп заявки
+
+        :param order: Стоп заявка (ORDER_TYPE_STOP или ORDER_TYPE_STOP_LIMIT) с начальной стоп ценой. На продажу стоп цена ниже последней цены, на покупку - выше
+        :param distance: Расстояние стоп цены от последней цены
+        :param step: Минимальное изменение стоп цены для переставления заявки. 0 - на каждый шаг цены
+        :return: Состояние заявки или None, если заявка не выставлена
+        """
+        group = self.parse_comment(order.comment)
+        group_id = None if group is None else group['group_id']  # Следящая заявка может входить в группу OCO
+        order.comment = self.make_comment(group_id=group_id, distance=Decimal(str(distance)), step=Decimal(str(step)))
+        order_state = self.fp_provider.place_order(order)
+        if order_state is not None:
+            self.track(order_state)
+        return order_state
+
+    def track(self, order_state: orders_service.OrderState) -> None:
+        """Отслеживание заявки менеджера по комментарию"""
+        params = self.parse_comment(order_state.order.comment)
+        if params is None:  # Если заявка не менеджера
+            return
+        order_id = order_state.order_id
+        group_id = params['group_id']
+        final = order_state.status in FinamPy.final_order_statuses  # Заявка завершена
+        if params['distance'] is not None and not final:  # Спецификацию инструмента следящей заявки загружаем заранее
+            self.fp_provider.get_symbol_info(*order_state.order.symbol.rsplit('@', 1))
+        with self.lock:
+            executed = self.executed(order_state) or order_id in self.executions  # По заявке уже были сделки
+            self.executions.pop(order_id, None)
+            if group_id is not None:
+                if executed:  # Если по заявке уже были сделки
+                    self.trigger(group_id, order_id)
+                elif self.executed_order(group_id) is not None:  # Если группа уже исполнилась
+                    self.actions.put((self.cancel_siblings, (group_id, self.executed_order(group_id))))  # то заявку тоже снимаем
+                if not final:
+                    self.groups.setdefault(group_id, {})[order_id] = order_state
+                    self.order_groups[order_id] = group_id
+            if final:  # Завершенную заявку не отслеживаем
+                return
+            if params['distance'] is not None and order_id not in self.trailing:
+                self.trailing[order_id] = TrailingStop(order_state, params['distance'], params['step'])
+                symbol = order_state.order.symbol
+                if symbol not in self.trailing_symbols:  # Если по инструменту еще нет следящих заявок
+                    self.trailing_symbols[symbol] = set()
+                    self.fp_provider.on_quote.subscribe(self.on_quote, key=symbol)  # то подписываемся на его котировки
+                self.trailing_symbols[symbol].add(order_id)
+
+    def untrack(self, order_id) -> Optional[str]:
+        """Окончание отслеживания заявки
+
+        :return: Номер группы OCO заявки или None
+        """
+        with self.lock:
+            group_id = self.order_groups.pop(order_id, None)
+            if group_id is not None:
+                group = self.groups.get(group_id, {})
+                group.pop(order_id, None)
+                if not group:  # Если в группе больше нет активных заявок
+                    self.groups.pop(group_id, None)
+                    self.finish_group(group_id)
+            trailing_stop = self.trailing.pop(order_id, None)
+            if trailing_stop is not None:
+                symbol = trailing_stop.order_state.order.symbol
+                order_ids = self.trailing_symbols.get(symbol, set())
+                order_ids.discard(order_id)
+                if not order_ids:  # Если по инструменту больше нет следящих заявок
+                    self.trailing_symbols.pop(symbol, None)
+                    self.fp_provider.on_quote.unsubscribe(self.on_quote, key=symbol)  # то котировки по нему больше не нужны
+        return group_id
+
+    def restore(self, attempts=5, delay=1.0) -> None:
+        """Восстановление групп OCO и следящих заявок из GetOrders после перезапуска
+
+        :param int attempts: Макс. кол-во запросов GetOrders по каждому счету
+        :param float delay: Пауза перед вторым запросом в секундах. Перед каждым следующим удваивается
+        :raises ConnectionError: Заявки счета не получены за attempts запросов
+        """
+        for account_id in self.account_ids:
+            for attempt in range(1, attempts + 1):
+                response: orders_service.OrdersResponse = self.fp_provider.call_function(self.fp_provider.orders_stub.GetOrders, orders_service.OrdersRequest(account_id=account_id))
+                if response is not None:  # Если заявки получены
+                    break
+                if attempt < attempts:
+                    self.logger.warning('Заявки счета %s не получены (попытка %s из %s)', account_id, attempt, attempts)
+                    sleep(delay * 2 ** (attempt - 1))
+            else:  # Если заявки так и не получены
+                raise ConnectionError(f'Группы OCO и следящие заявки счета {account_id} не восстановлены: GetOrders не получен за {attempts} попыток')
+            for order_state in response.orders:  # Сделки по группам, пропущенные во время перезапуска, снимают остальные заявки групп
+                self.track(order_state)
+        self.logger.debug('Восстановлено групп OCO %s, следящих заявок %s', len(self.groups), len(self.trailing))
+
+    @staticmethod
+    def executed(order_state: orders_service.OrderState) -> bool:
+        """Были ли сделки по заявке"""
+        return bool(order_state.executed_quantity.value) and Decimal(order_state.executed_quantity.value) > 0
+
+    def trigger(self, group_id, order_id) -> None:
+        """Сделка по заявке группы: снятие остальных заявок группы"""
+        with self.lock:
+            order_id = self.executed_order(group_id) or order_id  # Исполнившейся считаем первую заявку со сделкой
+            if group_id in self.groups:  # Если в группе есть активные заявки
+                self.triggered[group_id] = order_id
+            else:  # Группа уже завершена или заявка в нее еще не добавлена
+                self.finish_group(group_id, order_id)
+        self.actions.put((self.cancel_siblings, (group_id, order_id)))
+
+    def executed_order(self, group_id) -> Optional[str]:
+        """Номер исполнившейся заявки группы или None, если сделок по группе не было"""
+        with self.lock:
+            return self.triggered.get(group_id) or self.finished.get(group_id)
+
+    def finish_group(self, group_id, order_id=None) -> None:
+        """Завершение группы: исполнившаяся заявка хранится среди последних завершенных групп, чтобы снимать заявки группы, ответ на выставление которых придет позже
+
+        :param str group_id: Номер группы OCO
+        :param str order_id: Номер исполнившейся заявки. None - из активной группы
+        """
+        with self.lock:
+            order_id = self.triggered.pop(group_id, None) or order_id
+            if order_id is None:  # Если сделок по группе не было
+                return
+            self.finished[group_id] = order_id
+            while len(self.finished) > 1000:  # Храним только последние
+                self.finished.pop(next(iter(self.finished)))
+
+    def remember_execution(self, order_id) -> None:
+        """Сделка по заявке, которая еще не отслеживается (пришла раньше ответа на выставление)"""
+        with self.lock:
+            self.executions[order_id] = None
+            while len(self.executions) > 1000:  # Храним только последние
+                self.executions.pop(next(iter(self.executions)))
+
+    # События
+
+    def on_order(self, order_state: orders_service.OrderState) -> None:
+        """Изменение заявки"""
+        order_id = order_state.order_id
+        executed = self.executed(order_state)  # По заявке были сделки
+        with self.lock:
+            tracked = order_id in self.order_groups or order_id in self.trailing  # Заявка отслеживается
+        if not tracked:  # Если заявка не отслеживается
+            if executed and self.parse_comment(order_state.order.comment) is not None:  # Заявка менеджера, ответ на выставление которой еще не пришел
+                self.remember_execution(order_id)
+            return
+        if order_state.status in FinamPy.final_order_statuses:  # Если заявка завершена
+            group_id = self.untrack(order_id)
+            if group_id is not None and executed:  # Если по заявке группы были сделки, а подписки на сделки нет
+                self.trigger(group_id, order_id)
+            return
+        with self.lock:
+            group_id = self.order_groups.get(order_id)
+            if group_id is not None:
+                self.groups[group_id][order_id] = order_state
+            if order_id in self.trailing:
+                self.trailing[order_id].order_state = order_state
+        if group_id is not None and executed:  # Частичное исполнение
+            self.trigger(group_id, order_id)
+
+    def on_trade(self, trade: AccountTrade) -> None:
+        """Сделка по заявке"""
+        with self.lock:
+            group_id = self.order_groups.get(trade.order_id)
+            trailing = trade.order_id in self.trailing
+        if group_id is not None:  # Если заявка входит в группу
+            self.trigger(group_id, trade.order_id)  # то снимаем остальные заявки группы
+        elif not trailing:  # Заявка может быть еще не отслеживаемой
+            self.remember_execution(trade.order_id)
+
+    def on_quote(self, event: marketdata_service.SubscribeQuoteResponse) -> None:
+        """Котировки по инструментам следящих заявок"""
+        for quote in event.quote:
+            if not quote.last.value:  # Если последней цены в котировке нет
+                continue
+            last = Decimal(quote.last.value)  # Последняя цена
+            with self.lock:
+                for order_id in self.trailing_symbols.get(quote.symbol, ()):
+                    trailing_stop = self.trailing[order_id]
+                    if trailing_stop.moving:  # Если заявка уже переставляется
+                        continue
+                    stop_price = self.trail_price(trailing_stop, last)
+                    if stop_price is not None:
+                        trailing_stop.moving = True
+                        self.actions.put((self.move_stop, (order_id, stop_price)))
+
+    def trail_price(self, trailing_stop: TrailingStop, last) -> Optional[Decimal]:
+        """Новая стоп цена следящей заявки по последней цене. None - переставлять не нужно"""
+        order = trailing_stop.order_state.order
+        si = self.fp_provider.get_symbol_info(*order.symbol.rsplit('@', 1))  # Спецификация инструмента
+        tick = Decimal(si.min_step).scaleb(-si.decimals) if si is not None and si.min_step else None  # Шаг цены
+        sell = order.side != SIDE_BUY  # Стоп на продажу защищает длинную позицию и идет за ценой вверх
+        stop_price = last - trailing_stop.distance if sell else last + trailing_stop.distance
+        if tick is not None:  # Стоп цену округляем по шагу цены в сторону от последней цены
+            stop_price = (stop_price / tick).to_integral_value(ROUND_FLOOR if sell else ROUND_CEILING) * tick
+        move = stop_price - trailing_stop.stop_price if sell else trailing_stop.stop_price - stop_price  # Изменение стоп цены в сторону прибыли
+        if move <= 0 or move < trailing_stop.step:
+            return None
+        return stop_price
+
+    # Действия. Выполняются в потоке действий
+
+    def cancel_siblings(self, group_id, order_id) -> None:
+        """Снятие остальных заявок группы после сделки по заявке order_id"""
+        with self.lock:
+            siblings = [state for sibling_id, state in self.groups.get(group_id, {}).items() if sibling_id != order_id]
+        by_account: dict[str, list[str]] = {}
+        for state in siblings:
+            by_account.setdefault(state.order.account_id, []).append(state.order_id)
+        for account_id, order_ids in by_account.items():
+            self.logger.info('Сделка по заявке %s группы OCO %s. Снятие заявок %s', order_id, group_id, order_ids)
+            for outcome in self.fp_provider.cancel_orders(account_id, order_ids):
+                if outcome.error is None:
+                    self.untrack(outcome.order_id)
+
+    def move_stop(self, order_id, stop_price) -> None:
+        """Переставление следящей стоп заявки"""
+        with self.lock:
+            trailing_stop = self.trailing.get(order_id)
+        if trailing_stop is None:  # Если заявка уже завершилась
+            return
+        old = trailing_stop.order_state.order
+        order = orders_service.Order()
+        order.CopyFrom(old)
+        order.client_order_id = self.fp_provider.new_client_order_id()  # Новый клиентский номер, по которому заявку можно найти, если ответ не пришел
+        order.stop_price.value = str(stop_price)
+        if old.type == orders_service.ORDER_TYPE_STOP_LIMIT and old.limit_price.value:  # Лимитную цену сдвигаем вместе со стоп ценой
+            order.limit_price.value = str(Decimal(old.limit_price.value) + stop_price - trailing_stop.stop_price)
+        outcome = self.fp_provider.replace_order(old.account_id, order_id, order, mode=self.replace_mode)
+        if outcome.place is not None and outcome.place.order_state is not None:  # Если новая заявка выставлена
+            if outcome.cancel is None or outcome.cancel.error is not None:  # а старая не снята
+                self.logger.warning('Следящая заявка %s не снята при переставлении на %s: %s', order_id, stop_price,
+                                    'не снималась' if outcome.cancel is None else outcome.cancel.error)
+            self.untrack(order_id)
+            self.track(outcome.place.order_state)
+            self.logger.debug('Следящая заявка %s переставлена на %s: %s', order_id, stop_price, outcome.place.order_id)
+        elif outcome.cancel is not None and outcome.cancel.error is None and outcome.cancel.order_state.status in FinamPy.final_order_statuses:  # Старая заявка снята или исполнена, новая не выставлена
+            self.untrack(order_id)
+            if outcome.place is not None:  # Если старая заявка снята, а новая не выставлена, то позиция без стоп заявки
+                self.logger.warning('Следящая заявка %s снята, но не переставлена на %s: %s', order_id, stop_price, outcome.place.error)
+                self.place_lost_stop(order_id, order, trailing_stop.stop_price)
+            else:  # Старая заявка исполнилась. Переставлять нечего
+                self.logger.debug('Следящая заявка %s исполнилась при переставлении на %s', order_id, stop_price)
+        else:  # Ничего не изменилось. Попробуем на следующей котировке
+            with self.lock:
+                trailing_stop.moving = False
+
+    def place_lost_stop(self, order_id, order: orders_service.Order, old_stop_price) -> None:
+        """Повторное выставление следящей заявки, снятой при переставлении. Сначала по новой стоп цене, затем по прежней
+
+        :param str order_id: Номер снятой заявки
+        :param order: Новая заявка, которую не удалось выставить
+        :param Decimal old_stop_price: Стоп цена снятой заявки
+        """
+        rejected = (orders_service.ORDER_STATUS_REJECTED, orders_service.ORDER_STATUS_FAILED,
+                    orders_service.ORDER_STATUS_DENIED_BY_BROKER, orders_service.ORDER_STATUS_REJECTED_BY_EXCHANGE)  # Заявка не принята
+        try:
+            order_state = self.fp_provider.find_order(order.account_id, order.client_order_id, attempts=3)  # Заявка могла дойти до сервера без ответа
+            new_stop_price = Decimal(order.stop_price.value)
+            for stop_price in (new_stop_price, old_stop_price):
+                if order_state is not None and order_state.status not in rejected:  # Если заявка принята
+                    break
+                retry = orders_service.Order()
+                retry.CopyFrom(order)
+                retry.client_order_id = self.fp_provider.new_client_order_id()
+                retry.stop_price.value = str(stop_price)
+                if retry.type == orders_service.ORDER_TYPE_STOP_LIMIT and retry.limit_price.value:  # Лимитную цену сдвигаем вместе со стоп ценой
+                    retry.limit_price.value = str(Decimal(order.limit_price.value) + stop_price - new_stop_price)
+                order_state = self.fp_provider.place_order_idempotent(retry)
+        except ConnectionError as ex:  # Выставлена ли заявка, неизвестно. Повтор может выставить ее дважды
+            self.logger.error('Следящая заявка %s снята, состояние новой заявки неизвестно: %s', order_id, ex)
+            self.on_stop_lost.trigger(order_id, order)
+            return
+        if order_state is None or order_state.status in rejected:
+            self.logger.error('Следящая заявка %s снята и не выставлена заново. Позиция без стоп заявки', order_id)
+            self.on_stop_lost.trigger(order_id, order)
+            return
+        self.track(order_state)
+        self.logger.warning('Следящая заявка %s выставлена заново по %s: %s', order_id, order_state.order.stop_price.value, order_state.order_id)
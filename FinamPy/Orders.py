@@ -0,0 +1,160 @@
+import logging  # Будем вести лог
+from threading import RLock  # Заявки обновляются из разных потоков подписок
+from typing import Optional
+
+from FinamPy.FinamPy import FinamPy, Event  # Статусы завершенных заявок, событие изменения заявки
+from FinamPy.grpc import orders_service_pb2 as orders_service  # Заявки
+from FinamPy.grpc.trade_pb2 import AccountTrade  # Свои сделки
+
+
+class OrderCache:
+    """Свои заявки и сделки в памяти. Заполняется из GetOrders, обновляется подписками SubscribeOrders / SubscribeTrades (или SubscribeOrderTrade)
+
+    Поиск заявки по номеру и по клиентскому номеру, активные заявки, сделки и остаток заявки - без запросов к серверу.
+    При каждом подключении потока подписки на заявки, в том числе первом, пропущенные изменения загружаются из GetOrders, а по пропавшим из него активным заявкам - из GetOrder.
+    Так не теряются изменения между начальной загрузкой и подключением потока.
+    Заявка из GetOrders не заменяет более новое изменение, пришедшее по подписке после запроса: сравниваются время последней транзакции и исполненное кол-во
+    """
+    logger = logging.getLogger('FinamPy.Orders')  # Будем вести лог
+    final_statuses = FinamPy.final_order_statuses  # Статусы завершенных заявок. Остальные заявки активные
+    order_streams = ('SubscribeOrders', 'SubscribeOrderTrade')  # Потоки подписок, после подключения которых нужна сверка
+
+    def __init__(self, fp_provider, account_ids=None):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param list[str] account_ids: Номера счетов. По умолчанию, все счета провайдера
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.account_ids = list(fp_provider.account_ids if account_ids is None else account_ids)  # Номера счетов
+        self.orders: dict[str, orders_service.OrderState] = {}  # Заявки по номеру
+        self.client_order_ids: dict[str, str] = {}  # Номер заявки по клиентскому номеру
+        self.active: dict[str, orders_service.OrderState] = {}  # Активные заявки по номеру
+        self.fills: dict[str, list[AccountTrade]] = {}  # Сделки по номеру заявки
+        self.filled: dict[str, float] = {}  # Исполненное кол-во по сделкам по номеру заявки
+        self.trade_ids: set[str] = set()  # Номера полученных сделок, чтобы не учитывать сделку дважды
+        self.lock = RLock()  # Блокировка изменения заявок
+        self.on_update = Event()  # Изменение заявки (OrderState)
+        self.on_fill = Event()  # Сделка по заявке (AccountTrade)
+
+    def start(self) -> 'OrderCache':
+        """Загрузка заявок и начало обновления по событиям провайдера. Потоки подписок запускаются отдельно"""
+        self.fp_provider.on_order.subscribe(self.update)
+        self.fp_provider.on_trade.subscribe(self.add_trade)
+        self.fp_provider.on_stream_connected.subscribe(self.on_stream_connected)
+        self.reconcile()
+        return self
+
+    def stop(self) -> None:
+        """Остановка обновления"""
+        self.fp_provider.on_order.unsubscribe(self.update)
+        self.fp_provider.on_trade.unsubscribe(self.add_trade)
+        self.fp_provider.on_stream_connected.unsubscribe(self.on_stream_connected)
+
+    def on_stream_connected(self, name, reconnect) -> None:
+        """Сверка заявок после подключения потока подписки на заявки. Изменения до подключения поток не присылает"""
+        if name.split(':')[0] in self.order_streams:
+            self.reconcile()
+
+    def reconcile(self) -> None:
+        """Сверка заявок с сервером: загрузка GetOrders, уточнение активных заявок, которых в нем нет, через GetOrder"""
+        for account_id in self.account_ids:
+            response: orders_service.OrdersResponse = self.fp_provider.call_function(self.fp_provider.orders_stub.GetOrders, orders_service.OrdersRequest(account_id=account_id))
+            if response is None:  # Если заявки не получены
+                continue  # то переходим к следующему счету
+            received = set()  # Номера полученных заявок
+            for order_state in response.orders:
+                self.update(order_state, snapshot=True)
+                received.add(order_state.order_id)
+            with self.lock:
+                missing = [order_id for order_id, order_state in self.active.items() if order_state.order.account_id == account_id and order_id not in received]
+            for order_id in missing:  # Активные заявки, которых нет на сервере, могли завершиться, пока поток был отключен
+                order_state = self.fp_provider.call_function(self.fp_provider.orders_stub.GetOrder, orders_service.GetOrderRequest(account_id=account_id, order_id=order_id))
+                if order_state is not None:
+                    self.update(order_state, snapshot=True)
+        self.logger.debug('Сверка заявок: всего %s, активных %s', len(self.orders), len(self.active))
+
+    def update(self, order_state: orders_service.OrderState, snapshot=False) -> None:
+        """Изменение заявки
+
+        :param order_state: Заявка
+        :param bool snapshot: Заявка из GetOrders / GetOrder. Пропускается, если в кэше более новое изменение из подписки
+        """
+        order_id = order_state.order_id
+        with self.lock:
+            current = self.orders.get(order_id)
+            if current is not None and current.status in self.final_statuses and order_state.status not in self.final_statuses:  # Если пришло устаревшее изменение завершенной заявки
+                return  # то его пропускаем
+            if snapshot and current is not None and current.status not in self.final_statuses and self.is_older(order_state, current):  # Если запрос устарел, пока выполнялся
+                return  # то изменение из подписки не заменяем
+            self.orders[order_id] = order_state
+            if order_state.order.client_order_id:
+                self.client_order_ids[order_state.order.client_order_id] = order_id
+            if order_state.status in self.final_statuses:
+                self.active.pop(order_id, None)
+            else:
+                self.active[order_id] = order_state
+        self.on_update.trigger(order_state)
+
+    @staticmethod
+    def is_older(order_state: orders_service.OrderState, current: orders_service.OrderState) -> bool:
+        """Старее ли заявка, чем текущая: по времени последней транзакции, а при равном времени - по исполненному кол-ву"""
+        def updated_at(state):  # Время последнего изменения заявки
+            return max((state.transact_at.seconds, state.transact_at.nanos), (state.withdraw_at.seconds, state.withdraw_at.nanos))
+
+        time, current_time = updated_at(order_state), updated_at(current)
+        if time != current_time:
+            return time < current_time
+        return float(order_state.executed_quantity.value or 0) < float(current.executed_quantity.value or 0)
+
+    def add_trade(self, trade: AccountTrade) -> None:
+        """Сделка по заявке"""
+        with self.lock:
+            if trade.trade_id in self.trade_ids:  # Если сделка уже получена (из другой подписки или повторно)
+                return  # то ее не учитываем
+            self.trade_ids.add(trade.trade_id)
+            self.fills.setdefault(trade.order_id, []).append(trade)
+            self.filled[trade.order_id] = self.filled.get(trade.order_id, 0.0) + float(trade.size.value)
+        self.on_fill.trigger(trade)
+
+    def get(self, order_id) -> Optional[orders_service.OrderState]:
+        """Заявка по номеру"""
+        return self.orders.get(order_id)
+
+    def get_by_client_order_id(self, client_order_id) -> Optional[orders_service.OrderState]:
+        """Заявка по клиентскому номеру"""
+        order_id = self.client_order_ids.get(client_order_id)
+        return None if order_id is None else self.orders.get(order_id)
+
+    def is_active(self, order_id) -> bool:
+        """Активна ли заявка"""
+        return order_id in self.active
+
+    def get_active(self, account_id=None, symbol=None) -> list[orders_service.OrderState]:
+        """Активные заявки, с отбором по счету и инструменту"""
+        with self.lock:
+            orders = list(self.active.values())
+        return [o for o in orders if (account_id is None or o.order.account_id == account_id) and (symbol is None or o.order.symbol == symbol)]
+
+    def get_fills(self, order_id) -> list[AccountTrade]:
+        """Сделки по заявке"""
+        return list(self.fills.get(order_id, ()))
+
+    def filled_quantity(self, order_id) -> float:
+        """Исполненное кол-во по сделкам. Если сделок нет, то по заявке"""
+        filled = self.filled.get(order_id)
+        if filled is not None:
+            return filled
+        order_state = self.orders.get(order_id)
+        return 0.0 if order_state is None or not order_state.executed_quantity.value else float(order_state.executed_quantity.value)
+
+    def remaining_quantity(self, order_id) -> Optional[float]:
+        """Неисполненный остаток заявки. None - заявка не найдена"""
+        order_state = self.orders.get(order_id)
+        if order_state is None:
+            return None
+        if order_state.status in self.final_statuses:  # У завершенной заявки остатка нет
+            return 0.0
+        if order_state.remaining_quantity.value:
+            return float(order_state.remaining_quantity.value)
+        return float(order_state.order.quantity.value or 0) - self.filled_quantity(order_id)
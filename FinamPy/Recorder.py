@@ -0,0 +1,185 @@
+from functools import partial  # Запись стакана с символом подписки
+from struct import Struct  # Заголовки записей
+from threading import Lock  # События пишутся из разных потоков подписок
+from time import time_ns, sleep, perf_counter_ns  # Время получения события, соблюдение интервалов при воспроизведении
+from typing import Iterator
+
+from FinamPy.FinamPy import FinamPy, Event  # Вызов событий котировок, события воспроизведения
+from FinamPy.grpc import marketdata_service_pb2 as marketdata_service  # Рыночные данные
+
+
+class Recorder:
+    """Запись событий подписок на котировки, стаканы, обезличенные сделки и бары в двоичный файл
+
+    Формат файла: заголовок magic, затем записи подряд. Запись: заголовок record (вид события, временной интервал, время получения в наносекундах UTC, длина)
+    и событие protobuf длиной length. Записи только добавляются в конец файла, поэтому запись можно продолжать в существующий файл.
+    Стакан пишется с символом подписки (длина символа, символ UTF-8, событие), т.к. пустой стакан символа не содержит.
+    Подписка на стаканы ведется по символу каждого потока подписки SubscribeOrderBook
+    """
+    magic = b'FPRC\x01'  # Заголовок файла: сигнатура и версия формата
+    record = Struct('<BBqI')  # Заголовок записи: вид события, временной интервал Финама для баров, время получения в наносекундах, длина события
+    quote, order_book, latest_trades, bar, symbol_order_book = 1, 2, 3, 4, 5  # Виды событий. order_book - стакан без символа подписки из ранних записей
+    message_types = {quote: marketdata_service.SubscribeQuoteResponse,
+                     order_book: marketdata_service.SubscribeOrderBookResponse,
+                     latest_trades: marketdata_service.SubscribeLatestTradesResponse,
+                     bar: marketdata_service.SubscribeBarsResponse,
+                     symbol_order_book: marketdata_service.SubscribeOrderBookResponse}  # Тип события protobuf по виду события
+
+    def __init__(self, fp_provider, filename, buffering=1024 * 1024):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам, события подписок которого записываются
+        :param str filename: Файл записи
+        :param int buffering: Размер буфера записи в байтах
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.filename = filename  # Файл записи
+        self.buffering = buffering  # Размер буфера записи
+        self.lock = Lock()  # Блокировка записи из разных потоков подписок
+        self.file = None  # Файл записи. None - запись не ведется
+        self.records = 0  # Кол-во записанных событий
+        self.order_book_callbacks = {}  # Запись стаканов по символу подписки
+
+    def start(self) -> 'Recorder':
+        """Начать запись"""
+        self.file = open(self.filename, 'ab', buffering=self.buffering)  # Дописываем в конец файла
+        if self.file.tell() == 0:  # Если файл новый
+            self.file.write(self.magic)  # то пишем заголовок
+        self.fp_provider.on_quote.subscribe(self.on_quote)
+        self.fp_provider.on_stream_connected.subscribe(self.on_stream_connected)
+        for name in list(self.fp_provider.streams):  # Потоки подписки на стаканы, подключенные до начала записи
+            self.on_stream_connected(name, False)
+        self.fp_provider.on_latest_trades.subscribe(self.on_latest_trades)
+        self.fp_provider.on_new_bar.subscribe(self.on_new_bar)
+        return self
+
+    def stop(self) -> None:
+        """Остановить запись"""
+        self.fp_provider.on_quote.unsubscribe(self.on_quote)
+        self.fp_provider.on_stream_connected.unsubscribe(self.on_stream_connected)
+        for symbol, callback in self.order_book_callbacks.items():
+            self.fp_provider.on_order_book.unsubscribe(callback, key=symbol)
+        self.order_book_callbacks.clear()
+        self.fp_provider.on_latest_trades.unsubscribe(self.on_latest_trades)
+        self.fp_provider.on_new_bar.unsubscribe(self.on_new_bar)
+        with self.lock:
+            if self.file is not None:
+                self.file.close()  # Буфер записывается в файл при закрытии
+                self.file = None
+
+    def write(self, kind, event, timeframe=0, symbol=None) -> None:
+        """Запись события
+
+        :param int kind: Вид события
+        :param event: Событие protobuf
+        :param int timeframe: Временной интервал Финама для баров
+        :param str symbol: Символ подписки для стаканов
+        """
+        receive_time = time_ns()  # Время получения события
+        payload = event.SerializeToString()  # Событие сериализуем вне блокировки
+        if symbol is not None:  # Если пишем символ подписки
+            symbol = symbol.encode('utf-8')
+            payload = bytes((len(symbol),)) + symbol + payload  # то перед событием
+        with self.lock:
+            if self.file is None:  # Если запись уже остановлена
+                return  # то событие не пишем
+            self.file.write(self.record.pack(kind, timeframe, receive_time, len(payload)))
+            self.file.write(payload)
+            self.records += 1
+
+    def flush(self) -> None:
+        """Сбросить буфер записи в файл"""
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def on_quote(self, event) -> None:
+        self.write(self.quote, event)
+
+    def on_stream_connected(self, name, reconnect) -> None:
+        """Подключение потока подписки. Стаканы записываются с символом подписки, по которому их вызывает поток"""
+        stream, _, symbol = name.partition(':')
+        if stream != 'SubscribeOrderBook' or symbol in self.order_book_callbacks:
+            return
+        callback = self.order_book_callbacks[symbol] = partial(self.on_order_book, symbol)
+        self.fp_provider.on_order_book.subscribe(callback, key=symbol)
+
+    def on_order_book(self, symbol, event) -> None:
+        self.write(self.symbol_order_book, event, symbol=symbol)
+
+    def on_latest_trades(self, event) -> None:
+        self.write(self.latest_trades, event)
+
+    def on_new_bar(self, event, finam_timeframe) -> None:
+        self.write(self.bar, event, finam_timeframe)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class Replayer:
+    """Воспроизведение записанных Recorder событий через события on_quote, on_order_book, on_latest_trades, on_new_bar"""
+    def __init__(self, filename, fp_provider=None):
+        """Инициализация
+
+        :param str filename: Файл записи
+        :param FinamPy fp_provider: Провайдер Финам, через события которого воспроизводятся записи. None - через собственные события
+        """
+        self.filename = filename  # Файл записи
+        self.on_quote = Event() if fp_provider is None else fp_provider.on_quote  # Котировка по инструменту
+        self.on_order_book = Event() if fp_provider is None else fp_provider.on_order_book  # Стакан по инструменту
+        self.on_latest_trades = Event() if fp_provider is None else fp_provider.on_latest_trades  # Обезличенные сделки по инструменту
+        self.on_new_bar = Event() if fp_provider is None else fp_provider.on_new_bar  # Свечи по инструменту и временнОму интервалу
+
+    def read(self) -> Iterator[tuple[int, int, int, object, str]]:
+        """Чтение записей
+
+        :return: Вид события, временной интервал Финама для баров, время получения в наносекундах, событие protobuf, символ подписки стакана ('' - не записан)
+        """
+        record = Recorder.record  # Заголовок записи
+        message_types = Recorder.message_types  # Тип события по виду
+        with open(self.filename, 'rb') as f:
+            if f.read(len(Recorder.magic)) != Recorder.magic:  # Если заголовок файла не совпадает
+                raise ValueError(f'Файл {self.filename} не является записью событий FinamPy')
+            while True:
+                header = f.read(record.size)
+                if len(header) < record.size:  # Если дошли до конца файла или запись не дописана
+                    return  # то выходим
+                kind, timeframe, receive_time, length = record.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:  # Если событие не дописано (запись прервана)
+                    return  # то выходим
+                symbol = ''  # Символ подписки стакана
+                if kind == Recorder.symbol_order_book:  # Стакан с символом подписки
+                    symbol, payload = payload[1:1 + payload[0]].decode('utf-8'), payload[1 + payload[0]:]
+                    kind = Recorder.order_book
+                yield kind, timeframe, receive_time, message_types[kind].FromString(payload), symbol
+
+    def replay(self, speed=None) -> int:
+        """Воспроизведение записей
+
+        :param float speed: Скорость воспроизведения относительно записи: 1 - с исходными интервалами между событиями, 10 - в 10 раз быстрее. None - максимально быстро
+        :return: Кол-во воспроизведенных событий
+        """
+        triggers = {Recorder.quote: lambda e, _: FinamPy.trigger_quote(self.on_quote, e),
+                    Recorder.order_book: lambda e, symbol: self.on_order_book.trigger_keyed(symbol or (e.order_book[0].symbol if e.order_book else ''), e),  # По символу подписки. В ранних записях - по символу стакана
+                    Recorder.latest_trades: lambda e, _: self.on_latest_trades.trigger_keyed(e.symbol, e)}  # Вызов события по виду, как в потоках подписок
+        replayed = 0  # Кол-во воспроизведенных событий
+        first_time = start = None  # Время получения первого события, время начала воспроизведения
+        for kind, timeframe, receive_time, event, symbol in self.read():
+            if speed is not None:  # Если воспроизводим с интервалами
+                if first_time is None:  # Если это первое событие
+                    first_time, start = receive_time, perf_counter_ns()  # то от него отсчитываем интервалы
+                else:  # Для следующих событий
+                    wait = (receive_time - first_time) / speed - (perf_counter_ns() - start)  # Сколько наносекунд осталось до события
+                    if wait > 0:
+                        sleep(wait / 1e9)
+            if kind == Recorder.bar:  # Бары вызываются с временнЫм интервалом
+                self.on_new_bar.trigger_keyed((event.symbol, timeframe), event, timeframe)
+            else:
+                triggers[kind](event, symbol)
+            replayed += 1
+        return replayed
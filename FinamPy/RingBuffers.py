@@ -0,0 +1,151 @@
+import numpy as np  # Буферы фиксированного размера. pip install FinamPy[numpy]
+
+from FinamPy.History import bar_dtype  # Бар: время открытия в секундах UTC, цены и объем Финама
+from FinamPy.grpc import marketdata_service_pb2 as marketdata_service  # Рыночные данные
+
+
+trade_dtype = np.dtype([('timestamp', 'f8'), ('price', 'f8'), ('size', 'f8'), ('side', 'i1')])  # Обезличенная сделка: время в секундах UTC, цена, размер, сторона Финама
+quote_dtype = np.dtype([('timestamp', 'f8'), ('bid', 'f8'), ('bid_size', 'f8'), ('ask', 'f8'), ('ask_size', 'f8'), ('last', 'f8'), ('last_size', 'f8')])  # Котировка
+
+
+class RingBuffer:
+    """Кольцевой буфер фиксированного размера с окнами без копирования
+
+    Каждое значение пишется дважды: в позицию i и i + capacity. Поэтому последние n значений всегда лежат в памяти подряд,
+    и window(n) возвращает представление массива NumPy без копирования. Представление действительно до следующих capacity - n записей
+    """
+    def __init__(self, dtype, capacity):
+        """Инициализация
+
+        :param np.dtype dtype: Тип значения
+        :param int capacity: Кол-во хранимых значений
+        """
+        self.capacity = capacity  # Кол-во хранимых значений
+        self.data = np.zeros(2 * capacity, dtype=dtype)  # Память выделяется один раз
+        self.index = 0  # Позиция следующей записи от 0 до capacity - 1
+        self.count = 0  # Кол-во записанных значений, не больше capacity
+
+    def append(self, value) -> None:
+        """Добавить значение
+
+        :param tuple value: Значение в порядке полей типа
+        """
+        self.data[self.index] = value
+        self.data[self.index + self.capacity] = value
+        self.index += 1
+        if self.index == self.capacity:
+            self.index = 0
+        if self.count < self.capacity:
+            self.count += 1
+
+    def replace_last(self, value) -> None:
+        """Заменить последнее значение, например, формирующийся бар"""
+        if self.count == 0:  # Если значений еще нет
+            self.append(value)  # то добавляем
+            return
+        last = self.index - 1 if self.index else self.capacity - 1
+        self.data[last] = value
+        self.data[last + self.capacity] = value
+
+    def window(self, n=None) -> np.ndarray:
+        """Последние n значений от старых к новым без копирования
+
+        :param int n: Кол-во значений. None - все хранимые значения
+        """
+        n = self.count if n is None else min(n, self.count)
+        end = self.index + self.capacity  # Позиция после последнего значения во второй половине
+        return self.data[end - n:end]
+
+    def last(self):
+        """Последнее значение или None, если значений нет"""
+        return self.data[self.index + self.capacity - 1] if self.count else None
+
+    def __len__(self):
+        return self.count
+
+
+class MarketBuffers:
+    """Последние сделки, котировки и бары по инструментам в кольцевых буферах, которые заполняются событиями подписок провайдера"""
+    def __init__(self, fp_provider, trades=10000, quotes=10000, bars=5000):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param int trades: Кол-во хранимых сделок по инструменту
+        :param int quotes: Кол-во хранимых котировок по инструменту
+        :param int bars: Кол-во хранимых бар по инструменту и временнОму интервалу
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.trades_capacity, self.quotes_capacity, self.bars_capacity = trades, quotes, bars  # Размеры буферов
+        self.trades: dict[str, RingBuffer] = {}  # Сделки по символу инструмента
+        self.quotes: dict[str, RingBuffer] = {}  # Котировки по символу инструмента
+        self.bars: dict[tuple[str, int], RingBuffer] = {}  # Бары по символу инструмента и временнОму интервалу Финама
+
+    def start(self) -> 'MarketBuffers':
+        """Начать заполнение буферов. Потоки подписок запускаются отдельно"""
+        self.fp_provider.on_latest_trades.subscribe(self.on_latest_trades)
+        self.fp_provider.on_quote.subscribe(self.on_quote)
+        self.fp_provider.on_new_bar.subscribe(self.on_new_bar)
+        return self
+
+    def stop(self) -> None:
+        """Остановить заполнение буферов"""
+        self.fp_provider.on_latest_trades.unsubscribe(self.on_latest_trades)
+        self.fp_provider.on_quote.unsubscribe(self.on_quote)
+        self.fp_provider.on_new_bar.unsubscribe(self.on_new_bar)
+
+    def get_trades(self, symbol, n=None) -> np.ndarray:
+        """Последние n сделок инструмента (trade_dtype) без копирования"""
+        buffer = self.trades.get(symbol)
+        return np.empty(0, dtype=trade_dtype) if buffer is None else buffer.window(n)
+
+    def get_quotes(self, symbol, n=None) -> np.ndarray:
+        """Последние n котировок инструмента (quote_dtype) без копирования"""
+        buffer = self.quotes.get(symbol)
+        return np.empty(0, dtype=quote_dtype) if buffer is None else buffer.window(n)
+
+    def get_bars(self, symbol, finam_timeframe, n=None) -> np.ndarray:
+        """Последние n бар инструмента (bar_dtype) без копирования. Последний бар может быть формирующимся"""
+        buffer = self.bars.get((symbol, finam_timeframe))
+        return np.empty(0, dtype=bar_dtype) if buffer is None else buffer.window(n)
+
+    def on_latest_trades(self, event: marketdata_service.SubscribeLatestTradesResponse) -> None:
+        """Обработчик события обезличенных сделок"""
+        buffer = self.trades.get(event.symbol)
+        if buffer is None:  # Если сделки по инструменту пришли впервые
+            buffer = self.trades[event.symbol] = RingBuffer(trade_dtype, self.trades_capacity)
+        for trade in event.trades:
+            buffer.append((trade.timestamp.seconds + trade.timestamp.nanos / 1e9, float(trade.price.value), float(trade.size.value), trade.side))
+
+    def on_quote(self, event: marketdata_service.SubscribeQuoteResponse) -> None:
+        """Обработчик события котировок"""
+        for quote in event.quote:
+            buffer = self.quotes.get(quote.symbol)
+            if buffer is None:  # Если котировка по инструменту пришла впервые
+                buffer = self.quotes[quote.symbol] = RingBuffer(quote_dtype, self.quotes_capacity)
+            last = buffer.last()  # Незаполненные поля котировки берем из предыдущей
+            buffer.append((quote.timestamp.seconds + quote.timestamp.nanos / 1e9,
+                           self.value(quote.bid, last, 'bid'), self.value(quote.bid_size, last, 'bid_size'),
+                           self.value(quote.ask, last, 'ask'), self.value(quote.ask_size, last, 'ask_size'),
+                           self.value(quote.last, last, 'last'), self.value(quote.last_size, last, 'last_size')))
+
+    def on_new_bar(self, event: marketdata_service.SubscribeBarsResponse, finam_timeframe) -> None:
+        """Обработчик события баров. Формирующийся бар заменяется, новый добавляется"""
+        key = (event.symbol, finam_timeframe)
+        buffer = self.bars.get(key)
+        if buffer is None:  # Если бары по инструменту и временнОму интервалу пришли впервые
+            buffer = self.bars[key] = RingBuffer(bar_dtype, self.bars_capacity)
+        for bar in event.bars:
+            last = buffer.last()
+            value = (bar.timestamp.seconds, float(bar.open.value), float(bar.high.value), float(bar.low.value), float(bar.close.value), float(bar.volume.value))
+            if last is None or bar.timestamp.seconds > last['timestamp']:  # Если бар новый
+                buffer.append(value)
+            elif bar.timestamp.seconds == last['timestamp']:  # Если бар формирующийся
+                buffer.replace_last(value)
+            # Бары старше последнего пропускаем
+
+    @staticmethod
+    def value(decimal, last, name) -> float:
+        """Значение поля котировки. Если поле не заполнено, то значение из предыдущей котировки или NaN"""
+        if decimal.value:
+            return float(decimal.value)
+        return float('nan') if last is None else last[name]
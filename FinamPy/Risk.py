@@ -0,0 +1,170 @@
+import logging  # Будем вести лог
+from decimal import Decimal, InvalidOperation  # Точная проверка кол-ва и цены
+from typing import Optional
+
+from FinamPy.Accounts import AccountCache  # Типы инструментов, стоимость которых - цена, умноженная на кол-во
+from FinamPy.grpc import marketdata_service_pb2 as marketdata_service  # Котировки
+from FinamPy.grpc import orders_service_pb2 as orders_service  # Заявки
+from FinamPy.grpc.side_pb2 import SIDE_BUY  # Направление заявки
+
+
+class RiskGate:
+    """Проверка заявки перед отправкой на сервер: кол-во кратно лоту, цена по шагу цены, ограничения на заявку и позицию
+
+    Спецификации инструментов берутся из справочника провайдера get_symbol_info, позиции - из AccountCache, активные заявки - из OrderCache.
+    Запросов к серверу при проверке нет, если спецификации инструментов загружены заранее preload. Заявка, не прошедшая проверку, на сервер не отправляется.
+    Стоимость считается по цене заявки, а для рыночной - по последней цене из подписки на котировки или из позиции. Если стоимость нужно проверить,
+    а цена не известна, то заявка отклоняется. Ограничения на стоимость проверяются только для акций и фондов, где стоимость - цена, умноженная на кол-во.
+    Для фьючерсов (стоимость пункта цены), облигаций (% от номинала) и остальных инструментов используйте ограничения на кол-во и позицию
+    """
+    logger = logging.getLogger('FinamPy.Risk')  # Будем вести лог
+    value_types = AccountCache.cash_types  # Типы инструментов, для которых проверяются ограничения на стоимость
+    limit_names = ('max_quantity', 'max_notional', 'max_position', 'max_position_notional')  # Названия ограничений
+
+    def __init__(self, fp_provider, account_cache=None, order_cache=None, max_quantity=None, max_notional=None, max_position=None, max_position_notional=None):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param AccountCache account_cache: Позиции по счетам. None - ограничения на позицию не проверяются
+        :param OrderCache order_cache: Активные заявки. Если задан, то к позиции добавляются остатки активных заявок в ту же сторону
+        :param float max_quantity: Максимальное кол-во в заявке в штуках
+        :param float max_notional: Максимальная стоимость заявки. Только для акций и фондов
+        :param float max_position: Максимальная позиция в штуках по модулю после исполнения заявки
+        :param float max_position_notional: Максимальная стоимость позиции по модулю после исполнения заявки. Только для акций и фондов
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.account_cache = account_cache  # Позиции по счетам
+        self.order_cache = order_cache  # Активные заявки
+        self.limits: dict[Optional[str], dict[str, Optional[float]]] = {None: {
+            'max_quantity': max_quantity, 'max_notional': max_notional, 'max_position': max_position, 'max_position_notional': max_position_notional}}  # Ограничения по символу инструмента. None - для всех инструментов
+        self.rejects: dict[str, int] = {}  # Кол-во отклоненных заявок по причине
+        self.last_prices: dict[str, float] = {}  # Последняя цена из подписки на котировки по символу инструмента
+
+    def start(self) -> 'RiskGate':
+        """Начало проверки заявок провайдера и получения последних цен из подписки на котировки. Потоки подписок запускаются отдельно"""
+        self.fp_provider.risk_gate = self
+        self.fp_provider.on_quote.subscribe(self.on_quote)
+        return self
+
+    def stop(self) -> None:
+        """Окончание проверки заявок провайдера"""
+        self.fp_provider.risk_gate = None
+        self.fp_provider.on_quote.unsubscribe(self.on_quote)
+
+    def on_quote(self, event: marketdata_service.SubscribeQuoteResponse) -> None:
+        """Последние цены из подписки на котировки"""
+        for quote in event.quote:
+            if quote.last.value:  # Если в котировке есть последняя цена
+                self.last_prices[quote.symbol] = float(quote.last.value)
+
+    def set_limits(self, symbol, **limits) -> None:
+        """Ограничения для инструмента. Заменяют общие ограничения
+
+        :param str symbol: Символ инструмента тикер@биржа
+        :param limits: max_quantity, max_notional, max_position, max_position_notional. None - без ограничения
+        """
+        for name in limits:
+            if name not in self.limit_names:
+                raise ValueError(f'Неизвестное ограничение {name}')
+        self.limits.setdefault(symbol, {}).update(limits)
+
+    def get_limit(self, symbol, name) -> Optional[float]:
+        """Ограничение для инструмента. Если для инструмента не задано, то общее"""
+        symbol_limits = self.limits.get(symbol)
+        if symbol_limits is not None and name in symbol_limits:
+            return symbol_limits[name]
+        return self.limits[None][name]
+
+    def preload(self, symbols) -> list[str]:
+        """Загрузка спецификаций инструментов заранее, чтобы при проверке заявок не было запросов к серверу
+
+        :param list[str] symbols: Символы инструментов тикер@биржа
+        :return: Символы инструментов, спецификации которых не найдены
+        """
+        return [symbol for symbol in symbols if self.get_symbol_info(symbol) is None]
+
+    def get_symbol_info(self, symbol):
+        """Спецификация инструмента по символу тикер@биржа из справочника провайдера"""
+        ticker, _, mic = symbol.rpartition('@')
+        return self.fp_provider.get_symbol_info(ticker, mic)
+
+    def check(self, order: orders_service.Order) -> Optional[str]:
+        """Проверка заявки
+
+        :param order: Заявка
+        :return: Причина отказа. None - заявка прошла проверку
+        """
+        reason = self._check(order)
+        if reason is not None:
+            kind = reason.split(':', 1)[0]  # Причина без подробностей
+            self.rejects[kind] = self.rejects.get(kind, 0) + 1
+        return reason
+
+    def _check(self, order: orders_service.Order) -> Optional[str]:
+        si = self.get_symbol_info(order.symbol)  # Спецификация инструмента
+        if si is None:
+            return f'Инструмент не найден: {order.symbol}'
+        try:
+            quantity = Decimal(order.quantity.value or '0')  # Кол-во в штуках
+            limit_price = Decimal(order.limit_price.value) if order.limit_price.value else None
+            stop_price = Decimal(order.stop_price.value) if order.stop_price.value else None
+        except InvalidOperation:
+            return 'Неверный формат: кол-во или цена не число'
+        if quantity <= 0:
+            return f'Неверное кол-во: {quantity}'
+        if si.board == 'FUT':  # Для фьючерсов кол-во в контрактах
+            if quantity != quantity.to_integral_value():
+                return f'Неверное кол-во: {quantity} не целое кол-во контрактов'
+        else:  # Для остальных инструментов кол-во кратно лоту
+            lot_size = Decimal(si.lot_size.value) if si.lot_size.value else Decimal(1)  # Лот в штуках
+            if lot_size > 0 and quantity % lot_size != 0:
+                return f'Неверное кол-во: {quantity} не кратно лоту {lot_size}'
+        for price in (limit_price, stop_price):
+            if price is None:
+                continue
+            if price <= 0:
+                return f'Неверная цена: {price}'
+            steps = price.scaleb(si.decimals)  # Цена в единицах последнего десятичного знака
+            if steps != steps.to_integral_value() or (si.min_step > 0 and int(steps) % si.min_step != 0):
+                return f'Неверная цена: {price} не кратна шагу цены {Decimal(si.min_step).scaleb(-si.decimals)}'
+        symbol = order.symbol
+        size = float(quantity)
+        max_quantity = self.get_limit(symbol, 'max_quantity')
+        if max_quantity is not None and size > max_quantity:
+            return f'Превышено кол-во в заявке: {size} > {max_quantity}'
+        max_notional = self.get_limit(symbol, 'max_notional')
+        max_position = self.get_limit(symbol, 'max_position') if self.account_cache is not None else None  # Ограничения на позицию проверяем, если позиции известны
+        max_position_notional = self.get_limit(symbol, 'max_position_notional') if self.account_cache is not None else None
+        notional = si.type in self.value_types and (max_notional is not None or max_position_notional is not None)  # Проверяем ли стоимость
+        price = 0.0  # Цена для оценки стоимости
+        if notional:
+            price = float(limit_price if limit_price is not None else stop_price if stop_price is not None else 0) or self.last_price(order)
+            if not price:  # Если стоимость не оценить
+                return f'Цена не известна: {symbol}. Нет котировки и позиции для проверки стоимости'
+        if max_notional is not None and notional and size * price > max_notional:
+            return f'Превышена стоимость заявки: {size * price:.2f} > {max_notional}'
+        if max_position is None and (max_position_notional is None or not notional):  # Если ограничений на позицию нет
+            return None
+        signed = size if order.side == SIDE_BUY else -size  # Изменение позиции со знаком
+        position = self.account_cache.get_position(order.account_id, symbol) + signed  # Позиция после исполнения заявки
+        if self.order_cache is not None:  # Если известны активные заявки
+            for order_state in self.order_cache.get_active(order.account_id, symbol):
+                if order_state.order.side == order.side:  # Заявки в ту же сторону увеличивают позицию
+                    remaining = self.order_cache.remaining_quantity(order_state.order_id) or 0.0
+                    position += remaining if order.side == SIDE_BUY else -remaining
+        if max_position is not None and abs(position) > max_position:
+            return f'Превышена позиция: {abs(position)} > {max_position}'
+        if max_position_notional is not None and notional and abs(position) * price > max_position_notional:
+            return f'Превышена стоимость позиции: {abs(position) * price:.2f} > {max_position_notional}'
+        return None
+
+    def last_price(self, order: orders_service.Order) -> float:
+        """Текущая цена для рыночной заявки из подписки на котировки или из позиции по инструменту. 0 - не известна"""
+        last_price = self.last_prices.get(order.symbol)
+        if last_price:
+            return last_price
+        if self.account_cache is None:
+            return 0.0
+        state = self.account_cache.get_account(order.account_id)
+        position = None if state is None else state.positions.get(order.symbol)
+        return 0.0 if position is None else position.current_price
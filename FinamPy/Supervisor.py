@@ -0,0 +1,119 @@
+import logging  # Будем вести лог
+from threading import Thread, Event as ThreadingEvent  # Потоки подписок, остановка
+from typing import Optional
+
+
+class SupervisedThread:
+    """Поток подписки под наблюдением"""
+    def __init__(self, target, args, name):
+        self.target = target  # Функция подписки провайдера, например, subscribe_quote_thread
+        self.args = args  # Параметры функции подписки
+        self.name = name  # Название потока
+        self.thread: Optional[Thread] = None  # Поток
+        self.restarts = 0  # Кол-во перезапусков потока
+
+
+class Supervisor:
+    """Наблюдение за потоками подписок: запуск, перезапуск завершившихся с ошибкой, состояние потоков
+
+    Ошибки в обработчиках событий перехватываются в потоке подписки провайдера, записываются в лог и считаются, поток при этом продолжает работу.
+    Если поток все же завершился (непредвиденная ошибка), а канал не закрыт, то Supervisor запускает его снова
+    """
+    logger = logging.getLogger('FinamPy.Supervisor')  # Будем вести лог
+
+    def __init__(self, fp_provider, interval=5):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param float interval: Период проверки потоков в секундах
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.interval = interval  # Период проверки потоков
+        self.threads: list[SupervisedThread] = []  # Потоки подписок
+        self._stop = ThreadingEvent()  # Остановка наблюдения
+        self._monitor: Optional[Thread] = None  # Поток наблюдения
+
+    def subscribe(self, target, *args, name=None) -> SupervisedThread:
+        """Запуск потока подписки под наблюдением
+
+        :param target: Функция подписки провайдера, например, fp_provider.subscribe_quote_thread
+        :param args: Параметры функции подписки
+        :param str name: Название потока. По умолчанию, название функции
+        """
+        supervised = SupervisedThread(target, args, name or target.__name__)
+        self._start_thread(supervised)
+        self.threads.append(supervised)
+        if self._monitor is None:  # Если наблюдение еще не запущено
+            self.start()  # то запускаем его
+        return supervised
+
+    def _start_thread(self, supervised) -> None:
+        """Запуск потока"""
+        supervised.thread = Thread(target=supervised.target, args=supervised.args, name=supervised.name, daemon=True)
+        supervised.thread.start()
+
+    def start(self) -> 'Supervisor':
+        """Запуск наблюдения"""
+        self._stop.clear()
+        self._monitor = Thread(target=self._run, name='SupervisorThread', daemon=True)
+        self._monitor.start()
+        return self
+
+    def stop(self) -> None:
+        """Остановка наблюдения. Потоки подписок завершаются при закрытии канала провайдера"""
+        self._stop.set()
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+
+    def _run(self) -> None:
+        """Поток наблюдения"""
+        while not self._stop.wait(self.interval):  # Пока не остановили, ждем следующую проверку
+            self.check()
+
+    def check(self) -> int:
+        """Перезапуск завершившихся потоков подписок
+
+        :return: Кол-во перезапущенных потоков
+        """
+        if self.fp_provider.channel is None:  # Если канал закрыт
+            return 0  # то потоки завершились штатно
+        restarted = 0  # Кол-во перезапущенных потоков
+        for supervised in self.threads:
+            if supervised.thread.is_alive():  # Если поток работает
+                continue  # то переходим к следующему
+            handle = self.get_handle(supervised)
+            if handle is not None and handle.state == 'stopped':  # Если поток остановлен штатно (закрыт или отменен вызов)
+                continue  # то его не перезапускаем
+            self.logger.warning('Перезапуск потока подписки %s', supervised.name if handle is None else handle.name)
+            supervised.restarts += 1
+            self._start_thread(supervised)
+            restarted += 1
+        return restarted
+
+    def get_handle(self, supervised):
+        """Состояние потока подписки провайдера для потока под наблюдением. None - поток еще не начал подписку"""
+        for handle in list(self.fp_provider.streams.values()):
+            if handle.thread is supervised.thread:
+                return handle
+        return None
+
+    def health(self) -> list[dict]:
+        """Состояние всех потоков подписок под наблюдением"""
+        result = []
+        for supervised in self.threads:
+            handle = self.get_handle(supervised)
+            result.append({'name': supervised.name if handle is None else handle.name,
+                           'alive': supervised.thread.is_alive(),
+                           'state': 'starting' if handle is None else handle.state,
+                           'last_message_age': None if handle is None else handle.last_message_age(),
+                           'messages': 0 if handle is None else handle.messages,
+                           'reconnects': 0 if handle is None else handle.reconnects,
+                           'restarts': supervised.restarts,
+                           'callback_errors': 0 if handle is None else handle.callback_errors,
+                           'last_error': None if handle is None else handle.last_error})
+        return result
+
+    def healthy(self) -> bool:
+        """Все потоки подписок работают и получают события"""
+        return all(stream['alive'] and stream['state'] == 'streaming' for stream in self.health())
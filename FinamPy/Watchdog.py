@@ -0,0 +1,107 @@
+import logging  # Будем вести лог
+from threading import Thread, Event as ThreadingEvent  # Поток проверки, остановка
+from time import time  # Текущее время
+from typing import Optional
+
+from FinamPy.grpc import assets_service_pb2 as assets_service  # Расписание торгов
+
+
+class Watchdog:
+    """Переподключение потоков подписок на рыночные данные, от которых нет событий во время торгов
+
+    Поток gRPC может оставаться подключенным, но не получать событий (полуоткрытое соединение TCP). Watchdog проверяет,
+    сколько секунд нет событий по каждому потоку. Если инструмент торгуется по расписанию AssetsService.Schedule, а событий нет дольше заданного,
+    то вызов отменяется, и поток подписки подключается снова. Потоки своих заявок и сделок не проверяются, т.к. события по ним приходят не всегда
+    """
+    logger = logging.getLogger('FinamPy.Watchdog')  # Будем вести лог
+    default_max_silence = {'SubscribeQuote': 30, 'SubscribeOrderBook': 30, 'SubscribeLatestTrades': 60, 'SubscribeBars': 120}  # Максимальное время без событий в секундах по виду подписки
+    schedule_ttl = 60 * 60  # Время жизни расписания торгов в секундах
+
+    def __init__(self, fp_provider, max_silence=None, interval=5):
+        """Инициализация
+
+        :param FinamPy fp_provider: Провайдер Финам
+        :param dict max_silence: Максимальное время без событий в секундах по виду подписки (SubscribeQuote, SubscribeOrderBook, SubscribeLatestTrades, SubscribeBars)
+        :param float interval: Период проверки в секундах
+        """
+        self.fp_provider = fp_provider  # Провайдер Финам
+        self.max_silence = {**self.default_max_silence, **(max_silence or {})}  # Максимальное время без событий по виду подписки
+        self.interval = interval  # Период проверки
+        self.schedules: dict[str, tuple[float, list[tuple[int, int]]]] = {}  # Время загрузки и торговые сессии (начало, окончание) по символу
+        self.resubscribes: dict[str, int] = {}  # Кол-во переподключений по потоку подписки
+        self._stop = ThreadingEvent()  # Остановка проверок
+        self._thread: Optional[Thread] = None  # Поток проверок
+
+    def start(self) -> 'Watchdog':
+        """Запуск проверок"""
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='WatchdogThread', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Остановка проверок"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        """Поток проверок"""
+        while not self._stop.wait(self.interval):  # Пока не остановили, ждем следующую проверку
+            if self.fp_provider.channel is None:  # Если канал закрыт
+                break  # то проверять больше нечего
+            self.check()
+
+    @staticmethod
+    def parse_stream(name) -> tuple[str, list[str]]:
+        """Вид подписки и символы инструментов из названия потока подписки
+
+        :param str name: Название потока подписки, например, SubscribeQuote:SBER@MISX,GAZP@MISX или SubscribeBars:SBER@MISX:TIME_FRAME_M1
+        """
+        parts = name.split(':')
+        kind = parts[0]
+        if len(parts) < 2 or kind not in Watchdog.default_max_silence:  # Потоки своих заявок и сделок
+            return kind, []
+        return kind, parts[1].split(',')
+
+    def check(self) -> list[str]:
+        """Проверка потоков подписок
+
+        :return: Названия переподключенных потоков
+        """
+        now = time()
+        resubscribed = []
+        for name, handle in list(self.fp_provider.streams.items()):
+            if handle.call is None or handle.state not in ('connecting', 'streaming'):  # Если поток не подключен
+                continue  # то его не проверяем
+            kind, symbols = self.parse_stream(name)
+            max_silence = self.max_silence.get(kind)
+            if not symbols or max_silence is None:  # Если поток не проверяется
+                continue
+            silence = handle.silence()  # Сколько секунд нет событий
+            if silence <= max_silence:  # Если события были недавно
+                continue
+            if not any(self.is_trading(symbol, now) for symbol in symbols):  # Если ни один инструмент сейчас не торгуется
+                continue  # то событий может и не быть
+            self.logger.warning('Нет событий %.0f с по потоку подписки %s во время торгов. Переподключение', silence, name)
+            if self.fp_provider.resubscribe(name):
+                self.resubscribes[name] = self.resubscribes.get(name, 0) + 1
+                resubscribed.append(name)
+        return resubscribed
+
+    def is_trading(self, symbol, now) -> bool:
+        """Торгуется ли инструмент по расписанию. Если расписание не получено, то считаем, что торгуется
+
+        :param str symbol: Символ инструмента тикер@биржа
+        :param float now: Время в секундах, прошедших с 01.01.1970 00:00 UTC
+        """
+        loaded, sessions = self.schedules.get(symbol, (0.0, []))
+        if now - loaded > self.schedule_ttl or (sessions and now >= sessions[-1][1]):  # Если расписание устарело или все сессии в нем прошли
+            schedule: assets_service.ScheduleResponse = self.fp_provider.call_function(self.fp_provider.assets_stub.Schedule, assets_service.ScheduleRequest(symbol=symbol))
+            if schedule is None:  # Если расписание не получено
+                return True
+            sessions = sorted((session.interval.start_time.seconds, session.interval.end_time.seconds)
+                              for session in schedule.sessions if 'CLOSED' not in session.type.upper())  # Торговые сессии
+            self.schedules[symbol] = (now, sessions)
+        return any(start <= now < end for start, end in sessions)
@@ -1 +1,12 @@
-from .FinamPy import FinamPy
+from .FinamPy import FinamPy, ChannelProfile
+from .Metrics import Metrics, MetricsRegistry
+from .ClockSync import ClockSync
+from .Recorder import Recorder, Replayer
+from .Bars import TickBarAggregator, BarBuilder
+from .Supervisor import Supervisor
+from .Watchdog import Watchdog
+from .Orders import OrderCache
+from .Accounts import AccountCache
+from .Risk import RiskGate
+from .OrderLatency import OrderLatency
+from .OrderManager import OrderManager